@@ -0,0 +1,151 @@
+import re
+import sys
+import types
+
+import numpy as np
+
+# Stand-in for the parts of blenderproc and bpy the samplers and the scene analysis use, so their hot paths can be
+# timed without Blender. install() has to be called before any suturo_blenderproc module is imported.
+
+CUBE_FACES = np.array([[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]])
+CUBE_NORMALS = np.array([[-1, 0, 0], [1, 0, 0], [0, -1, 0], [0, 1, 0], [0, 0, -1], [0, 0, 1]], dtype=np.float64)
+
+
+def get_box_corners(box_min: np.ndarray, box_max: np.ndarray) -> np.ndarray:
+    """The 8 corners in the order of CUBE_FACES, x changes slowest and z fastest."""
+    grid = np.array(np.meshgrid([0, 1], [0, 1], [0, 1], indexing="ij")).reshape(3, -1).T
+    return np.where(grid == 0, box_min, box_max).astype(np.float64)
+
+
+class _Collection(object):
+    """Supports len and foreach_get like a bpy collection of mesh elements."""
+
+    def __init__(self, **attributes):
+        self.attributes = {k: np.asarray(v) for k, v in attributes.items()}
+
+    def __len__(self):
+        return len(next(iter(self.attributes.values())))
+
+    def foreach_get(self, attribute: str, out: np.ndarray):
+        out[:] = self.attributes[attribute].ravel()
+
+
+class Mesh(object):
+    def __init__(self, vertices: np.ndarray):
+        self.vertices = _Collection(co=vertices)
+        self.polygons = _Collection(normal=CUBE_NORMALS, loop_start=np.arange(0, 24, 4), loop_total=np.full(6, 4))
+        self.loops = _Collection(vertex_index=CUBE_FACES.ravel())
+
+
+class BlenderObject(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.hide_render = False
+
+    def keyframe_insert(self, data_path: str, frame: int = None):
+        pass
+
+
+class MeshObject(object):
+    """Axis aligned box with its origin in the center of its bottom face."""
+
+    def __init__(self, name: str, box_min, box_max):
+        box_min, box_max = np.asarray(box_min, dtype=np.float64), np.asarray(box_max, dtype=np.float64)
+        self.blender_obj = BlenderObject(name)
+        self.location = np.array([(box_min[0] + box_max[0]) / 2, (box_min[1] + box_max[1]) / 2, box_min[2]])
+        self.rotation = np.zeros(3)
+        self._local_corners = get_box_corners(box_min, box_max) - self.location
+
+    def get_name(self) -> str:
+        return self.blender_obj.name
+
+    def get_bound_box(self) -> np.ndarray:
+        return self._local_corners + self.location
+
+    def get_location(self) -> np.ndarray:
+        return self.location.copy()
+
+    def set_location(self, location, frame: int = None):
+        self.location = np.asarray(location, dtype=np.float64)
+
+    def get_rotation_euler(self) -> np.ndarray:
+        return self.rotation.copy()
+
+    def set_rotation_euler(self, rotation, frame: int = None):
+        self.rotation = np.asarray(rotation, dtype=np.float64)
+
+    def get_local2world_mat(self) -> np.ndarray:
+        matrix = np.eye(4)
+        matrix[:3, 3] = self.location
+        return matrix
+
+    def get_mesh(self) -> Mesh:
+        return Mesh(self._local_corners)
+
+
+class Light(object):
+    def __init__(self):
+        self.location = np.zeros(3)
+        self.energy = 0.0
+        self.color = [1, 1, 1]
+
+    def set_location(self, location):
+        self.location = np.asarray(location)
+
+    def set_energy(self, energy: float):
+        self.energy = energy
+
+    def set_color(self, color):
+        self.color = color
+
+
+camera_poses = []
+
+
+def add_camera_pose(cam2world_matrix: np.ndarray, frame: int = None):
+    camera_poses.append(cam2world_matrix)
+
+
+def rotation_from_forward_vec(forward_vec: np.ndarray, up_axis: str = 'Y', inplane_rot: float = None) -> np.ndarray:
+    """Camera looks along -z with y up, as bproc.camera.rotation_from_forward_vec."""
+    z = -np.asarray(forward_vec, dtype=np.float64)
+    z /= np.linalg.norm(z)
+    x = np.cross([0.0, 0.0, 1.0], z)
+    x = x / np.linalg.norm(x) if np.linalg.norm(x) > 1e-9 else np.array([1.0, 0.0, 0.0])
+    rotation = np.column_stack([x, np.cross(z, x), z])
+    if inplane_rot:
+        c, s = np.cos(inplane_rot), np.sin(inplane_rot)
+        rotation = rotation @ np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    return rotation
+
+
+def build_transformation_mat(translation, rotation) -> np.ndarray:
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = translation
+    return matrix
+
+
+def by_attr(elements: list, attr_name: str, value, regex: bool = False) -> list:
+    if regex:
+        return [e for e in elements if re.fullmatch(value, getattr(e.blender_obj, attr_name))]
+    return [e for e in elements if getattr(e.blender_obj, attr_name) == value]
+
+
+def install():
+    """Registers the stand-ins as the blenderproc and bpy modules."""
+    bproc = types.ModuleType("blenderproc")
+    bproc.types = types.SimpleNamespace(MeshObject=MeshObject, Light=Light)
+    bproc.camera = types.SimpleNamespace(add_camera_pose=add_camera_pose,
+                                         rotation_from_forward_vec=rotation_from_forward_vec,
+                                         set_resolution=lambda width, height: None)
+    bproc.math = types.SimpleNamespace(build_transformation_mat=build_transformation_mat)
+    bproc.filter = types.SimpleNamespace(by_attr=by_attr)
+    bproc.utility = types.SimpleNamespace(reset_keyframes=camera_poses.clear)
+    bproc.init = lambda: None
+    sys.modules["blenderproc"] = bproc
+
+    bpy = types.ModuleType("bpy")
+    bpy.context = types.SimpleNamespace(scene=types.SimpleNamespace(
+        objects=[], render=types.SimpleNamespace(resolution_x=640, resolution_y=480)))
+    sys.modules["bpy"] = bpy
@@ -0,0 +1,65 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from suturo_blenderproc.sampler.weighted_sampler import sample_less_probable_partitions, unique_class_indices
+
+
+def legacy_less_probable_partitions(object_names: np.ndarray, num_partitions: int, partition_size: int,
+                                    reduction_factor: float) -> np.ndarray:
+    # The previous O(n^2) implementation of PartitionType.LESS_PROBABLE_OBJECTS, kept as reference
+    indices = np.arange(len(object_names))
+    num_objects = len(object_names)
+    partitions = np.empty(shape=[num_partitions, partition_size], dtype=np.int64)
+    for i in range(num_partitions):
+        probabilities = np.repeat(a=1 / num_objects, repeats=num_objects)
+        for j in range(partition_size):
+            selected_idx = np.random.choice(np.arange(num_objects), size=1, p=probabilities)[0]
+            partitions[i, j] = indices[selected_idx]
+            probabilities[object_names == object_names[selected_idx]] *= reduction_factor
+            object_names = np.delete(object_names, selected_idx)
+            probabilities = np.delete(probabilities, selected_idx)
+            indices = np.delete(indices, selected_idx)
+            probabilities /= np.sum(probabilities)
+            num_objects -= 1
+    return partitions
+
+
+def synthetic_object_names(num_objects: int, num_classes: int) -> np.ndarray:
+    classes = np.array([f"Class{c}" for c in range(num_classes)])
+    return classes[np.random.randint(num_classes, size=num_objects)]
+
+
+def time_call(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(sizes: [int], num_partitions: int, num_classes: int, legacy_limit: int):
+    print(f"{'objects':>8} | {'less_probable [s]':>17} | {'legacy [s]':>10} | {'unique [s]':>10}")
+    for size in sizes:
+        names = synthetic_object_names(size, num_classes)
+        partition_size = size // num_partitions
+        engine = time_call(sample_less_probable_partitions, names, num_partitions, partition_size, 0.1)
+        legacy = float("nan")
+        if size <= legacy_limit:
+            legacy = time_call(legacy_less_probable_partitions, names, num_partitions, partition_size, 0.1)
+        unique = time_call(lambda: [unique_class_indices(p) for p in np.split(names[:partition_size * num_partitions],
+                                                                              num_partitions)])
+        print(f"{size:>8} | {engine:>17.4f} | {legacy:>10.4f} | {unique:>10.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the object partitioning engine.')
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--num_partitions", type=int, default=3)
+    parser.add_argument("--num_classes", type=int, default=90)
+    parser.add_argument("--legacy_limit", type=int, default=10000,
+                        help="Largest pool size for which the quadratic reference implementation is timed")
+    args = parser.parse_args()
+    run(args.sizes, args.num_partitions, args.num_classes, args.legacy_limit)
@@ -0,0 +1,177 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from benchmarks import fake_blenderproc
+
+fake_blenderproc.install()
+
+from benchmarks.partition_benchmark import legacy_less_probable_partitions
+from benchmarks.synthetic_scene import SyntheticConfig, build_synthetic_scene, get_class_names
+from suturo_blenderproc.scene_index import SceneIndex
+from suturo_blenderproc.scene_init import SceneInitializer
+from suturo_blenderproc.sampler.object_partitions import ObjectPartition, PartitionType
+from suturo_blenderproc.sampler.pose_sampler import CameraPoseSampler
+from suturo_blenderproc.sampler.placement import BatchPlacementSampler, get_object_footprints
+from suturo_blenderproc.sampler.line_of_sight import LineOfSightFilter
+
+RESULTS_DIR = Path(__file__).resolve().parent.joinpath("results")
+
+
+def measure(func, min_time: float = 0.5, max_repeats: int = 20) -> float:
+    """Best time of func over repeated calls, repeats until min_time is spent or max_repeats calls are done."""
+    best, total, repeats = np.inf, 0.0, 0
+    while repeats < max_repeats and (repeats == 0 or total < min_time):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best, total, repeats = min(best, elapsed), total + elapsed, repeats + 1
+    return best
+
+
+class BenchmarkScene(object):
+    """A synthetic scene of one size and the samplers built on it, shared by all benchmarks of that size."""
+
+    def __init__(self, num_objects: int, num_classes: int, seed: int):
+        self.num_objects = num_objects
+        self.seed = seed
+        self.objects = build_synthetic_scene(num_objects, num_classes, seed)
+        self.config = SyntheticConfig(get_class_names(num_classes))
+        self.scene_initializer = SceneInitializer(self.config, use_geometry_cache=False, selective_loading=False)
+        self.scene_initializer.mesh_objects = self.objects
+        self.annotatable = self.scene_initializer.get_objects2annotate()
+        self.walls = self.scene_initializer.get_walls()[0]
+        self.surfaces = self.scene_initializer.get_surface_set()
+        self.line_of_sight = LineOfSightFilter.from_objects(self.scene_initializer.get_furnitures())
+
+    def rng(self) -> np.random.Generator:
+        return np.random.default_rng(self.seed)
+
+
+def bench_partitions(scene: BenchmarkScene, legacy_limit: int) -> list:
+    results = []
+    for partition_type in PartitionType:
+        seconds = measure(lambda: ObjectPartition(3, scene.annotatable, scene.rng()).create_partition(partition_type))
+        results.append((f"partition/{partition_type.name.lower()}", seconds, len(scene.annotatable), "objects"))
+    if len(scene.annotatable) <= legacy_limit:
+        names = np.asarray([o.get_name().split('.')[0] for o in scene.annotatable])
+        size = len(names) // 3
+        seconds = measure(lambda: legacy_less_probable_partitions(names, 3, size, 0.99), max_repeats=1)
+        results.append(("partition/legacy_less_probable_objects", seconds, len(names), "objects"))
+    return results
+
+
+def bench_classification(scene: BenchmarkScene) -> list:
+    def analyse():
+        # Removing nothing still drops the index and the geometry, so both are computed again
+        scene.scene_initializer.remove_objects([])
+        scene.scene_initializer.get_walls()
+        scene.scene_initializer.get_surface_set()
+
+    seconds = measure(lambda: SceneIndex(scene.config.get_objects()).build(scene.objects))
+    return [("classification/scene_index", seconds, scene.num_objects, "objects"),
+            ("classification/scene_analysis", measure(analyse), scene.num_objects, "objects")]
+
+
+def bench_camera_sampling(scene: BenchmarkScene, num_poses: int) -> list:
+    center = np.append(np.mean(scene.walls.bbox, axis=0)[:2], 0)
+    results = []
+    for name, line_of_sight in [("camera/circular_batched", None),
+                                ("camera/circular_line_of_sight", scene.line_of_sight)]:
+        def sample():
+            fake_blenderproc.camera_poses.clear()
+            sampler = CameraPoseSampler(scene.walls, scene.rng(), line_of_sight=line_of_sight)
+            sampler.get_sampled_circular_cam_poses_batched(num_poses, 1.0, center, 1.4, center + [0, 0, 0.8],
+                                                           max_radius=3.0)
+
+        results.append((name, measure(sample), num_poses, "poses"))
+
+    positions = scene.rng().uniform(np.min(scene.walls.bbox, axis=0), np.max(scene.walls.bbox, axis=0),
+                                    size=(num_poses, 3))
+    seconds = measure(lambda: scene.line_of_sight.visible_mask(positions, center + [0, 0, 0.8]))
+    results.append(("camera/line_of_sight_tests", seconds, num_poses * max(len(scene.line_of_sight), 1),
+                    "segment-boxes"))
+    return results
+
+
+def bench_placement(scene: BenchmarkScene, objects_per_surface: int, num_surfaces: int) -> list:
+    # Objects are placed on the first num_surfaces surfaces, every candidate is still tested against all surfaces
+    radii, _ = get_object_footprints(scene.annotatable)
+    num_surfaces = min(num_surfaces, len(scene.surfaces))
+    num = min(len(radii), num_surfaces * objects_per_surface)
+    surface_indices = np.arange(num) % num_surfaces
+    seconds = measure(lambda: BatchPlacementSampler(scene.surfaces, rng=scene.rng()).sample(radii[:num],
+                                                                                            surface_indices))
+    return [("placement/batch", seconds, num, "objects")]
+
+
+def run(sizes: [int], num_classes: int, seed: int, legacy_limit: int, num_poses: int, objects_per_surface: int,
+        num_surfaces: int) -> list:
+    results = []
+    for size in sizes:
+        scene = BenchmarkScene(size, num_classes, seed)
+        for name, seconds, items, unit in bench_partitions(scene, legacy_limit) + bench_classification(scene) + \
+                bench_camera_sampling(scene, num_poses) + bench_placement(scene, objects_per_surface, num_surfaces):
+            results.append({"name": name, "size": size, "seconds": seconds, "items": items, "unit": unit,
+                            "throughput": items / seconds if seconds > 0 else float("inf")})
+            print(f"{name:<40} {size:>8} {seconds:>10.5f} s {results[-1]['throughput']:>14.1f} {unit}/s")
+    return results
+
+
+def find_regressions(results: list, baseline: list, tolerance: float) -> list:
+    """Results whose throughput dropped by more than tolerance compared to the same benchmark in the baseline."""
+    previous = {(r["name"], r["size"]): r["throughput"] for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result["name"], result["size"])
+        if key in previous and result["throughput"] < previous[key] * (1 - tolerance):
+            regressions.append(dict(result, baseline_throughput=previous[key]))
+    return regressions
+
+
+def save_results(path: Path, results: list):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "numpy": np.__version__, "machine": platform.machine(), "results": results}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the samplers and the scene analysis without Blender.')
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--num_classes", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy_limit", type=int, default=1000,
+                        help="Largest pool size for which the quadratic reference partitioning is timed")
+    parser.add_argument("--num_poses", type=int, default=256, help="Camera poses sampled per call")
+    parser.add_argument("--objects_per_surface", type=int, default=8)
+    parser.add_argument("--placement_surfaces", type=int, default=16, help="Surfaces objects are placed on")
+    parser.add_argument("--output", default=str(RESULTS_DIR.joinpath("latest.json")))
+    parser.add_argument("--baseline", default=str(RESULTS_DIR.joinpath("baseline.json")),
+                        help="Earlier results the throughputs are compared against")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="Relative throughput drop that counts as regression")
+    parser.add_argument("--update_baseline", action="store_true", help="Store the results as new baseline")
+    args = parser.parse_args()
+
+    run_results = run(args.sizes, args.num_classes, args.seed, args.legacy_limit, args.num_poses,
+                      args.objects_per_surface, args.placement_surfaces)
+    save_results(Path(args.output), run_results)
+    if args.update_baseline:
+        save_results(Path(args.baseline), run_results)
+    elif Path(args.baseline).is_file():
+        with open(args.baseline, 'r') as stream:
+            found = find_regressions(run_results, json.load(stream)["results"], args.tolerance)
+        for regression in found:
+            print(f"Regression in {regression['name']} with {regression['size']} objects: "
+                  f"{regression['throughput']:.1f} instead of {regression['baseline_throughput']:.1f} "
+                  f"{regression['unit']}/s")
+        if found:
+            sys.exit(1)
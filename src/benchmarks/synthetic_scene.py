@@ -0,0 +1,54 @@
+import numpy as np
+
+from benchmarks.fake_blenderproc import MeshObject
+
+SURFACE_PREFIXES = ["TableSurface", "RoundTableSurface", "OvalTableSurface", "ShelfSHELFFLOOR"]
+
+
+class SyntheticConfig(object):
+    """The part of the YAMLConfig the SceneInitializer reads, for a synthetic scene."""
+
+    def __init__(self, classes: [str]):
+        self.classes = classes
+
+    def get_objects(self) -> [str]:
+        return self.classes
+
+
+def get_class_names(num_classes: int) -> [str]:
+    return [f"Class{c}" for c in range(num_classes)]
+
+
+def build_synthetic_scene(num_objects: int, num_classes: int = 90, seed: int = 0) -> list:
+    """
+    Fake MeshObjects named like a kitchen scene: a room, table surfaces of every type, shelf floors and furniture,
+    one percent each, the rest are small objects of num_classes classes. Surfaces and furniture lie on a grid
+    that grows with the scene, so their density stays the same.
+    """
+    rng = np.random.default_rng(seed)
+    num_surfaces = max(4, num_objects // 100)
+    num_furniture = max(4, num_objects // 100)
+    num_items = max(num_objects - num_surfaces - num_furniture - 1, 0)
+    side = int(np.ceil(np.sqrt(num_surfaces + num_furniture)))
+    room_size = max(10.0, side * 2.5)
+
+    objects = [MeshObject("KitchenRoom", [0, 0, 0], [room_size, room_size, 3.0])]
+    cells = rng.permutation(side * side)[:num_surfaces + num_furniture]
+    for k, cell in enumerate(cells):
+        center = 1.25 + 2.5 * np.array([cell % side, cell // side], dtype=np.float64)
+        size = rng.uniform(0.8, 1.6, size=2)
+        low, high = center - size / 2, center + size / 2
+        if k < num_surfaces:
+            name = f"{SURFACE_PREFIXES[k % len(SURFACE_PREFIXES)]}.{k:03d}"
+            height = 0.75 if k % len(SURFACE_PREFIXES) < 3 else rng.uniform(0.3, 1.8)
+            objects.append(MeshObject(name, [low[0], low[1], height - 0.03], [high[0], high[1], height]))
+        else:
+            objects.append(MeshObject(f"Furniture.{k:03d}", [low[0], low[1], 0.0], [high[0], high[1], 2.0]))
+
+    classes = get_class_names(num_classes)
+    sizes = rng.uniform(0.03, 0.12, size=(num_items, 3))
+    for i in range(num_items):
+        half_x, half_y, height = sizes[i, 0] / 2, sizes[i, 1] / 2, sizes[i, 2]
+        objects.append(MeshObject(f"{classes[i % num_classes]}.{i // num_classes:03d}", [-half_x, -half_y, 0],
+                                  [half_x, half_y, height]))
+    return objects
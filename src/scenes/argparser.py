@@ -5,6 +5,30 @@ def get_argparse():
     parser = argparse.ArgumentParser(description='A test program.')
     parser.add_argument("--config_yaml", help="Config file which should be located at /data/yaml")
     parser.add_argument("--output", help="Output directory of annotations and images")
+    parser.add_argument("--iterations", type=int, default=3, help="Number of object samplings that are rendered")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Run seed, every iteration draws from streams derived from (seed, iteration)")
+    parser.add_argument("--shard", type=int, default=0, help="Index of this worker when run by scenes/driver.py")
+    parser.add_argument("--start_iteration", type=int, default=0,
+                        help="First iteration to generate, e.g. to regenerate a single frame of an earlier run")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the run in --output, iterations recorded in its manifest are skipped")
+    parser.add_argument("--arrangements", type=int, default=1,
+                        help="Every iteration samples --objects times this many objects and spreads them over all "
+                             "surfaces, 0 chooses it by --memory_budget_mb")
+    parser.add_argument("--objects", type=int, default=2,
+                        help="Objects sampled per arrangement, objects no surface has room for are left out")
+    parser.add_argument("--cameras", type=int, default=2,
+                        help="Camera poses per object arrangement, the objects on one surface")
+    parser.add_argument("--memory_budget_mb", type=float, default=2048,
+                        help="Memory the rendered frames of one iteration may use when --arrangements is 0")
+    parser.add_argument("--max_pending_mb", type=float, default=1024,
+                        help="Render outputs that may wait for the background writer before rendering blocks")
+    parser.add_argument("--output_format", default="coco", choices=["coco", "shards"],
+                        help="COCO images with one hdf5 file per frame, or frames packed into <output>/frame_shards")
+    parser.add_argument("--frames_per_shard", type=int, default=1024, help="Frames per shard file with shards")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write per-stage timings and counters to <output>/profiling")
     args = parser.parse_args()
 
     return args
@@ -0,0 +1,90 @@
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+p = Path(__file__).resolve().parent.parent
+sys.path.append(str(p))
+from suturo_blenderproc.dataset.shard_merge import merge_coco_annotations, merge_hdf5_files
+
+
+def split_iterations(iterations: int, num_shards: int) -> [(int, int)]:
+    """Returns (first global iteration, number of iterations) for every shard."""
+    base, remainder = divmod(iterations, num_shards)
+    shards = []
+    start = 0
+    for shard in range(num_shards):
+        count = base + (1 if shard < remainder else 0)
+        if count > 0:
+            shards.append((start, count))
+        start += count
+    return shards
+
+
+def get_shard_dir(output_dir: Path, shard: int) -> Path:
+    return output_dir.joinpath("shards", f"shard_{shard:03d}")
+
+
+def launch_shards(args) -> [Path]:
+    # Workers run in the src dir, so paths passed to them have to be absolute
+    output_dir = Path(args.output).resolve()
+    script = Path(args.script).resolve()
+    processes = []
+    for shard, (start, count) in enumerate(split_iterations(args.iterations, args.num_shards)):
+        shard_dir = get_shard_dir(output_dir, shard)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        # All shards share the run seed and generate their global iterations, the random streams are derived from
+        # (seed, iteration), so the output doesn't depend on the number of shards
+        command = [args.blenderproc, "run", str(script), "--config_yaml", args.config_yaml,
+                   "--output", str(shard_dir), "--iterations", str(count), "--start_iteration", str(start),
+                   "--seed", str(args.seed), "--shard", str(shard)]
+        if args.resume:
+            command.append("--resume")
+        log = open(shard_dir.joinpath("worker.log"), 'a' if args.resume else 'w')
+        print(f"Shard {shard}: iterations {start}..{start + count - 1}")
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=str(p))
+        processes.append((shard, shard_dir, process, log))
+
+    shard_dirs = []
+    failed = []
+    for shard, shard_dir, process, log in processes:
+        if process.wait() != 0:
+            failed.append(shard)
+        log.close()
+        shard_dirs.append(shard_dir)
+
+    if failed:
+        raise Exception(f"Shards {failed} failed, see worker.log in their output directories")
+    return shard_dirs
+
+
+def merge_shards(shard_dirs: [Path], output_dir: Path):
+    merged = merge_coco_annotations([d.joinpath("coco_data") for d in shard_dirs], output_dir.joinpath("coco_data"))
+    num_hdf5 = merge_hdf5_files(shard_dirs, output_dir)
+    print(f"Merged {len(merged['images'])} images, {len(merged['annotations'])} annotations "
+          f"and {num_hdf5} hdf5 files into {output_dir}")
+
+
+def get_argparse():
+    parser = argparse.ArgumentParser(description='Runs the data generation sharded over several blenderproc workers.')
+    parser.add_argument("--config_yaml", required=True, help="Config file which should be located at /data/yaml")
+    parser.add_argument("--output", required=True, help="Output directory of the merged dataset")
+    parser.add_argument("--iterations", type=int, required=True, help="Total number of iterations over all shards")
+    parser.add_argument("--num_shards", type=int, default=1, help="Number of parallel blenderproc workers")
+    parser.add_argument("--seed", type=int, default=0, help="Run seed shared by all shards")
+    parser.add_argument("--script", default=str(Path(__file__).resolve().parent.joinpath("test", "main.py")),
+                        help="Pipeline script that is run by every worker")
+    parser.add_argument("--blenderproc", default="blenderproc", help="blenderproc executable")
+    parser.add_argument("--merge_only", action="store_true", help="Only merge the outputs of existing shards")
+    parser.add_argument("--resume", action="store_true", help="Resume the shards of an interrupted run")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_argparse()
+    output_dir = Path(args.output)
+    if args.merge_only:
+        shard_dirs = sorted(d for d in output_dir.joinpath("shards").iterdir() if d.is_dir())
+    else:
+        shard_dirs = launch_shards(args)
+    merge_shards(shard_dirs, output_dir)
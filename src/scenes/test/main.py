@@ -3,18 +3,33 @@ import blenderproc as bproc
 import sys
 from pathlib import Path
 
-p = Path.cwd()
-while p.stem != "src":
-    p = p.parent
-
-sys.path.append(str(p))
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 import scenes.argparser
-import utils.yaml_config
-import utils.path_utils
+from utils.project_context import get_project_context
 import suturo_blenderproc.scene_init
+from suturo_blenderproc.scene_index import get_class_pattern
 import suturo_blenderproc.sampler.pose_sampler
 from suturo_blenderproc.sampler.object_partitions import ObjectPartition, PartitionType
+from suturo_blenderproc.sampler.placement import BatchPlacementSampler
+from suturo_blenderproc.sampler.surface_scheduler import SurfaceScheduler
+from suturo_blenderproc.sampler.keyframe_batch import KeyframeBatch, choose_num_arrangements
+from suturo_blenderproc.sampler.iteration_sampler import IterationSampler
+from suturo_blenderproc.sampler.line_of_sight import LineOfSightFilter
+from suturo_blenderproc.sampler.pose_bank import CameraPoseBank
+from suturo_blenderproc.writer.streaming_coco import StreamingCocoWriter
+from suturo_blenderproc.writer.async_writer import AsyncWriter
+from suturo_blenderproc.writer.shard_format import ShardWriter, shard_to_coco
+from suturo_blenderproc.visibility import VisibilityManager
+from suturo_blenderproc.instrumentation import Instrumentation, get_instrumentation, set_instrumentation
+from suturo_blenderproc.sampler.rng import RandomStreams, RandomStream
+from suturo_blenderproc.writer.run_manifest import RunManifest
+from suturo_blenderproc.dataset.shard_merge import get_hdf5_files
+from suturo_blenderproc.dataset.yolo_converter import YoloConverter
+from suturo_blenderproc.dataset.merge import DatasetMerger
+from utils.file_utils import get_file_hash
 import os
+import json
+import functools
 
 import blenderproc.python.types.MeshObjectUtility
 import numpy as np
@@ -22,7 +37,7 @@ import numpy as np
 
 def init_objects(object_names: [], mesh_objects: []):
     mesh_objects = [m for m in mesh_objects if isinstance(m, blenderproc.types.MeshObject)]
-    return [bproc.filter.by_attr(mesh_objects, "name", f"{o}.*", regex=True) for o in object_names]
+    return [bproc.filter.by_attr(mesh_objects, "name", get_class_pattern(o), regex=True) for o in object_names]
 
 
 def hide_object(mesh_objects: [blenderproc.types.MeshObject]):
@@ -37,11 +52,6 @@ def hide_object(mesh_objects: [blenderproc.types.MeshObject]):
             mesh_object.blender_obj.hide_render = True
 
 
-def hide_render_objects(blender_objects, render):
-    for b_object in blender_objects:
-        b_object.blender_obj.hide_render = render
-
-
 def set_homogeneous_lighting(locations, strength: float):
     for location in locations:
         light = bproc.types.Light()
@@ -50,17 +60,75 @@ def set_homogeneous_lighting(locations, strength: float):
 
 
 args = scenes.argparser.get_argparse()
-config = utils.yaml_config.YAMLConfig(filename=args.config_yaml)
+# Paths and config are resolved and validated once, before anything is loaded
+context = get_project_context(args.config_yaml, args.output)
+output_dir = str(context.output_dir)
+if args.profile:
+    set_instrumentation(Instrumentation(enabled=True, output_dir=os.path.join(output_dir, "profiling")))
+instrumentation = get_instrumentation()
+manifest = RunManifest(output_dir, run_seed=args.seed, shard=args.shard, resume=args.resume)
+random_streams = RandomStreams(run_seed=manifest.run_seed, shard=manifest.shard)
+manifest.start(random_streams.run_seed)
+print(f"Run seed: {random_streams.run_seed}, shard: {random_streams.shard}")
+config = context.config
 scene_initializer = suturo_blenderproc.scene_init.SceneInitializer(yaml_config=config)
 scene_initializer.initialize_scene()
-tables = scene_initializer.get_shelf_floors()
 walls = scene_initializer.get_walls()
-camera_pose_sampler = suturo_blenderproc.sampler.pose_sampler.CameraPoseSampler(walls=walls[0])
-object_pose_sampler = suturo_blenderproc.sampler.pose_sampler.ObjectPoseSampler(surface=tables[0])
+furnitures = scene_initializer.get_furnitures()
+# The walls enclose every camera, they can't occlude anything and are left out
+line_of_sight = LineOfSightFilter.from_objects(furnitures)
+camera_pose_sampler = suturo_blenderproc.sampler.pose_sampler.CameraPoseSampler(walls=walls[0],
+                                                                                line_of_sight=line_of_sight)
+# Valid camera poses around every surface are computed once per scene and shared by all runs and workers
+scene_id = get_file_hash(context.blend_path)
+all_surfaces = scene_initializer.get_surface_set()
+room_z = np.min(walls[0].bbox[:, 2]), np.max(walls[0].bbox[:, 2])
+# Cameras circle around the center of every surface. A configured position_of_interest is the point they look at
+# on the surface it lies on, or the closest one, all other surfaces are looked at in their center
+configured_poi = config.position_of_interest
+poi_surface = None
+if configured_poi is not None and len(all_surfaces) > 0:
+    inside = np.flatnonzero(all_surfaces.contains_points(configured_poi)[0])
+    candidates = inside if len(inside) > 0 else np.arange(len(all_surfaces))
+    distances = np.linalg.norm(all_surfaces.centers[candidates, :2] - configured_poi[:2], axis=1)
+    poi_surface = int(candidates[np.argmin(distances)])
+    print(f"Cameras of surface {poi_surface} look at the configured position_of_interest {configured_poi}")
+pose_banks, usable = [], []
+for k, surface in enumerate(all_surfaces):
+    radius = max(surface.x_size, surface.y_size) / 2 + 0.6
+    poi = configured_poi if k == poi_surface else np.append(surface.center[:2], surface.height)
+    try:
+        bank = CameraPoseBank.get_or_build_circular(
+            context.pose_bank_dir, scene_id, camera_pose_sampler, num_poses=1024, radius=radius,
+            max_radius=radius + 0.6, center=surface.center, poi=poi,
+            height=float(np.clip(surface.height + 0.6, *room_z)))
+    except Exception as e:
+        print(f"No camera poses for surface {k}: {e}")
+        continue
+    if len(bank) > 0:
+        pose_banks.append(bank)
+        usable.append(k)
+if not usable:
+    raise Exception("None of the surfaces of the scene can be seen by the camera")
+surfaces = all_surfaces.subset(usable)
+print(f"Placing objects on {len(surfaces)} surfaces with {sum(len(b) for b in pose_banks)} banked camera poses")
+placement_sampler = BatchPlacementSampler(surfaces, min_distance=0.3, max_distance=0.7, max_tries=333)
+surface_scheduler = SurfaceScheduler(surfaces, min_distance=placement_sampler.min_distance)
 light_pose_sampler = suturo_blenderproc.sampler.pose_sampler.LightPoseSampler(walls=walls[0])
-furnitures = bproc.filter.by_attr(scene_initializer.get_all_mesh_objects(), "name", "Furniture.*", regex=True)
-
-partitions = ObjectPartition(num_partitions=3,objects=scene_initializer.get_objects2annotate(),)
+visibility = VisibilityManager(scene_initializer.get_all_mesh_objects())
+keyframe_batch = KeyframeBatch(placement_sampler, visibility)
+# The objects of an iteration are spread over all surfaces, in the worst case every one of them gets its own surface
+# and arrangement, the memory budget has to cover the frames of all of them
+num_arrangements = args.arrangements if args.arrangements > 0 else \
+    choose_num_arrangements(args.cameras * args.objects, args.memory_budget_mb)
+print(f"Spreading {args.objects * num_arrangements} objects per iteration over {len(surfaces)} surfaces with "
+      f"{args.cameras} camera poses per surface")
+iteration_sampler = IterationSampler(random_streams, keyframe_batch, surface_scheduler, light_pose_sampler, pose_banks,
+                                     line_of_sight, num_objects=args.objects, num_arrangements=num_arrangements,
+                                     num_cameras=args.cameras)
+
+partitions = ObjectPartition(num_partitions=3, objects=scene_initializer.get_objects2annotate(),
+                             rng=random_streams.generator(0, RandomStream.PARTITION))
 partitions.create_partition(partition_type=PartitionType.UNIQUE_OBJECTS, probability_reduction_factor=0.1)
 
 
@@ -72,49 +140,106 @@ partitions.create_partition(partition_type=PartitionType.UNIQUE_OBJECTS, probabi
 # centroid of table = 5.40737, -3.2758
 # plate dimension = 0.26,0.26, 0,02
 # bowl dimension = 0.168, 0.168, 0.055
-def deploy_scene(x, objects):
-    for i in range(x):
-        subset = np.random.choice(objects, size=2)
-        print(subset.shape)
-        hide_render_objects(subset, False)
-        light_pose_sampler.sample_homogenous_lights_around_center(200)
-        blenderproc.object.sample_poses_on_surface(subset, tables[0].mesh_object,
-                                                   object_pose_sampler.sample_object_pose_uniform,
-                                                   max_tries=333,
-                                                   min_distance=0.3, max_distance=0.7, up_direction=None,
-                                                   check_all_bb_corners_over_surface=True)
-        radius = np.random.uniform(1.2, 1.8)
-        camera_pose_sampler.get_sampled_circular_cam_poses(num_poses=2, radius=radius,
-                                                           center=np.array([5.40, -3.2758]),
-                                                           poi=config.get_position_of_interest(), height=1.4)
-        hide_render_objects(furnitures, False)
+def record_written_iteration(coco_writer, iteration, records, hdf5_paths):
+    image_files = [os.path.join(coco_writer.output_dir, r["image"]["file_name"]) for r in records]
+    hdf5_count = int(hdf5_paths[-1].stem) + 1 if hdf5_paths else len(get_hdf5_files(output_dir))
+    manifest.record_iteration(iteration, image_files + hdf5_paths, coco_writer.get_offset(),
+                              coco_writer.next_image_id, coco_writer.next_annotation_id, hdf5_count)
+
+
+def record_written_frames(shard_writer, iteration, frames, hdf5_paths):
+    # The shard files keep growing, instead of checksums the frame count is recorded and cut back to on resume
+    manifest.record_iteration(iteration, [], frame_count=shard_writer.num_frames)
+
+
+def deploy_scene(iterations, objects, output_writer):
+    completed = manifest.completed_iterations()
+    for i in iterations:
+        if i in completed:
+            continue
+        iteration_sampler.sample(i, objects)
+        # RGB pass shows the sampled objects together with the furniture
+        with instrumentation.stage("visibility"):
+            visibility.show_only(furnitures)
+        keyframe_batch.key_visibility()
         # Render the scene
+        with instrumentation.stage("render"):
+            data = bproc.renderer.render()
+        # Segmentation pass only shows the sampled objects
+        with instrumentation.stage("visibility"):
+            visibility.hide(furnitures)
 
-        data = bproc.renderer.render()
-        # Write the rendering into an hdf5 file
-        hide_render_objects(furnitures, True)
-
-        seg_data = bproc.renderer.render_segmap(map_by=["instance", "class", "name"])
+        with instrumentation.stage("render_segmap"):
+            seg_data = bproc.renderer.render_segmap(map_by=["instance", "class", "name"])
 
-        bproc.writer.write_coco_annotations(
-            os.path.join("/home/naser/workspace/SUTURO/SUTURO_WSS/SUTURO-Blenderproc/SUTURO-blenderproc/output",
-                         'coco_data'),
-            instance_segmaps=seg_data["instance_segmaps"],
-            instance_attribute_maps=seg_data["instance_attribute_maps"],
-            colors=data["colors"],
-            color_file_format="JPEG")
-        bproc.writer.write_hdf5("/home/naser/workspace/SUTURO/SUTURO_WSS/SUTURO-Blenderproc/SUTURO-blenderproc/output",
-                                data)
-        hide_render_objects(subset, True)
-        blenderproc.utility.reset_keyframes()
+        # Writing happens on the background thread, the next iteration starts right away
+        output_writer.submit(i, data, seg_data)
+        keyframe_batch.release()
+        instrumentation.end_iteration(i)
 
 
 def pipeline():
-    hide_render_objects(scene_initializer.get_all_mesh_objects(), True)
-    hide_render_objects(scene_initializer.get_objects2annotate(), False)
+    visibility.hide_all()
     objects = scene_initializer.get_objects2annotate()
-    hide_render_objects(objects, True)
-    deploy_scene(3, objects)
+    with open(context.id2name_path, 'r') as stream:
+        id2name = json.load(stream)
+    if args.output_format == "shards":
+        frame_writer = ShardWriter(os.path.join(output_dir, 'frame_shards'), frames_per_shard=args.frames_per_shard)
+        if args.resume:
+            manifest.restore_outputs(shard_writer=frame_writer)
+        output_writer = AsyncWriter(frame_writer, max_pending_mb=args.max_pending_mb,
+                                    on_written=functools.partial(record_written_frames, frame_writer))
+    else:
+        if args.resume:
+            manifest.restore_outputs(os.path.join(output_dir, 'coco_data'), output_dir)
+        frame_writer = StreamingCocoWriter(os.path.join(output_dir, 'coco_data'), id2name=id2name)
+        output_writer = AsyncWriter(frame_writer, output_dir, hdf5_start_index=len(get_hdf5_files(output_dir)),
+                                    max_pending_mb=args.max_pending_mb,
+                                    on_written=functools.partial(record_written_iteration, frame_writer))
+    if args.resume:
+        print(f"Resuming, {len(manifest.completed_iterations())} iterations are already done")
+    finished = False
+    try:
+        deploy_scene(range(args.start_iteration, args.start_iteration + args.iterations), objects, output_writer)
+        # Waits for the queued iterations, an error of the writer thread is raised here
+        with instrumentation.stage("writer_flush"):
+            output_writer.close()
+        finished = True
+    finally:
+        try:
+            output_writer.close()
+        finally:
+            with instrumentation.stage("coco_finalize"):
+                if args.output_format == "shards":
+                    frame_writer.close()
+                else:
+                    # Only a completed run is marked as finished, a crashed one can still be resumed and watched
+                    frame_writer.finalize(finished=finished)
+    coco_dir, hdf5_dir = os.path.join(output_dir, 'coco_data'), output_dir
+    if args.output_format == "shards" and (config.get_combine_with_existing_dataset() or config.get_yolo_dataset()):
+        # Merge and YOLO conversion read COCO, the shards are converted once for them
+        with instrumentation.stage("shard_conversion"):
+            shard_to_coco(os.path.join(output_dir, 'frame_shards'), coco_dir, id2name)
+        hdf5_dir = None
+    if config.get_combine_with_existing_dataset():
+        # The new frames are appended to the existing dataset, which is then converted instead of the run output
+        coco_dir, hdf5_dir = config.get_path_to_dataset_that_has_to_be_combined(), None
+        with instrumentation.stage("dataset_merge"):
+            merger = DatasetMerger(coco_dir, id2name)
+            result = merger.merge([os.path.join(output_dir, 'coco_data')])
+            # Keeps coco_annotations.json of the target in sync, like --compile of the merge CLI
+            merger.compile()
+        print(f"Merged {result['images']} images into {coco_dir}, dropped {result['duplicates']} near-duplicates")
+    if config.get_yolo_dataset():
+        yolo_dir = config.get_yolo_save_path() or os.path.join(output_dir, 'yolo_data')
+        with instrumentation.stage("yolo_conversion"):
+            result = YoloConverter(coco_dir, yolo_dir, id2name, hdf5_dir=hdf5_dir).convert()
+        print(f"Converted {result['images']} images into the YOLO dataset {yolo_dir}")
+    print(f"Occluded camera candidates (wasted renders): {line_of_sight.get_wasted_fraction():.2%}")
+    print(f"Object placement rejection rate: {placement_sampler.get_rejection_rate():.2%}")
+    print(f"hide_render writes: {visibility.num_writes}")
+    if args.profile:
+        print(instrumentation.write_summary())
 
 
 pipeline()
@@ -0,0 +1,120 @@
+import blenderproc as bproc
+import bpy
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import utils.path_utils
+from utils.file_utils import get_file_hash
+from suturo_blenderproc.scene_index import ROLE_PATTERNS, get_class_pattern
+from suturo_blenderproc.instrumentation import get_instrumentation
+
+
+def get_scene_name_regex(classes: [str]) -> str:
+    """Regex that fullmatches the names of the role objects of a scene and of the objects of the given classes."""
+    patterns = [p.pattern if not p.flags & re.IGNORECASE else f"(?i:{p.pattern})"
+                for role_patterns in ROLE_PATTERNS.values() for p in role_patterns]
+    patterns += [get_class_pattern(c) for c in classes]
+    return "|".join(f"(?:{p})" for p in patterns)
+
+
+class GlbImportCache(object):
+    """
+    Converts .glb files into .blend files once and keeps them in cache_dir, keyed by the hash of the .glb content.
+    Loading the converted .blend skips the glTF import, which has to rebuild meshes, materials and textures.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else utils.path_utils.get_path_object_cache_dir()
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_cache_path(self, glb_path) -> Path:
+        glb_path = Path(glb_path)
+        return self.cache_dir.joinpath(f"{glb_path.stem}.{get_file_hash(glb_path)[:16]}.blend")
+
+    def load(self, glb_path, name: str = None) -> [bproc.types.MeshObject]:
+        """Loads the meshes of a .glb file, named after name or the file stem."""
+        glb_path = Path(glb_path)
+        cache_path = self.get_cache_path(glb_path)
+        if cache_path.is_file():
+            self.num_hits += 1
+            get_instrumentation().count("asset_cache_hits")
+            return bproc.loader.load_blend(str(cache_path), obj_types=["mesh"])
+
+        self.num_misses += 1
+        objects = self._import_glb(glb_path, name if name is not None else glb_path.stem)
+        self._write(cache_path, objects)
+        return objects
+
+    def _import_glb(self, glb_path: Path, name: str) -> [bproc.types.MeshObject]:
+        existing = set(bpy.context.scene.objects)
+        bpy.ops.import_scene.gltf(filepath=str(glb_path))
+        imported = [o for o in bpy.context.scene.objects if o not in existing]
+        meshes = [o for o in imported if o.type == "MESH"]
+        # Empties of the glTF hierarchy are dropped, the meshes keep their world transform
+        for obj in meshes:
+            matrix_world = obj.matrix_world.copy()
+            obj.parent = None
+            obj.matrix_world = matrix_world
+            obj.name = name
+        for obj in imported:
+            if obj.type != "MESH":
+                bpy.data.objects.remove(obj, do_unlink=True)
+        return bproc.object.convert_to_meshes(meshes)
+
+    def _write(self, cache_path: Path, objects: [bproc.types.MeshObject]):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".blend")
+        os.close(fd)
+        try:
+            bpy.data.libraries.write(tmp_path, set(o.blender_obj for o in objects), fake_user=True)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class AssetLoader(object):
+    """
+    Loads only what a run needs: the role objects of the scene (walls, surfaces, furniture) and the objects of the
+    configured classes, either from the scene itself or, for classes the scene doesn't contain, from the .glb files
+    of the object library. Objects of other classes are never read from disk.
+    """
+
+    def __init__(self, classes: [str], library_dir=None, cache: GlbImportCache = None):
+        self.classes = list(classes)
+        self.library_dir = Path(library_dir) if library_dir is not None else \
+            utils.path_utils.get_path_object_library()
+        self.cache = cache if cache is not None else GlbImportCache()
+
+    def load_scene(self, blend_path) -> [bproc.types.MeshObject]:
+        return bproc.loader.load_blend(str(blend_path), name_regrex=get_scene_name_regex(self.classes))
+
+    def find_library_files(self, classes: [str]) -> dict:
+        """Returns class -> .glb files of the library whose name starts with the class name."""
+        files = {c: [] for c in classes}
+        if not self.library_dir.is_dir():
+            return files
+        patterns = {c: re.compile(get_class_pattern(c)) for c in classes}
+        for entry in sorted(os.scandir(self.library_dir), key=lambda e: e.name):
+            path = Path(entry.path)
+            if not entry.is_file() or path.suffix.lower() != ".glb":
+                continue
+            for c, pattern in patterns.items():
+                if pattern.fullmatch(path.stem):
+                    files[c].append(path)
+        return files
+
+    def load(self, blend_path) -> [bproc.types.MeshObject]:
+        objects = self.load_scene(blend_path)
+        names = [o.get_name() for o in objects]
+        missing = [c for c in self.classes if not any(re.fullmatch(get_class_pattern(c), n) for n in names)]
+        for c, paths in self.find_library_files(missing).items():
+            if not paths:
+                print(f"No objects of class {c} in the scene or in {self.library_dir}")
+            for path in paths:
+                objects.extend(self.cache.load(path))
+        return objects
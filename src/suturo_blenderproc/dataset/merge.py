@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from suturo_blenderproc.dataset.shard_merge import link_or_copy
+from suturo_blenderproc.writer.streaming_coco import StreamingCocoWriter, read_records, compile_coco_annotations
+
+
+def compute_dhash(image_path, hash_size: int = 8) -> np.uint64:
+    """64 bit difference hash: signs of the horizontal gradients of a 9x8 grayscale thumbnail."""
+    with Image.open(image_path) as image:
+        pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return np.uint64(int(np.packbits(bits).view(">u8")[0]))
+
+
+def hamming_distances(hashes: np.ndarray, value: np.uint64) -> np.ndarray:
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class DHashIndex(object):
+    """
+    Finds hashes within max_distance bits of a query. The 64 bits are split into max_distance + 1 bands, two hashes
+    that differ in at most max_distance bits agree on at least one band, so only hashes sharing a band value have
+    to be compared. The known hashes are kept sorted per band, hashes added later go into dicts.
+    """
+
+    def __init__(self, hashes: np.ndarray, max_distance: int = 4):
+        self.max_distance = max_distance
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        num_bands = max_distance + 1
+        widths = [64 // num_bands + (1 if b < 64 % num_bands else 0) for b in range(num_bands)]
+        self._shifts = np.cumsum([0] + widths[:-1]).astype(np.uint64)
+        self._masks = [np.uint64((1 << w) - 1) for w in widths]
+        self._sorted = []
+        for shift, mask in zip(self._shifts, self._masks):
+            keys = (self.hashes >> shift) & mask
+            order = np.argsort(keys, kind="stable")
+            self._sorted.append((keys[order], order))
+        self._added = []
+        self._added_bands = [{} for _ in widths]
+
+    def __len__(self):
+        return len(self.hashes) + len(self._added)
+
+    def contains_near(self, value: np.uint64) -> bool:
+        value = np.uint64(value)
+        for band, (shift, mask) in enumerate(zip(self._shifts, self._masks)):
+            key = (value >> shift) & mask
+            keys, order = self._sorted[band]
+            start, end = np.searchsorted(keys, key, side="left"), np.searchsorted(keys, key, side="right")
+            if end > start and np.any(hamming_distances(self.hashes[order[start:end]], value) <= self.max_distance):
+                return True
+            candidates = self._added_bands[band].get(int(key), [])
+            if candidates and np.any(hamming_distances(np.array(candidates, dtype=np.uint64),
+                                                       value) <= self.max_distance):
+                return True
+        return False
+
+    def add(self, value: np.uint64):
+        value = np.uint64(value)
+        self._added.append(value)
+        for band, (shift, mask) in enumerate(zip(self._shifts, self._masks)):
+            self._added_bands[band].setdefault(int((value >> shift) & mask), []).append(value)
+
+    def get_all(self) -> np.ndarray:
+        return np.concatenate([self.hashes, np.array(self._added, dtype=np.uint64)])
+
+
+def read_dataset_records(coco_dir):
+    """Yields the (image, annotations) records of a COCO dir, streamed or compiled, with category names."""
+    coco_dir = Path(coco_dir)
+    annotation_path = coco_dir.joinpath(StreamingCocoWriter.ANNOTATION_FILE)
+    if annotation_path.is_file():
+        for record, _ in read_records(annotation_path):
+            yield record
+        return
+
+    with open(coco_dir.joinpath(StreamingCocoWriter.COCO_FILE), 'r') as f:
+        coco = json.load(f)
+    names = {c["id"]: c["name"] for c in coco.get("categories", [])}
+    annotations = {}
+    for annotation in coco["annotations"]:
+        annotations.setdefault(annotation["image_id"], []).append(
+            dict(annotation, name=names.get(annotation["category_id"], "")))
+    for image in coco["images"]:
+        yield {"image": image, "annotations": annotations.get(image["id"], [])}
+
+
+class DatasetMerger(object):
+    """
+    Appends datasets to a target COCO dir in the streamed format of the StreamingCocoWriter. A sidecar index in the
+    target keeps the next free ids, the size of annotations.jsonl and the dHashes of all its images, so a merge only
+    reads the new images. Image and annotation ids are renumbered after the target, category ids are mapped by name
+    onto id2name, images are linked and frames that are near-duplicates of a known frame are dropped.
+    """
+
+    INDEX_FILE = "merge_index.json"
+    HASH_FILE = "merge_hashes.npy"
+
+    def __init__(self, target_dir, id2name: dict, max_distance: int = 4):
+        self.target_dir = Path(target_dir)
+        self.id2name = {str(k): v for k, v in id2name.items()}
+        self.name2id = {v: int(k) for k, v in self.id2name.items()}
+        self.max_distance = max_distance
+        self.annotation_path = self.target_dir.joinpath(StreamingCocoWriter.ANNOTATION_FILE)
+        self.target_dir.joinpath("images").mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        index_path = self.target_dir.joinpath(self.INDEX_FILE)
+        if not index_path.is_file():
+            self._build_index()
+            return
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        self.next_image_id = index["next_image_id"]
+        self.next_annotation_id = index["next_annotation_id"]
+        # Records appended by a merge that crashed before its index was saved are dropped
+        size = self.annotation_path.stat().st_size if self.annotation_path.is_file() else 0
+        if size > index["offset"]:
+            os.truncate(self.annotation_path, index["offset"])
+        self.hash_index = DHashIndex(np.load(self.target_dir.joinpath(self.HASH_FILE)), self.max_distance)
+
+    def _build_index(self):
+        """
+        Indexes an existing target once, a compiled coco_annotations.json is converted to annotations.jsonl. The
+        category ids of the target are mapped by name onto id2name like the ones of merged records, a target built
+        with another mapping is rewritten and one with categories id2name doesn't know is rejected.
+        """
+        self.next_image_id = 0
+        self.next_annotation_id = 0
+        hashes = []
+        records = []
+        if self.annotation_path.is_file() or self.target_dir.joinpath(StreamingCocoWriter.COCO_FILE).is_file():
+            records = list(read_dataset_records(self.target_dir))
+        remapped = self._remap_target_categories(records)
+        if records and (remapped or not self.annotation_path.is_file()):
+            fd, tmp_path = tempfile.mkstemp(dir=self.target_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            os.replace(tmp_path, self.annotation_path)
+        for record in records:
+            hashes.append(compute_dhash(self.target_dir.joinpath(record["image"]["file_name"])))
+            self.next_image_id = max(self.next_image_id, record["image"]["id"] + 1)
+            for annotation in record["annotations"]:
+                self.next_annotation_id = max(self.next_annotation_id, annotation["id"] + 1)
+        self.hash_index = DHashIndex(np.array(hashes, dtype=np.uint64), self.max_distance)
+        self._save_index()
+
+    def _remap_target_categories(self, records: [dict]) -> bool:
+        """Maps the category ids of the target records onto id2name in place, returns whether any id changed."""
+        remapped = False
+        unknown = set()
+        for record in records:
+            for annotation in record["annotations"]:
+                category_id = self._map_category(annotation, {})
+                if category_id is None:
+                    unknown.add(annotation.get("name", "").split('.')[0] or str(annotation["category_id"]))
+                elif category_id != annotation["category_id"]:
+                    annotation["category_id"] = category_id
+                    remapped = True
+        if unknown:
+            raise Exception(f"Categories {sorted(unknown)} of {self.target_dir} are not in id2name, merging into it "
+                            f"would mix up category ids")
+        return remapped
+
+    def _save_index(self):
+        size = self.annotation_path.stat().st_size if self.annotation_path.is_file() else 0
+        index = {"next_image_id": self.next_image_id, "next_annotation_id": self.next_annotation_id,
+                 "offset": size, "num_images": len(self.hash_index)}
+        for name, write in [(self.HASH_FILE, lambda f: np.save(f, self.hash_index.get_all())),
+                            (self.INDEX_FILE, lambda f: f.write(json.dumps(index).encode()))]:
+            fd, tmp_path = tempfile.mkstemp(dir=self.target_dir, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, self.target_dir.joinpath(name))
+
+    def _map_category(self, annotation: dict, source_id2name: dict):
+        name = source_id2name.get(str(annotation["category_id"])) or annotation.get("name", "").split('.')[0]
+        return self.name2id.get(name)
+
+    def merge(self, source_dirs: [Path], source_id2name: dict = None) -> dict:
+        """
+        Appends the frames of all source COCO dirs. source_id2name maps the category ids of the sources to names,
+        by default the sources use the same id2name as the target.
+        """
+        source_id2name = {str(k): v for k, v in (source_id2name or self.id2name).items()}
+        counts = {"images": 0, "annotations": 0, "duplicates": 0, "unknown_categories": 0}
+        with open(self.annotation_path, 'a') as out:
+            for source_dir in source_dirs:
+                for record in read_dataset_records(source_dir):
+                    src = Path(source_dir).joinpath(record["image"]["file_name"])
+                    dhash = compute_dhash(src)
+                    if self.hash_index.contains_near(dhash):
+                        counts["duplicates"] += 1
+                        continue
+                    self.hash_index.add(dhash)
+
+                    image_id = self.next_image_id
+                    file_name = Path("images").joinpath(f"{image_id:06d}{src.suffix}")
+                    link_or_copy(src, self.target_dir.joinpath(file_name))
+                    annotations = []
+                    for annotation in record["annotations"]:
+                        category_id = self._map_category(annotation, source_id2name)
+                        if category_id is None:
+                            counts["unknown_categories"] += 1
+                            continue
+                        annotations.append(dict(annotation, id=self.next_annotation_id, image_id=image_id,
+                                                category_id=category_id, name=self.id2name[str(category_id)]))
+                        self.next_annotation_id += 1
+                    out.write(json.dumps({"image": dict(record["image"], id=image_id, file_name=str(file_name)),
+                                          "annotations": annotations}) + "\n")
+                    self.next_image_id += 1
+                    counts["images"] += 1
+                    counts["annotations"] += len(annotations)
+            out.flush()
+            os.fsync(out.fileno())
+        self._save_index()
+        return counts
+
+    def compile(self) -> dict:
+        """Writes coco_annotations.json of the whole target, this is the only step that reads every record."""
+        return compile_coco_annotations(self.target_dir, self.id2name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Merges generated COCO datasets into an existing dataset.')
+    parser.add_argument("target_dir", help="COCO dir of the dataset the others are merged into")
+    parser.add_argument("source_dirs", nargs="+", help="COCO dirs that are merged into the target")
+    parser.add_argument("--id2name", required=True, help="Json file mapping category ids to names")
+    parser.add_argument("--max_distance", type=int, default=4,
+                        help="Frames whose dHashes differ in at most this many bits are duplicates")
+    parser.add_argument("--compile", action="store_true", help="Write coco_annotations.json of the target")
+    args = parser.parse_args()
+    with open(args.id2name, 'r') as stream:
+        mapping = json.load(stream)
+    merger = DatasetMerger(args.target_dir, mapping, max_distance=args.max_distance)
+    result = merger.merge(args.source_dirs)
+    print(f"Merged {result['images']} images with {result['annotations']} annotations, dropped "
+          f"{result['duplicates']} near-duplicates and {result['unknown_categories']} annotations of unknown "
+          f"categories")
+    if args.compile:
+        merger.compile()
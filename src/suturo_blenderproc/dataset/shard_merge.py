@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+
+def link_or_copy(src, dst):
+    """Hardlinks src to dst, falls back to a copy if both are not on the same file system."""
+    dst = Path(dst)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def get_hdf5_files(directory) -> [Path]:
+    """Returns the <index>.hdf5 files written by bproc.writer.write_hdf5, sorted by their index."""
+    files = [p for p in Path(directory).glob("*.hdf5") if p.stem.isdigit()]
+    return sorted(files, key=lambda p: int(p.stem))
+
+
+def merge_hdf5_files(shard_dirs: [Path], output_dir) -> int:
+    """Links the hdf5 files of all shards into output_dir with a global, consecutive index."""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index = 0
+    for shard_dir in shard_dirs:
+        for hdf5_file in get_hdf5_files(shard_dir):
+            link_or_copy(hdf5_file, output_dir.joinpath(f"{index}.hdf5"))
+            index += 1
+    return index
+
+
+def merge_coco_annotations(shard_coco_dirs: [Path], output_coco_dir) -> dict:
+    """
+    Merges the coco_annotations.json of all shards into output_coco_dir. Image and annotation ids are renumbered
+    to be globally unique, the images are linked into output_coco_dir/images under their new id.
+    """
+    output_coco_dir = Path(output_coco_dir)
+    output_coco_dir.joinpath("images").mkdir(parents=True, exist_ok=True)
+
+    merged = None
+    categories = {}
+    image_id = 0
+    annotation_id = 0
+    for shard_coco_dir in shard_coco_dirs:
+        annotation_file = Path(shard_coco_dir).joinpath("coco_annotations.json")
+        if not annotation_file.is_file():
+            print(f"Skipping {shard_coco_dir}, it contains no coco_annotations.json")
+            continue
+        with open(annotation_file, 'r') as f:
+            coco = json.load(f)
+
+        if merged is None:
+            merged = {k: v for k, v in coco.items() if k not in ["images", "annotations", "categories"]}
+            merged["images"] = []
+            merged["annotations"] = []
+
+        for category in coco.get("categories", []):
+            known = categories.setdefault(category["id"], category)
+            if known["name"] != category["name"]:
+                raise Exception(f"Category id {category['id']} is used for {known['name']} and {category['name']}")
+
+        image_ids = {}
+        for image in coco["images"]:
+            file_name = Path(image["file_name"])
+            new_file_name = Path("images").joinpath(f"{image_id:06d}{file_name.suffix}")
+            link_or_copy(Path(shard_coco_dir).joinpath(file_name), output_coco_dir.joinpath(new_file_name))
+            image_ids[image["id"]] = image_id
+            merged["images"].append(dict(image, id=image_id, file_name=str(new_file_name)))
+            image_id += 1
+
+        for annotation in coco["annotations"]:
+            merged["annotations"].append(dict(annotation, id=annotation_id,
+                                              image_id=image_ids[annotation["image_id"]]))
+            annotation_id += 1
+
+    if merged is None:
+        raise Exception("None of the shards contains coco annotations")
+
+    merged["categories"] = [categories[k] for k in sorted(categories)]
+    with open(output_coco_dir.joinpath("coco_annotations.json"), 'w') as f:
+        json.dump(merged, f)
+    return merged
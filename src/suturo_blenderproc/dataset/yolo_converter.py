@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from suturo_blenderproc.writer.streaming_coco import StreamingCocoWriter, read_records
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def rle_to_binary_mask(rle: dict) -> np.ndarray:
+    """Decodes the uncompressed COCO RLE written by binary_mask_to_rle."""
+    height, width = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.arange(len(counts)) % 2
+    return np.repeat(values, counts).astype(bool).reshape((height, width), order='F')
+
+
+def coco_boxes_to_yolo(bboxes: np.ndarray, width: int, height: int) -> np.ndarray:
+    """(N, 4) COCO [x, y, w, h] pixel boxes to normalized YOLO [cx, cy, w, h] boxes."""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    yolo = np.column_stack([bboxes[:, :2] + bboxes[:, 2:] / 2, bboxes[:, 2:]]) / scale
+    return np.clip(yolo, 0.0, 1.0)
+
+
+def mask_to_yolo_polygon(mask: np.ndarray) -> np.ndarray:
+    """Normalized (K, 2) outline of the largest connected part of a mask, empty if it has no area."""
+    if cv2 is None:
+        raise Exception("Polygon labels need opencv-python, install it or convert with task='detect'")
+    contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.zeros(shape=(0, 2))
+    contour = max(contours, key=cv2.contourArea).reshape(-1, 2).astype(np.float64)
+    return contour / np.array([mask.shape[1], mask.shape[0]], dtype=np.float64)
+
+
+def get_split(image_id: int, val_fraction: float) -> str:
+    # Multiplicative hashing keeps the split of an image fixed between incremental runs
+    return "val" if (image_id * 2654435761) % (1 << 32) < val_fraction * (1 << 32) else "train"
+
+
+def link_image(src: Path, dst: Path):
+    """Hardlinks src to dst, falls back to a symlink if both are not on the same file system."""
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+
+def _write_image(record: dict, settings: dict, dst_dir: Path) -> bool:
+    image = record["image"]
+    src = Path(settings["coco_dir"]).joinpath(image["file_name"])
+    if src.is_file():
+        link_image(src, dst_dir.joinpath(src.name))
+        return True
+    if settings["hdf5_dir"] is None:
+        return False
+    # Without the COCO image the frame is taken from the hdf5 output, which has the same index as the image id
+    hdf5_path = Path(settings["hdf5_dir"]).joinpath(f"{image['id']}.hdf5")
+    if h5py is None or not hdf5_path.is_file():
+        return False
+    with h5py.File(hdf5_path, 'r') as f:
+        colors = np.array(f["colors"])
+    Image.fromarray(colors.astype(np.uint8)).save(dst_dir.joinpath(Path(image["file_name"]).name), quality=95)
+    return True
+
+
+def convert_records(records: [dict], settings: dict) -> (int, int, int):
+    """Writes the label files and images of COCO records, returns (images, labels, skipped annotations)."""
+    output_dir = Path(settings["output_dir"])
+    name2index = settings["name2index"]
+    id2name = settings["id2name"]
+    num_images, num_labels, num_skipped = 0, 0, 0
+    for record in records:
+        image = record["image"]
+        split = get_split(image["id"], settings["val_fraction"])
+        if not _write_image(record, settings, output_dir.joinpath("images", split)):
+            print(f"Image {image['file_name']} is missing, skipping it")
+            continue
+
+        annotations = [a for a in record["annotations"]
+                       if id2name.get(str(a["category_id"]), a.get("name", "").split('.')[0]) in name2index]
+        num_skipped += len(record["annotations"]) - len(annotations)
+        classes = [name2index[id2name.get(str(a["category_id"]), a.get("name", "").split('.')[0])]
+                   for a in annotations]
+        lines = []
+        if settings["task"] == "segment":
+            for class_index, annotation in zip(classes, annotations):
+                polygon = mask_to_yolo_polygon(rle_to_binary_mask(annotation["segmentation"]))
+                if len(polygon) >= 3:
+                    lines.append(f"{class_index} " + " ".join(f"{v:.6f}" for v in polygon.ravel()))
+        else:
+            boxes = coco_boxes_to_yolo([a["bbox"] for a in annotations], image["width"], image["height"])
+            lines = [f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}" for c, (x, y, w, h) in zip(classes, boxes)]
+
+        label_path = output_dir.joinpath("labels", split, Path(image["file_name"]).stem + ".txt")
+        with open(label_path, 'w') as f:
+            f.write("\n".join(lines) + ("\n" if lines else ""))
+        num_images += 1
+        num_labels += len(lines)
+    return num_images, num_labels, num_skipped
+
+
+class YoloConverter(object):
+    """
+    Converts the streamed COCO output (annotations.jsonl) of a run into a YOLO dataset. The converter remembers up
+    to which byte of annotations.jsonl it has converted, so it can be run again, or with watch, while the
+    generation is still writing and only converts the new frames. Frames are converted in chunks on a process pool,
+    images are linked instead of copied.
+    """
+
+    STATE_FILE = ".yolo_state.json"
+
+    def __init__(self, coco_dir, output_dir, id2name: dict, task: str = "detect", val_fraction: float = 0.1,
+                 hdf5_dir=None, num_workers: int = None, chunk_size: int = 64):
+        if task not in ("detect", "segment"):
+            raise Exception(f"Unknown YOLO task {task}, use detect or segment")
+        if task == "segment" and cv2 is None:
+            raise Exception("Polygon labels need opencv-python, install it or convert with task='detect'")
+        self.coco_dir = Path(coco_dir)
+        self.output_dir = Path(output_dir)
+        self.id2name = {str(k): v for k, v in id2name.items()}
+        # YOLO class indices have to be consecutive, they follow the numeric order of the ids in id2name
+        self.class_names = [self.id2name[k] for k in sorted(self.id2name, key=int)]
+        self.task = task
+        self.val_fraction = val_fraction
+        self.hdf5_dir = hdf5_dir
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+        self.chunk_size = chunk_size
+        self.state_path = self.output_dir.joinpath(self.STATE_FILE)
+
+    def _load_offset(self) -> int:
+        if not self.state_path.is_file():
+            return 0
+        with open(self.state_path, 'r') as f:
+            state = json.load(f)
+        annotation_path = self.coco_dir.joinpath(StreamingCocoWriter.ANNOTATION_FILE)
+        # A truncated annotations.jsonl, e.g. after a resumed run, is converted again from the start
+        if state["source"] != str(annotation_path.resolve()) or state["offset"] > annotation_path.stat().st_size:
+            return 0
+        return state["offset"]
+
+    def _save_offset(self, offset: int):
+        state = {"source": str(self.coco_dir.joinpath(StreamingCocoWriter.ANNOTATION_FILE).resolve()),
+                 "offset": offset}
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _write_data_yaml(self):
+        lines = [f"path: {self.output_dir.resolve()}", "train: images/train", "val: images/val", "names:"]
+        lines += [f"  {i}: {name}" for i, name in enumerate(self.class_names)]
+        with open(self.output_dir.joinpath("data.yaml"), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+    def convert(self) -> dict:
+        """Converts all frames written since the last call and returns the counts of this call."""
+        for directory in ["images", "labels"]:
+            for split in ["train", "val"]:
+                self.output_dir.joinpath(directory, split).mkdir(parents=True, exist_ok=True)
+        self._write_data_yaml()
+
+        annotation_path = self.coco_dir.joinpath(StreamingCocoWriter.ANNOTATION_FILE)
+        if not annotation_path.is_file():
+            return {"images": 0, "labels": 0, "skipped": 0}
+        offset = self._load_offset()
+        records = []
+        for record, end in read_records(annotation_path, offset):
+            records.append(record)
+            offset = end
+
+        settings = {"coco_dir": str(self.coco_dir), "output_dir": str(self.output_dir), "task": self.task,
+                    "name2index": {name: i for i, name in enumerate(self.class_names)}, "id2name": self.id2name,
+                    "val_fraction": self.val_fraction,
+                    "hdf5_dir": str(self.hdf5_dir) if self.hdf5_dir is not None else None}
+        chunks = [records[i:i + self.chunk_size] for i in range(0, len(records), self.chunk_size)]
+        totals = np.zeros(3, dtype=np.int64)
+        if self.num_workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                totals += convert_records(chunk, settings)
+        else:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                for counts in executor.map(convert_records, chunks, [settings] * len(chunks)):
+                    totals += counts
+        self._save_offset(offset)
+        return {"images": int(totals[0]), "labels": int(totals[1]), "skipped": int(totals[2])}
+
+    def watch(self, interval: float = 10.0) -> dict:
+        """
+        Converts new frames every interval seconds until the run marked its stream as finished. The marker is
+        checked before converting, so the frames written up to it are always part of the last conversion.
+        """
+        totals = {"images": 0, "labels": 0, "skipped": 0}
+        while True:
+            finished = self.coco_dir.joinpath(StreamingCocoWriter.DONE_FILE).is_file()
+            for key, value in self.convert().items():
+                totals[key] += value
+            if finished:
+                return totals
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Converts the COCO output of a run into a YOLO dataset.')
+    parser.add_argument("coco_dir", help="Directory containing annotations.jsonl")
+    parser.add_argument("output_dir", help="Directory of the YOLO dataset")
+    parser.add_argument("--id2name", required=True, help="Json file mapping category ids to names")
+    parser.add_argument("--task", default="detect", choices=["detect", "segment"], help="Box or polygon labels")
+    parser.add_argument("--val_fraction", type=float, default=0.1, help="Fraction of images in the val split")
+    parser.add_argument("--hdf5_dir", default=None, help="Output directory with the hdf5 files of the run")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--watch", action="store_true", help="Keep converting until the run is finished")
+    parser.add_argument("--interval", type=float, default=10.0, help="Seconds between two conversions with --watch")
+    args = parser.parse_args()
+    with open(args.id2name, 'r') as stream:
+        mapping = json.load(stream)
+    converter = YoloConverter(args.coco_dir, args.output_dir, mapping, task=args.task,
+                              val_fraction=args.val_fraction, hdf5_dir=args.hdf5_dir, num_workers=args.workers)
+    result = converter.watch(args.interval) if args.watch else converter.convert()
+    print(f"Converted {result['images']} images with {result['labels']} labels, "
+          f"skipped {result['skipped']} annotations of unknown categories")
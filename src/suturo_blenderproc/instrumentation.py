@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak RSS is reported as 0 there
+    resource = None
+
+
+def get_peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    # ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    __slots__ = ("instrumentation", "name", "iteration", "start")
+
+    def __init__(self, instrumentation, name: str, iteration: int = None):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.iteration = iteration
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start, self.iteration)
+        return False
+
+
+def _add_stage(times: dict, calls: dict, name: str, seconds: float, num_calls: int = 1):
+    times[name] = times.get(name, 0.0) + seconds
+    calls[name] = calls.get(name, 0) + num_calls
+
+
+def _stage_record(times: dict, calls: dict) -> dict:
+    return {k: {"time": v, "calls": calls[k]} for k, v in times.items()}
+
+
+class Instrumentation(object):
+    """
+    Collects wall time and call counts per stage and arbitrary counters like rejections. Every end_iteration
+    appends the numbers of the iteration to a JSONL file, write_summary writes the totals as a table.
+    When disabled, stage returns a shared no-op context manager and count returns immediately.
+
+    Stages can be timed from other threads as well, all updates are guarded by a lock. Stages given an iteration,
+    e.g. by the background writer that is still writing an earlier iteration, are kept per iteration and added to
+    the record of the next end_iteration under "writer_stages" with the iteration they belong to, instead of being
+    attributed to the iteration the main thread is working on.
+    """
+
+    def __init__(self, enabled: bool = False, output_dir=None):
+        self.enabled = enabled
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+        self._lock = threading.Lock()
+        self._iteration_times = {}
+        self._iteration_calls = {}
+        self._iteration_counters = {}
+        # iteration -> (times, calls) of stages timed for that iteration from another thread
+        self._tagged_stages = {}
+        self.total_times = {}
+        self.total_calls = {}
+        self.total_counters = {}
+        self.num_iterations = 0
+
+    def stage(self, name: str, iteration: int = None):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, iteration)
+
+    def add_time(self, name: str, seconds: float, iteration: int = None):
+        with self._lock:
+            if iteration is None:
+                _add_stage(self._iteration_times, self._iteration_calls, name, seconds)
+            else:
+                _add_stage(*self._tagged_stages.setdefault(iteration, ({}, {})), name, seconds)
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._iteration_counters[name] = self._iteration_counters.get(name, 0) + n
+
+    def end_iteration(self, iteration: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            times, self._iteration_times = self._iteration_times, {}
+            calls, self._iteration_calls = self._iteration_calls, {}
+            counters, self._iteration_counters = self._iteration_counters, {}
+            tagged, self._tagged_stages = self._tagged_stages, {}
+        record = {"iteration": iteration,
+                  "stages": _stage_record(times, calls),
+                  "writer_stages": {str(i): _stage_record(*tagged[i]) for i in sorted(tagged)},
+                  "counters": counters,
+                  "peak_rss_mb": get_peak_rss_mb()}
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.output_dir.joinpath("timings.jsonl"), 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+        for k, v in times.items():
+            _add_stage(self.total_times, self.total_calls, k, v, calls[k])
+        for tagged_times, tagged_calls in tagged.values():
+            for k, v in tagged_times.items():
+                _add_stage(self.total_times, self.total_calls, k, v, tagged_calls[k])
+        for k, v in counters.items():
+            self.total_counters[k] = self.total_counters.get(k, 0) + v
+        self.num_iterations += 1
+
+    def summary(self) -> str:
+        # Stages timed outside of an iteration, e.g. the scene loading, are part of the totals as well
+        times = dict(self.total_times)
+        calls = dict(self.total_calls)
+        with self._lock:
+            pending = [(self._iteration_times, self._iteration_calls)] + list(self._tagged_stages.values())
+            for pending_times, pending_calls in pending:
+                for k, v in pending_times.items():
+                    _add_stage(times, calls, k, v, pending_calls[k])
+            counters = dict(self.total_counters)
+            for k, v in self._iteration_counters.items():
+                counters[k] = counters.get(k, 0) + v
+
+        total = sum(times.values())
+        lines = [f"{'stage':<24} {'calls':>8} {'total [s]':>10} {'mean [ms]':>10} {'share':>7}"]
+        for k in sorted(times, key=times.get, reverse=True):
+            share = times[k] / total if total > 0 else 0.0
+            lines.append(f"{k:<24} {calls[k]:>8} {times[k]:>10.3f} {times[k] / calls[k] * 1000:>10.2f} {share:>7.1%}")
+        if counters:
+            lines.append("")
+            lines.append(f"{'counter':<24} {'total':>8}")
+            for k in sorted(counters):
+                lines.append(f"{k:<24} {counters[k]:>8}")
+        lines.append("")
+        lines.append(f"iterations: {self.num_iterations}, peak RSS: {get_peak_rss_mb():.1f} MB")
+        return "\n".join(lines)
+
+    def write_summary(self) -> str:
+        summary = self.summary()
+        if self.enabled and self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.output_dir.joinpath("timings_summary.txt"), 'w') as f:
+                f.write(summary + "\n")
+        return summary
+
+
+_instrumentation = Instrumentation(enabled=False)
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation):
+    global _instrumentation
+    _instrumentation = instrumentation
@@ -0,0 +1,63 @@
+import numpy as np
+
+from suturo_blenderproc.sampler.keyframe_batch import KeyframeBatch
+from suturo_blenderproc.sampler.placement import get_object_footprints
+from suturo_blenderproc.sampler.pose_sampler import LightPoseSampler
+from suturo_blenderproc.sampler.rng import RandomStreams, RandomStream
+from suturo_blenderproc.sampler.surface_scheduler import SurfaceScheduler
+from suturo_blenderproc.instrumentation import get_instrumentation
+
+
+class IterationSampler(object):
+    """
+    Samples the lighting, the object arrangements and the camera poses of one iteration into a KeyframeBatch. The
+    num_objects * num_arrangements objects of an iteration are spread over all surfaces, every surface that gets
+    objects becomes an arrangement with num_cameras frames. An iteration therefore has at most that many
+    arrangements, but usually fewer when several objects share a surface.
+
+    Every random draw of iteration i comes from the generators RandomStreams derives for i, and none of the samplers
+    keeps state that depends on earlier iterations, so iteration i gets the same scene whether it runs alone, e.g.
+    in a resumed run or another shard, or after all iterations before it.
+    """
+
+    def __init__(self, random_streams: RandomStreams, keyframe_batch: KeyframeBatch,
+                 surface_scheduler: SurfaceScheduler, light_pose_sampler: LightPoseSampler, pose_banks: list,
+                 line_of_sight=None, num_objects: int = 2, num_arrangements: int = 1, num_cameras: int = 2):
+        self.random_streams = random_streams
+        self.keyframe_batch = keyframe_batch
+        self.surface_scheduler = surface_scheduler
+        self.light_pose_sampler = light_pose_sampler
+        # One CameraPoseBank per surface of the scheduler
+        self.pose_banks = pose_banks
+        self.line_of_sight = line_of_sight
+        self.num_objects = num_objects
+        self.num_arrangements = num_arrangements
+        self.num_cameras = num_cameras
+
+    def sample(self, iteration: int, objects: list) -> list:
+        """Keys the arrangements of the iteration into the batch and returns them, the batch is rendered after."""
+        instrumentation = get_instrumentation()
+        self.keyframe_batch.placement_sampler.rng = self.random_streams.generator(iteration, RandomStream.OBJECT_POSE)
+        self.light_pose_sampler.rng = self.random_streams.generator(iteration, RandomStream.LIGHT)
+        subset_rng = self.random_streams.generator(iteration, RandomStream.OBJECT_SUBSET)
+        self.surface_scheduler.rng = subset_rng
+        camera_rng = self.random_streams.generator(iteration, RandomStream.CAMERA_POSE)
+        with instrumentation.stage("lighting"):
+            self.light_pose_sampler.sample_lighting_configuration(strength_range=(150, 250))
+        # The objects of the iteration are spread over all surfaces within their capacities, every surface that gets
+        # objects becomes an arrangement with its own frames, all of them are rendered by one render call
+        subset = list(subset_rng.choice(objects, size=min(self.num_objects * self.num_arrangements, len(objects)),
+                                        replace=False))
+        assignment = self.surface_scheduler.assign(get_object_footprints(subset)[0])
+        arrangements = []
+        for k in np.unique(assignment[assignment >= 0]):
+            members = [obj for obj, surface_idx in zip(subset, assignment) if surface_idx == k]
+            arrangement = self.keyframe_batch.add_arrangement(members, k)
+            if not arrangement.objects:
+                continue
+            with instrumentation.stage("camera_sampling"):
+                cam2world_matrices = self.pose_banks[k].draw_visible(self.num_cameras, self.line_of_sight,
+                                                                     arrangement.targets, rng=camera_rng)
+            self.keyframe_batch.add_camera_poses(arrangement, cam2world_matrices)
+            arrangements.append(arrangement)
+        return arrangements
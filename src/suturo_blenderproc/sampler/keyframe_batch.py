@@ -0,0 +1,123 @@
+import blenderproc as bproc
+import bpy
+import numpy as np
+
+from suturo_blenderproc.sampler.placement import BatchPlacementSampler, get_object_footprints
+from suturo_blenderproc.visibility import VisibilityManager
+from suturo_blenderproc.instrumentation import get_instrumentation
+
+
+def estimate_frame_bytes(width: int, height: int, num_segmaps: int = 3) -> int:
+    """
+    Rough memory of one frame in the outputs of render and render_segmap: the uint8 colors, the float buffer they
+    are loaded from and the int32 segmentation maps.
+    """
+    return width * height * (3 + 3 * 4 + num_segmaps * 4)
+
+
+def choose_num_arrangements(num_cameras: int, memory_budget_mb: float, width: int = None, height: int = None,
+                            max_arrangements: int = 64) -> int:
+    """Largest number of arrangements whose num_cameras frames each fit into the memory budget, at least 1."""
+    width = width if width is not None else bpy.context.scene.render.resolution_x
+    height = height if height is not None else bpy.context.scene.render.resolution_y
+    frame_bytes = estimate_frame_bytes(width, height) * max(num_cameras, 1)
+    return int(np.clip(memory_budget_mb * 1024 * 1024 // frame_bytes, 1, max_arrangements))
+
+
+class Arrangement(object):
+    def __init__(self, objects: list, positions: np.ndarray, rotations: np.ndarray, targets: np.ndarray):
+        # Only the objects that could be placed, with their locations, euler rotations and bbox centers
+        self.objects = objects
+        self.positions = positions
+        self.rotations = rotations
+        self.targets = targets
+        self.frames = []
+
+
+class KeyframeBatch(object):
+    """
+    Records several object arrangements as keyframes, so one render and one render_segmap call produce the frames
+    of all of them. Every arrangement gets its own block of frames with its camera poses. Per frame the objects of
+    the arrangement are keyed at their pose and visible, all other objects of the batch are keyed hidden.
+
+    The placement only uses the footprints, objects are never moved in Blender outside of their keyframes. The keyed
+    rotations are the original rotation an object had when the placement sampler first saw it plus the sampled yaw,
+    so the rotation left behind by the keyframes of earlier batches doesn't change the poses of later ones.
+    """
+
+    def __init__(self, placement_sampler: BatchPlacementSampler, visibility: VisibilityManager):
+        self.placement_sampler = placement_sampler
+        self.visibility = visibility
+        self.arrangements = []
+        self.num_frames = 0
+        self._objects = {}
+
+    def add_arrangement(self, objects: list, surface_indices=0) -> Arrangement:
+        """Samples the poses of an arrangement, it gets its frames once its camera poses are added."""
+        with get_instrumentation().stage("object_placement"):
+            radii, z_offsets = get_object_footprints(objects)
+            result = self.placement_sampler.sample(radii, surface_indices)
+        placed, positions, rotations, targets, failed = [], [], [], [], []
+        for i, obj in enumerate(objects):
+            if not result.success[i]:
+                if np.ndim(surface_indices) > 0 and surface_indices[i] < 0:
+                    print(f"No surface has room for {obj.get_name()}")
+                else:
+                    print(f"Could not place {obj.get_name()} after {result.tries[i]} tries")
+                failed.append(obj)
+                continue
+            self._objects[obj.get_name()] = obj
+            bbox = np.array(obj.get_bound_box())
+            position = result.positions[i] + np.array([0, 0, z_offsets[i]])
+            placed.append(obj)
+            positions.append(position)
+            rotations.append(self.placement_sampler.get_base_rotation(obj) + np.array([0, 0, result.yaws[i]]))
+            targets.append([position[0], position[1], result.positions[i, 2] + np.ptp(bbox[:, 2]) / 2])
+        # Objects without a pose are not keyed, they must not stay visible at their previous location
+        self.visibility.hide(failed)
+        arrangement = Arrangement(placed, np.array(positions).reshape(-1, 3), np.array(rotations).reshape(-1, 3),
+                                  np.array(targets).reshape(-1, 3))
+        self.arrangements.append(arrangement)
+        return arrangement
+
+    def add_camera_poses(self, arrangement: Arrangement, cam2world_matrices: np.ndarray):
+        """Appends a frame per camera pose and keys the poses of the arrangement's objects on these frames."""
+        for cam2world_matrix in cam2world_matrices:
+            bproc.camera.add_camera_pose(cam2world_matrix, frame=self.num_frames)
+            for obj, position, rotation in zip(arrangement.objects, arrangement.positions, arrangement.rotations):
+                obj.set_location(position, frame=self.num_frames)
+                obj.set_rotation_euler(rotation, frame=self.num_frames)
+            arrangement.frames.append(self.num_frames)
+            self.num_frames += 1
+
+    def key_visibility(self):
+        """Keys hide_render of all objects of the batch on every frame, has to be called before rendering."""
+        with get_instrumentation().stage("keyframing"):
+            # Keyframed objects are hidden for the VisibilityManager, so it never overwrites their keys
+            self.visibility.hide(list(self._objects.values()))
+            for arrangement in self.arrangements:
+                members = set(o.get_name() for o in arrangement.objects)
+                for frame in arrangement.frames:
+                    for key, obj in self._objects.items():
+                        obj.blender_obj.hide_render = key not in members
+                        obj.blender_obj.keyframe_insert(data_path="hide_render", frame=frame)
+        get_instrumentation().count("batched_frames", self.num_frames)
+
+    def get_frame_arrangements(self) -> list:
+        """Arrangement of every rendered frame, in frame order."""
+        frames = [None] * self.num_frames
+        for arrangement in self.arrangements:
+            for frame in arrangement.frames:
+                frames[frame] = arrangement
+        return frames
+
+    def release(self):
+        """Removes all keyframes and leaves the objects of the batch hidden, in sync with the VisibilityManager."""
+        bproc.utility.reset_keyframes()
+        objects = list(self._objects.values())
+        for obj in objects:
+            obj.blender_obj.hide_render = True
+        self.visibility.track(objects)
+        self.arrangements = []
+        self.num_frames = 0
+        self._objects = {}
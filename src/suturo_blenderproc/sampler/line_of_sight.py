@@ -0,0 +1,109 @@
+import blenderproc as bproc
+import numpy as np
+
+from suturo_blenderproc.instrumentation import get_instrumentation
+
+
+def segments_hit_boxes(starts: np.ndarray, ends: np.ndarray, box_min: np.ndarray, box_max: np.ndarray,
+                       epsilon: float = 1e-6) -> np.ndarray:
+    """
+    Slab test of N segments against B axis aligned boxes, returns an (N, B) bool matrix. Touching a box at one of
+    the segment ends doesn't count as a hit.
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(ends, dtype=np.float64).reshape(-1, 3) - starts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1.0 / directions
+        t1 = (box_min[None, :, :] - starts[:, None, :]) * inverse[:, None, :]
+        t2 = (box_max[None, :, :] - starts[:, None, :]) * inverse[:, None, :]
+    # Axes the segment is parallel to: the slab is either never or always crossed
+    parallel = (directions == 0)[:, None, :]
+    inside_slab = (starts[:, None, :] >= box_min[None, :, :]) & (starts[:, None, :] <= box_max[None, :, :])
+    t_near = np.where(parallel, np.where(inside_slab, -np.inf, np.inf), np.minimum(t1, t2))
+    t_far = np.where(parallel, np.where(inside_slab, np.inf, -np.inf), np.maximum(t1, t2))
+    t_enter = np.max(t_near, axis=2)
+    t_exit = np.min(t_far, axis=2)
+    return (t_enter <= t_exit) & (t_exit > epsilon) & (t_enter < 1 - epsilon)
+
+
+def points_in_boxes(points: np.ndarray, box_min: np.ndarray, box_max: np.ndarray) -> np.ndarray:
+    """(N, B) bool matrix whether the points lie inside or on the border of the boxes."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    return np.all((points[:, None, :] >= box_min[None, :, :]) & (points[:, None, :] <= box_max[None, :, :]), axis=2)
+
+
+class LineOfSightFilter(object):
+    """
+    Rejects camera positions whose view on the position of interest or on the sampled objects is blocked by the
+    axis aligned bounding boxes of occluders, before any pose gets rendered. The test is conservative: a segment
+    through a box counts as blocked even if the mesh leaves a gap there, e.g. under a table or through an L-shaped
+    or open piece of furniture, so some views the renderer would show are rejected as well.
+
+    Boxes that contain one end of a segment are ignored for it, e.g. the shelf the objects stand in. Boxes that
+    enclose the camera, like the room or its walls, can therefore never occlude and should not be passed.
+    """
+
+    def __init__(self, bboxes: np.ndarray, padding: float = 0.0):
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 8, 3)
+        self.box_min = np.min(bboxes, axis=1) - padding
+        self.box_max = np.max(bboxes, axis=1) + padding
+        self.num_candidates = 0
+        self.num_occluded = 0
+
+    @classmethod
+    def from_objects(cls, objects: [bproc.types.MeshObject], padding: float = 0.0):
+        return cls(np.array([o.get_bound_box() for o in objects]), padding)
+
+    def __len__(self):
+        return len(self.box_min)
+
+    def copy(self):
+        """Filter with the same boxes and statistics of its own."""
+        line_of_sight = LineOfSightFilter(np.zeros(shape=(0, 8, 3)))
+        line_of_sight.box_min, line_of_sight.box_max = self.box_min.copy(), self.box_max.copy()
+        return line_of_sight
+
+    def get_wasted_fraction(self) -> float:
+        """Fraction of the tested camera positions that would have been occluded renders."""
+        if self.num_candidates == 0:
+            return 0.0
+        return self.num_occluded / self.num_candidates
+
+    def reset_statistics(self):
+        self.num_candidates = 0
+        self.num_occluded = 0
+
+    def are_segments_occluded(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """(N,) bool mask whether the segments are blocked by a box that contains none of their ends."""
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+        ends = np.broadcast_to(np.asarray(ends, dtype=np.float64), starts.shape)
+        if len(self) == 0:
+            return np.zeros(len(starts), dtype=bool)
+        hits = segments_hit_boxes(starts, ends, self.box_min, self.box_max)
+        hits &= ~points_in_boxes(starts, self.box_min, self.box_max)
+        hits &= ~points_in_boxes(ends, self.box_min, self.box_max)
+        return np.any(hits, axis=1)
+
+    def visible_mask(self, camera_positions: np.ndarray, poi: [float], targets: np.ndarray = None,
+                     min_visible_fraction: float = 1.0) -> np.ndarray:
+        """
+        Returns an (N,) bool mask of the camera positions that see the poi and at least min_visible_fraction of
+        the (M, 3) targets, e.g. the centers of the placed objects.
+        """
+        camera_positions = np.asarray(camera_positions, dtype=np.float64).reshape(-1, 3)
+        visible = ~self.are_segments_occluded(camera_positions, np.asarray(poi, dtype=np.float64).reshape(1, 3))
+        if targets is not None and len(targets) > 0:
+            targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+            num_cameras, num_targets = len(camera_positions), len(targets)
+            starts = np.repeat(camera_positions, num_targets, axis=0)
+            ends = np.tile(targets, (num_cameras, 1))
+            occluded = self.are_segments_occluded(starts, ends).reshape(num_cameras, num_targets)
+            visible &= np.mean(~occluded, axis=1) >= min_visible_fraction
+
+        num_occluded = int(np.count_nonzero(~visible))
+        self.num_candidates += len(camera_positions)
+        self.num_occluded += num_occluded
+        instrumentation = get_instrumentation()
+        instrumentation.count("line_of_sight_candidates", len(camera_positions))
+        instrumentation.count("line_of_sight_occluded", num_occluded)
+        return visible
@@ -2,6 +2,10 @@ from enum import Enum, auto
 import numpy as np
 import blenderproc as bproc
 
+from suturo_blenderproc.sampler.weighted_sampler import sample_less_probable_partitions, unique_class_indices
+from suturo_blenderproc.instrumentation import get_instrumentation
+from suturo_blenderproc.sampler.rng import get_rng
+
 
 class PartitionType(Enum):
     EQUAL_OBJECTS = auto()  # Gleichartige Objekte in der Partition
@@ -10,15 +14,20 @@ class PartitionType(Enum):
 
 
 class ObjectPartition(object):
-    def __init__(self, num_partitions: int, objects: [bproc.types.MeshObject]):
+    def __init__(self, num_partitions: int, objects: [bproc.types.MeshObject], rng: np.random.Generator = None):
         self.num_partitions = num_partitions
         self.objects = objects
+        self.rng = get_rng(rng)
         self._partitions = None
 
     def create_partition(self, partition_type: PartitionType, probability_reduction_factor: float = 0.99):
+        with get_instrumentation().stage("partitioning"):
+            return self._create_partition(partition_type, probability_reduction_factor)
+
+    def _create_partition(self, partition_type: PartitionType, probability_reduction_factor: float):
         num_objects = len(self.objects)
         objects = np.asarray(self.objects)
-        np.random.shuffle(objects)
+        self.rng.shuffle(objects)
         # Ensure that partitions created evenly
         objects = objects[0:(num_objects - num_objects % self.num_partitions)]
         if self.num_partitions <= 1:
@@ -29,43 +38,21 @@ class ObjectPartition(object):
             self._partitions = partitions
             return partitions
 
-        # Deletes duplicate objects, maybe rework it later
+        # Keeps only the first object of every class within a partition
         if partition_type == PartitionType.UNIQUE_OBJECTS:
-            object_names = [[o.get_name().split('.')[0] for o in partition] for partition in partitions]
-            for i, row in enumerate(object_names):
-                row = np.array(row)
-                indices = np.argsort(row)
-                _, count = np.unique(row, return_counts=True)
-                objects_sorted = np.take_along_axis(partitions[i], indices, axis=-1)
-                for j, c in enumerate(count):
-                    if c > 1:
-                        partitions[i] = np.delete(objects_sorted, np.s_[j + 1:j + c])
+            for i, partition in enumerate(partitions):
+                object_names = np.asarray([o.get_name().split('.')[0] for o in partition])
+                partitions[i] = partition[unique_class_indices(object_names)]
 
             self._partitions = partitions
             return partitions
 
         if partition_type == PartitionType.LESS_PROBABLE_OBJECTS:
             object_names = np.asarray([o.get_name().split('.')[0] for o in objects])
-            partitions_size = int(num_objects / self.num_partitions)
-            partitions = np.empty(shape=[self.num_partitions, partitions_size], dtype=object)
-            for i in range(self.num_partitions):
-                probabilities = np.repeat(a=1 / num_objects, repeats=num_objects)
-                for j in range(partitions_size):
-                    selected_idx = np.random.choice(np.arange(num_objects), size=1, p=probabilities)[0]
-                    selected_object = objects[selected_idx]
-
-                    # Aktualisieren der Partition und Objektlisten
-                    partitions[i, j] = selected_object
-                    object_indices = (object_names == object_names[selected_idx])
-                    probabilities[object_indices] *= probability_reduction_factor
-                    # Entfernen des ausgewählten Objekts
-                    object_names = np.delete(object_names, selected_idx)
-                    probabilities = np.delete(probabilities, selected_idx)
-                    objects = np.delete(objects, selected_idx)
-
-                    # Normalisieren der Wahrscheinlichkeiten
-                    probabilities /= np.sum(probabilities)
-                    num_objects -= 1
+            partitions_size = int(len(objects) / self.num_partitions)
+            indices = sample_less_probable_partitions(object_names, self.num_partitions, partitions_size,
+                                                      probability_reduction_factor, self.rng)
+            partitions = objects[indices]
             self._partitions = partitions
             return partitions.tolist()
 
@@ -0,0 +1,153 @@
+import blenderproc as bproc
+import numpy as np
+
+from suturo_blenderproc.types.surface_set import SurfaceSet
+from suturo_blenderproc.instrumentation import get_instrumentation
+from suturo_blenderproc.sampler.rng import get_rng
+
+
+def get_object_footprints(objects: [bproc.types.MeshObject]):
+    """
+    Returns the footprint radii of the objects and the offsets between their origin and the bottom of their
+    bounding box. The footprint is the circle around the origin that covers the bounding box under every yaw.
+    """
+    radii = np.zeros(len(objects))
+    z_offsets = np.zeros(len(objects))
+    for i, obj in enumerate(objects):
+        bbox = np.array(obj.get_bound_box())
+        location = np.array(obj.get_location())
+        radii[i] = np.max(np.linalg.norm(bbox[:, :2] - location[:2], axis=1))
+        z_offsets[i] = location[2] - np.min(bbox[:, 2])
+    return radii, z_offsets
+
+
+class PlacementResult(object):
+    def __init__(self, num_objects: int):
+        self.positions = np.zeros(shape=(num_objects, 3))
+        self.yaws = np.zeros(num_objects)
+        self.tries = np.zeros(num_objects, dtype=np.int64)
+        self.success = np.zeros(num_objects, dtype=bool)
+
+
+class BatchPlacementSampler(object):
+    """
+    Places objects on surfaces by dart throwing with footprints: every try draws batch_size candidate positions
+    at once, tests them against the surface and the already placed objects in NumPy and takes the first valid one.
+    Only the final poses are written to Blender.
+
+    A candidate is valid if its footprint lies on the surface, on its support polygon if known, doesn't overlap
+    another footprint and the distance to the closest object on the same surface lies in
+    [min_distance, max_distance], as in bproc.object.sample_poses_on_surface.
+
+    Candidates are drawn over the whole surface shrunk by the footprint radius, not only over the central 2/3 of
+    the surface like ObjectPoseSampler.sample_object_pose_uniform, so objects also end up close to the edges.
+
+    The sampled yaw replaces the yaw of the rotation an object had when it was placed for the first time, it is
+    not added to its current rotation. A pose therefore only depends on the draws of its own call.
+    """
+
+    def __init__(self, surfaces: SurfaceSet, min_distance: float = 0.3, max_distance: float = 0.7,
+                 max_tries: int = 333, batch_size: int = 64, rng: np.random.Generator = None):
+        self.surfaces = surfaces
+        self.rng = get_rng(rng)
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        self.max_tries = max_tries
+        self.batch_size = batch_size
+        self.num_tries = 0
+        self.num_placed = 0
+        # Candidates are only tested against the surface they are drawn for
+        self._single_surfaces = [surfaces.subset([k]) for k in range(len(surfaces))]
+        self._base_rotations = {}
+
+    def get_rejection_rate(self) -> float:
+        if self.num_tries == 0:
+            return 0.0
+        return 1 - self.num_placed / self.num_tries
+
+    def get_base_rotation(self, obj: bproc.types.MeshObject) -> np.ndarray:
+        """Euler rotation of obj before it was placed for the first time, recorded on the first call."""
+        key = obj.get_name()
+        if key not in self._base_rotations:
+            self._base_rotations[key] = np.array(obj.get_rotation_euler())
+        return self._base_rotations[key]
+
+    def _sample_candidates(self, surface_idx: int, radius: float, num: int) -> np.ndarray:
+        polygon = self.surfaces.polygons[surface_idx]
+        if polygon is not None:
+            low, high = polygon.bounds()
+            center, half_extents = (low + high) / 2, np.maximum((high - low) / 2 - radius, 0)
+        else:
+            center = self.surfaces.centers[surface_idx, :2]
+            half_extents = np.maximum(self.surfaces.extents[surface_idx] / 2 - radius, 0)
+        return self.rng.uniform(center - half_extents, center + half_extents, size=(num, 2))
+
+    def _place_one(self, surface_idx: int, radius: float, placed_xy: np.ndarray, placed_radii: np.ndarray):
+        tries = 0
+        while tries < self.max_tries:
+            num = min(self.batch_size, self.max_tries - tries)
+            candidates = self._sample_candidates(surface_idx, radius, num)
+            valid = self._single_surfaces[surface_idx].contains_points(candidates, margin=radius)[:, 0]
+            if len(placed_xy) > 0:
+                distances = np.linalg.norm(candidates[:, None, :] - placed_xy[None, :, :], axis=2)
+                closest = np.min(distances, axis=1)
+                valid &= np.all(distances >= placed_radii[None, :] + radius, axis=1)
+                valid &= (closest >= self.min_distance) & (closest <= self.max_distance)
+
+            hits = np.flatnonzero(valid)
+            if len(hits) > 0:
+                return candidates[hits[0]], tries + hits[0] + 1
+            tries += num
+        return None, tries
+
+    def sample(self, radii: np.ndarray, surface_indices: np.ndarray) -> PlacementResult:
+        """
+        Samples xy positions and yaws for objects with the given footprint radii on the given surfaces. Objects
+        with a negative surface index, e.g. ones the SurfaceScheduler found no room for, are not placed.
+        """
+        radii = np.asarray(radii, dtype=np.float64)
+        surface_indices = np.broadcast_to(np.asarray(surface_indices), radii.shape)
+        result = PlacementResult(len(radii))
+        result.yaws = self.rng.uniform(0, 6, size=len(radii))
+        for surface_idx in np.unique(surface_indices[surface_indices >= 0]):
+            placed = []
+            for i in np.flatnonzero(surface_indices == surface_idx):
+                placed_idx = np.array(placed, dtype=np.int64)
+                xy, tries = self._place_one(surface_idx, radii[i], result.positions[placed_idx, :2],
+                                            radii[placed_idx])
+                result.tries[i] = tries
+                if xy is not None:
+                    result.positions[i] = [xy[0], xy[1], self.surfaces.heights[surface_idx]]
+                    result.success[i] = True
+                    placed.append(i)
+
+        self.num_tries += int(np.sum(result.tries))
+        self.num_placed += int(np.count_nonzero(result.success))
+        instrumentation = get_instrumentation()
+        instrumentation.count("placement_tries", int(np.sum(result.tries)))
+        instrumentation.count("placement_failures", int(np.count_nonzero(~result.success)))
+        return result
+
+    def place(self, objects: [bproc.types.MeshObject], surface_indices=0, visibility=None) -> PlacementResult:
+        """
+        Samples the poses of all objects and writes the successful ones to Blender. Objects that could not be
+        placed are hidden, through the VisibilityManager if one is given, so they don't show up in the render at
+        their previous location.
+        """
+        with get_instrumentation().stage("object_placement"):
+            radii, z_offsets = get_object_footprints(objects)
+            result = self.sample(radii, surface_indices)
+            failed = [obj for i, obj in enumerate(objects) if not result.success[i]]
+            if visibility is not None:
+                visibility.hide(failed)
+            else:
+                for obj in failed:
+                    obj.blender_obj.hide_render = True
+            for i, obj in enumerate(objects):
+                if not result.success[i]:
+                    print(f"Could not place {obj.get_name()} after {result.tries[i]} tries")
+                    continue
+                result.positions[i, 2] += z_offsets[i]
+                obj.set_location(result.positions[i])
+                obj.set_rotation_euler(self.get_base_rotation(obj) + np.array([0, 0, result.yaws[i]]))
+        return result
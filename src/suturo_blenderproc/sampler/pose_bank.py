@@ -0,0 +1,197 @@
+import blenderproc as bproc
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from suturo_blenderproc.sampler.pose_sampler import CameraPoseSampler
+from suturo_blenderproc.instrumentation import get_instrumentation
+from suturo_blenderproc.sampler.rng import get_rng
+
+POSE_BANK_VERSION = 2
+
+
+def look_at_matrices(camera_positions: np.ndarray, poi: [float]) -> np.ndarray:
+    """
+    Vectorized build_cam_pose without inplane rotation: (N, 4, 4) cam2world matrices of cameras that look from
+    camera_positions at poi with the image y axis pointing up, like bproc.camera.rotation_from_forward_vec.
+    """
+    camera_positions = np.asarray(camera_positions, dtype=np.float64).reshape(-1, 3)
+    forward = np.asarray(poi, dtype=np.float64).reshape(1, 3) - camera_positions
+    forward /= np.maximum(np.linalg.norm(forward, axis=1, keepdims=True), 1e-12)
+    right = np.cross(forward, np.array([0.0, 0.0, 1.0]))
+    right_norm = np.linalg.norm(right, axis=1, keepdims=True)
+    # Looking straight up or down, any horizontal axis works as right vector
+    right = np.where(right_norm > 1e-9, right / np.maximum(right_norm, 1e-12), np.array([1.0, 0.0, 0.0]))
+    up = np.cross(right, forward)
+
+    matrices = np.zeros(shape=(len(camera_positions), 4, 4))
+    matrices[:, :3, 0] = right
+    matrices[:, :3, 1] = up
+    matrices[:, :3, 2] = -forward
+    matrices[:, :3, 3] = camera_positions
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def get_pose_bank_key(scene_id: str, poi: [float], mode: str, parameters: dict) -> str:
+    description = {"version": POSE_BANK_VERSION, "scene": scene_id, "poi": [float(v) for v in poi], "mode": mode,
+                   "parameters": parameters}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class CameraPoseBank(object):
+    """
+    Precomputed valid cam2world matrices of one (scene, poi, sampling mode). The matrices are sorted by stratum,
+    a cell of azimuth and distance bins around the sampling center, and stored as .npy next to a .json with the
+    stratum offsets. Loaded banks are memory mapped, so parallel workers share the pages of one file.
+
+    Draws walk through the non-empty strata in a shuffled order and take a uniform pose inside the stratum, so every
+    draw is O(1) and consecutive draws cover the azimuth and distance range evenly. The order is drawn from the rng
+    of every call and the bank keeps no state between calls, so the poses of an iteration only depend on its own
+    random stream and not on the draws of earlier iterations.
+    """
+
+    def __init__(self, matrices: np.ndarray, strata_offsets: np.ndarray, metadata: dict):
+        self.matrices = matrices
+        self.strata_offsets = np.asarray(strata_offsets, dtype=np.int64)
+        self.metadata = metadata
+        self._strata = np.flatnonzero(np.diff(self.strata_offsets) > 0)
+
+    @classmethod
+    def create(cls, matrices: np.ndarray, center: [float], num_azimuth_bins: int, num_distance_bins: int,
+               metadata: dict):
+        positions = matrices[:, :3, 3]
+        offsets = positions[:, :2] - np.asarray(center, dtype=np.float64)[:2]
+        # Azimuth measured like in get_sampled_circular_cam_poses, x = sin and y = cos
+        azimuths = np.mod(np.arctan2(offsets[:, 0], offsets[:, 1]), 2 * np.pi)
+        distances = np.linalg.norm(offsets, axis=1)
+        azimuth_bins = np.minimum((azimuths / (2 * np.pi) * num_azimuth_bins).astype(np.int64), num_azimuth_bins - 1)
+        d_min, d_max = (np.min(distances), np.max(distances)) if len(distances) > 0 else (0.0, 0.0)
+        scale = num_distance_bins / (d_max - d_min) if d_max > d_min else 0.0
+        distance_bins = np.minimum(((distances - d_min) * scale).astype(np.int64), num_distance_bins - 1)
+
+        strata = azimuth_bins * num_distance_bins + distance_bins
+        order = np.argsort(strata, kind="stable")
+        counts = np.bincount(strata, minlength=num_azimuth_bins * num_distance_bins)
+        metadata = dict(metadata, center=[float(v) for v in center[:2]], num_azimuth_bins=num_azimuth_bins,
+                        num_distance_bins=num_distance_bins, num_poses=len(matrices))
+        return cls(np.ascontiguousarray(matrices[order]), np.concatenate([[0], np.cumsum(counts)]), metadata)
+
+    @staticmethod
+    def get_paths(bank_dir, key: str) -> (Path, Path):
+        bank_dir = Path(bank_dir)
+        return bank_dir.joinpath(f"{key}.poses.npy"), bank_dir.joinpath(f"{key}.json")
+
+    def save(self, bank_dir):
+        bank_dir = Path(bank_dir)
+        bank_dir.mkdir(parents=True, exist_ok=True)
+        matrices_path, metadata_path = self.get_paths(bank_dir, self.metadata["key"])
+        metadata = dict(self.metadata, strata_offsets=self.strata_offsets.tolist())
+        # The matrices are replaced first, a bank is only complete once its metadata exists
+        for path, write in [(matrices_path, lambda f: np.save(f, self.matrices)),
+                            (metadata_path, lambda f: f.write(json.dumps(metadata).encode()))]:
+            fd, tmp_path = tempfile.mkstemp(dir=bank_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write(f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    @classmethod
+    def load(cls, bank_dir, key: str, mmap: bool = True):
+        """Returns the bank stored under key or None if it doesn't exist or is incomplete."""
+        matrices_path, metadata_path = cls.get_paths(bank_dir, key)
+        if not metadata_path.is_file() or not matrices_path.is_file():
+            return None
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+        matrices = np.load(matrices_path, mmap_mode='r' if mmap else None)
+        if metadata.get("version") != POSE_BANK_VERSION or len(matrices) != metadata["num_poses"]:
+            return None
+        strata_offsets = metadata.pop("strata_offsets")
+        return cls(matrices, strata_offsets, metadata)
+
+    @classmethod
+    def get_or_build_circular(cls, bank_dir, scene_id: str, camera_pose_sampler: CameraPoseSampler,
+                              num_poses: int, radius: float, center: np.ndarray, height: float, poi: [float],
+                              max_radius: float = None, angle_step: int = 5, num_azimuth_bins: int = 12,
+                              num_distance_bins: int = 3):
+        """
+        Loads the bank of the circular sampling mode or builds it with the bounds and line of sight checks of
+        camera_pose_sampler. The bank is built with a seed derived from its key, so workers that build it at the
+        same time write identical files.
+        """
+        parameters = {"radius": float(radius), "max_radius": float(max_radius if max_radius is not None else radius),
+                      "center": [float(v) for v in center[:2]], "height": float(height), "angle_step": angle_step,
+                      "num_poses": num_poses, "num_azimuth_bins": num_azimuth_bins,
+                      "num_distance_bins": num_distance_bins,
+                      "occluders": len(camera_pose_sampler.line_of_sight or [])}
+        key = get_pose_bank_key(scene_id, poi, "circular", parameters)
+        bank = cls.load(bank_dir, key)
+        if bank is not None:
+            return bank
+
+        # A copy of the filter, the candidates of the bank are not part of the statistics of the rendered poses
+        line_of_sight = camera_pose_sampler.line_of_sight
+        sampler = CameraPoseSampler(camera_pose_sampler.walls, rng=np.random.default_rng(int(key[:16], 16)),
+                                    line_of_sight=line_of_sight.copy() if line_of_sight is not None else None)
+        positions = sampler._sample_visible_positions(
+            lambda num: sampler.sample_cam_positions_circular(num, radius, center, height, max_radius, angle_step),
+            num_poses, poi, fallback=False)
+        metadata = {"version": POSE_BANK_VERSION, "key": key, "scene": scene_id, "mode": "circular",
+                    "poi": [float(v) for v in poi], "parameters": parameters}
+        bank = cls.create(look_at_matrices(positions, poi), center, num_azimuth_bins, num_distance_bins, metadata)
+        bank.save(bank_dir)
+        return cls.load(bank_dir, key)
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def draw_indices(self, num: int, rng: np.random.Generator = None) -> np.ndarray:
+        if len(self._strata) == 0:
+            raise Exception("The camera pose bank is empty")
+        rng = get_rng(rng)
+        num_rounds = -(-num // len(self._strata))
+        strata = np.concatenate([rng.permutation(self._strata) for _ in range(num_rounds)] +
+                                [np.zeros(0, dtype=np.int64)])[:num]
+        return rng.integers(self.strata_offsets[strata], self.strata_offsets[strata + 1])
+
+    def draw(self, num: int, rng: np.random.Generator = None) -> np.ndarray:
+        """(num, 4, 4) cam2world matrices drawn stratified from the bank."""
+        return np.array(self.matrices[self.draw_indices(num, rng)])
+
+    def draw_visible(self, num: int, line_of_sight, targets: np.ndarray = None, min_visible_fraction: float = 1.0,
+                     rng: np.random.Generator = None, max_rounds: int = 10) -> np.ndarray:
+        """
+        Draws poses that additionally see the targets of the current iteration, e.g. the placed objects. If the
+        filter rejects every drawn pose, unfiltered poses are used, so an arrangement never silently gets no frames.
+        """
+        if line_of_sight is None or targets is None or len(targets) == 0:
+            return self.draw(num, rng)
+        visible = []
+        num_visible = 0
+        for _ in range(max_rounds):
+            matrices = self.draw(2 * (num - num_visible), rng)
+            mask = line_of_sight.visible_mask(matrices[:, :3, 3], self.metadata["poi"], targets, min_visible_fraction)
+            visible.append(matrices[mask])
+            num_visible += int(np.count_nonzero(mask))
+            if num_visible >= num:
+                break
+        if num_visible == 0 and num > 0:
+            print(f"No banked camera pose sees the objects, using {num} unfiltered poses")
+            get_instrumentation().count("line_of_sight_fallbacks")
+            return self.draw(num, rng)
+        if num_visible < num:
+            print(f"Only found {num_visible} of {num} banked camera poses with a free line of sight")
+        return np.concatenate(visible)[:num]
+
+    def add_camera_poses(self, matrices: np.ndarray):
+        for cam2world_matrix in matrices:
+            bproc.camera.add_camera_pose(cam2world_matrix)
@@ -1,21 +1,32 @@
 import blenderproc as bproc
+from enum import Enum, auto
 import numpy as np
 
 import suturo_blenderproc.types.table
 import suturo_blenderproc.types.entity
+import suturo_blenderproc.types.wall
+from suturo_blenderproc.types.surface_set import SurfaceSet, SurfaceView
+from suturo_blenderproc.instrumentation import get_instrumentation
+from suturo_blenderproc.sampler.rng import get_rng
 
 
-def build_cam_pose(camera_position, poi):
-    rotation_matrix = bproc.camera.rotation_from_forward_vec(poi - np.array(camera_position),
-                                                             inplane_rot=np.random.uniform(0, 0))
+def build_cam_pose(camera_position, poi, rng: np.random.Generator = None):
+    inplane_rot = rng.uniform(0, 0) if rng is not None else 0.0
+    rotation_matrix = bproc.camera.rotation_from_forward_vec(poi - np.array(camera_position), inplane_rot=inplane_rot)
     # Add homog cam pose based on location an rotation
     cam2world_matrix = bproc.math.build_transformation_mat(camera_position, rotation_matrix)
     bproc.camera.add_camera_pose(cam2world_matrix)
 
 
 class CameraPoseSampler(object):
-    def __init__(self, walls):
+    def __init__(self, walls, rng: np.random.Generator = None, line_of_sight=None, max_sampling_rounds: int = 10):
         self.walls = walls
+        self.rng = get_rng(rng)
+        # Optional LineOfSightFilter, the batched samplers only build poses that pass it
+        self.line_of_sight = line_of_sight
+        self.max_sampling_rounds = max_sampling_rounds
+        self.num_candidates = 0
+        self.num_rejected = 0
 
     def is_position_out_of_bounds(self, position) -> bool:
         bbox = self.walls.bbox
@@ -23,20 +34,44 @@ class CameraPoseSampler(object):
         bool2 = np.less(position, np.min(bbox, axis=0))
         return np.any(bool1) or np.any(bool2)
 
+    def are_positions_out_of_bounds(self, positions: np.ndarray) -> np.ndarray:
+        """Vectorized version of is_position_out_of_bounds for an (N, 3) array, returns an (N,) bool mask."""
+        bbox = self.walls.bbox
+        positions = np.atleast_2d(positions)
+        bool1 = np.greater(positions, np.max(bbox, axis=0))
+        bool2 = np.less(positions, np.min(bbox, axis=0))
+        return np.any(bool1 | bool2, axis=1)
+
+    def get_rejection_rate(self) -> float:
+        if self.num_candidates == 0:
+            return 0.0
+        return self.num_rejected / self.num_candidates
+
+    def reset_statistics(self):
+        self.num_candidates = 0
+        self.num_rejected = 0
+
+    def _record_candidates(self, num_candidates: int, num_rejected: int):
+        self.num_candidates += num_candidates
+        self.num_rejected += num_rejected
+        instrumentation = get_instrumentation()
+        instrumentation.count("camera_candidates", num_candidates)
+        instrumentation.count("camera_rejections", num_rejected)
+
     def build_cam_poses_from_config(self, camera_positions: [float], poi: [float]):
 
         if self.is_position_out_of_bounds(poi):
             raise Exception("Position of Interest is out of bounds, pls use a valid poi")
 
-        step = 0
-        while step != len(camera_positions):
-            camera_position = camera_positions[step]
+        num_rejected = 0
+        for camera_position in camera_positions:
             if not self.is_position_out_of_bounds(camera_position):
-                build_cam_pose(camera_position, poi)
-                step += 1
+                build_cam_pose(camera_position, poi, self.rng)
             else:
-                print("Camera position is out of bounds")
-                continue
+                num_rejected += 1
+        if num_rejected > 0:
+            print(f"Skipped {num_rejected} of {len(camera_positions)} configured camera positions, they are out "
+                  f"of bounds")
 
     def get_sampled_cam_poses(self, num_poses: int, dimensions: np.ndarray, center: np.ndarray, offset: float,
                               poi: [float], height: float):
@@ -45,105 +80,298 @@ class CameraPoseSampler(object):
             raise Exception("Position of Interest is out of bounds, pls use a valid poi")
 
         step = 0
+        num_rejected = 0
         while step != num_poses:
             lower_bound = np.append(center[:2] - (dimensions[:2] / 2) - offset, height)
             upper_bound = np.append(center[:2] + (dimensions[:2] / 2) + offset, height)
-            camera_position = np.random.uniform(lower_bound, upper_bound)
+            camera_position = self.rng.uniform(lower_bound, upper_bound)
             if not self.is_position_out_of_bounds(camera_position):
-                build_cam_pose(camera_position, poi)
+                build_cam_pose(camera_position, poi, self.rng)
+                self._record_candidates(1, 0)
                 step += 1
             else:
-                print("Camera position is out of bounds")
-                continue
+                self._record_candidates(1, 1)
+                num_rejected += 1
+        if num_rejected > 0:
+            print(f"Rejected {num_rejected} camera positions that were out of bounds")
 
     def get_sampled_circular_cam_poses(self, num_poses: int, radius: float, center: np.ndarray, height: float,
                                        poi: [float]):
         step = 0
+        num_rejected = 0
         while step != num_poses:
-            radian = np.random.randint(360 / 5) * 5
+            radian = self.rng.integers(360 / 5) * 5
             x = center[0] + radius * np.sin(radian * np.pi / 180.0)
             y = center[1] + radius * np.cos(radian * np.pi / 180.0)
             camera_position = np.array([x, y, height])
             if not self.is_position_out_of_bounds(camera_position):
-                build_cam_pose(camera_position, poi)
+                build_cam_pose(camera_position, poi, self.rng)
+                self._record_candidates(1, 0)
                 step += 1
             else:
-                print("Camera position is out of bounds")
-                continue
+                self._record_candidates(1, 1)
+                num_rejected += 1
+        if num_rejected > 0:
+            print(f"Rejected {num_rejected} camera positions that were out of bounds")
+
+    def _check_height(self, height: float):
+        bbox = self.walls.bbox
+        z_min, z_max = np.min(bbox, axis=0)[2], np.max(bbox, axis=0)[2]
+        if not z_min <= height <= z_max:
+            raise Exception(f"Camera height {height} is outside of the room bounds [{z_min}, {z_max}]")
+
+    def sample_cam_positions_rectangular(self, num_poses: int, dimensions: np.ndarray, center: np.ndarray,
+                                         offset: float, height: float) -> np.ndarray:
+        """
+        Draws num_poses camera positions at once from the sampling rectangle of get_sampled_cam_poses.
+        The rectangle is clipped to the room bounds beforehand, so no candidate has to be rejected.
+        """
+        self._check_height(height)
+        bbox = self.walls.bbox
+        lower_bound = np.maximum(center[:2] - (dimensions[:2] / 2) - offset, np.min(bbox, axis=0)[:2])
+        upper_bound = np.minimum(center[:2] + (dimensions[:2] / 2) + offset, np.max(bbox, axis=0)[:2])
+        if np.any(lower_bound > upper_bound):
+            raise Exception("Sampling region for camera positions does not intersect the room bounds")
+
+        def draw(num: int) -> np.ndarray:
+            xy = self.rng.uniform(lower_bound, upper_bound, size=(num, 2))
+            return np.column_stack([xy, np.full(num, height)])
+
+        return self._draw_in_bounds(draw, num_poses)
+
+    def sample_cam_positions_circular(self, num_poses: int, radius: float, center: np.ndarray, height: float,
+                                      max_radius: float = None, angle_step: int = 5) -> np.ndarray:
+        """
+        Draws num_poses camera positions at once from the annulus [radius, max_radius] around center. Like
+        get_sampled_circular_cam_poses the azimuth is uniform on a grid of angle_step degrees and the distance is
+        uniform in [radius, max_radius], with max_radius = radius this is exactly the distribution of the loop. For
+        every azimuth the radial interval is clipped to the room bounds and azimuths without a valid interval are
+        left out, so no candidate has to be rejected.
+        """
+        self._check_height(height)
+        if max_radius is None:
+            max_radius = radius
+        if max_radius < radius:
+            raise Exception("max_radius has to be greater or equal to radius")
+
+        bbox = self.walls.bbox
+        lower, upper = np.min(bbox, axis=0)[:2], np.max(bbox, axis=0)[:2]
+        angles = np.deg2rad(np.arange(0, 360, angle_step))
+        directions = np.column_stack([np.sin(angles), np.cos(angles)])
+
+        # Slab test of the rays center + t * direction against the xy rectangle of the room
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t1 = (lower - center[:2]) / directions
+            t2 = (upper - center[:2]) / directions
+        inside_slab = (center[:2] >= lower) & (center[:2] <= upper)
+        t_near = np.where(directions == 0, np.where(inside_slab, -np.inf, np.inf), np.minimum(t1, t2))
+        t_far = np.where(directions == 0, np.where(inside_slab, np.inf, -np.inf), np.maximum(t1, t2))
+        r_min = np.maximum(np.max(t_near, axis=1), radius)
+        r_max = np.minimum(np.min(t_far, axis=1), max_radius)
+
+        valid = r_min <= r_max
+        if not np.any(valid):
+            raise Exception("Sampling annulus for camera positions does not intersect the room bounds")
+
+        valid_angles = np.flatnonzero(valid)
+
+        def draw(num: int) -> np.ndarray:
+            idx = valid_angles[self.rng.integers(len(valid_angles), size=num)]
+            radii = self.rng.uniform(r_min[idx], r_max[idx])
+            xy = center[:2] + radii[:, None] * directions[idx]
+            return np.column_stack([xy, np.full(num, height)])
+
+        return self._draw_in_bounds(draw, num_poses)
+
+    def _draw_in_bounds(self, draw, num_poses: int) -> np.ndarray:
+        """
+        Calls draw(num) until num_poses positions lie inside the room bounds. The sampling regions are clipped to
+        the bounds already, only rounding at the border can put a candidate outside and make a second round
+        necessary. After max_sampling_rounds the positions found so far are returned and the shortfall is reported.
+        """
+        found = [np.zeros(shape=(0, 3))]
+        num_found = 0
+        for _ in range(self.max_sampling_rounds):
+            if num_found >= num_poses:
+                break
+            positions = draw(num_poses - num_found)
+            rejected = self.are_positions_out_of_bounds(positions)
+            self._record_candidates(len(positions), int(np.count_nonzero(rejected)))
+            found.append(positions[~rejected])
+            num_found += len(positions) - int(np.count_nonzero(rejected))
+        if num_found < num_poses:
+            print(f"Only found {num_found} of {num_poses} camera positions inside the room bounds")
+        return np.concatenate(found)[:num_poses]
 
+    def _sample_visible_positions(self, sample_positions, num_poses: int, poi: [float], targets: np.ndarray = None,
+                                  min_visible_fraction: float = 1.0, fallback: bool = True) -> np.ndarray:
+        """
+        Draws positions with sample_positions(num) until num_poses of them pass the line of sight filter. Every round
+        oversamples the missing poses twice, after max_sampling_rounds the visible positions found so far are used.
+        If the filter rejects every candidate and fallback is set, unfiltered positions are used instead, the filter
+        is conservative and the views may still be free.
+        """
+        if self.line_of_sight is None:
+            return sample_positions(num_poses)
 
-def set_random_rotation_euler_zaxis(mesh_object: bproc.types.MeshObject):
-    rotation = np.random.uniform([0, 0, 0], [0, 0, 6])
+        visible = []
+        num_visible = 0
+        for _ in range(self.max_sampling_rounds):
+            positions = sample_positions(2 * (num_poses - num_visible))
+            positions = positions[self.line_of_sight.visible_mask(positions, poi, targets, min_visible_fraction)]
+            visible.append(positions)
+            num_visible += len(positions)
+            if num_visible >= num_poses:
+                break
+        if num_visible == 0 and num_poses > 0 and fallback:
+            print(f"No camera position with a free line of sight, using {num_poses} unfiltered positions")
+            get_instrumentation().count("line_of_sight_fallbacks")
+            return sample_positions(num_poses)
+        if num_visible < num_poses:
+            print(f"Only found {num_visible} of {num_poses} camera positions with a free line of sight")
+        return np.concatenate(visible)[:num_poses]
+
+    def get_sampled_cam_poses_batched(self, num_poses: int, dimensions: np.ndarray, center: np.ndarray,
+                                      offset: float, poi: [float], height: float, targets: np.ndarray = None,
+                                      min_visible_fraction: float = 1.0) -> np.ndarray:
+        if self.is_position_out_of_bounds(poi):
+            raise Exception("Position of Interest is out of bounds, pls use a valid poi")
+
+        with get_instrumentation().stage("camera_sampling"):
+            positions = self._sample_visible_positions(
+                lambda num: self.sample_cam_positions_rectangular(num, dimensions, center, offset, height),
+                num_poses, poi, targets, min_visible_fraction)
+            for camera_position in positions:
+                build_cam_pose(camera_position, poi, self.rng)
+        return positions
+
+    def get_sampled_circular_cam_poses_batched(self, num_poses: int, radius: float, center: np.ndarray,
+                                               height: float, poi: [float], max_radius: float = None,
+                                               angle_step: int = 5, targets: np.ndarray = None,
+                                               min_visible_fraction: float = 1.0) -> np.ndarray:
+        with get_instrumentation().stage("camera_sampling"):
+            positions = self._sample_visible_positions(
+                lambda num: self.sample_cam_positions_circular(num, radius, center, height, max_radius, angle_step),
+                num_poses, poi, targets, min_visible_fraction)
+            for camera_position in positions:
+                build_cam_pose(camera_position, poi, self.rng)
+        return positions
+
+
+def set_random_rotation_euler_zaxis(mesh_object: bproc.types.MeshObject, rng: np.random.Generator = None):
+    rotation = get_rng(rng).uniform([0, 0, 0], [0, 0, 6])
     mesh_object.set_rotation_euler(mesh_object.get_rotation_euler() + rotation)
 
 
 class ObjectPoseSampler(object):
-    def __init__(self, surface: suturo_blenderproc.types.entity.Entity):
+    def __init__(self, surface, rng: np.random.Generator = None):
         self.surface = surface
+        self.rng = get_rng(rng)
+        if isinstance(surface, SurfaceView):
+            self._surface_set, self._surface_idx = surface.surface_set, surface.index
+        else:
+            self._surface_set, self._surface_idx = SurfaceSet.from_entities([surface]), 0
 
     def sample_object_pose_gaussian(self, obj: bproc.types.MeshObject):
         surface = self.surface
         center = surface.center
-        variance_x = 1
-        variance_y = 1
-        if isinstance(surface, suturo_blenderproc.types.table.RectangularTable):
-            variance_x = surface.x_size * 2 / 3
-            variance_y = surface.y_size * 2 / 3
-        if isinstance(surface, suturo_blenderproc.types.table.RoundTable):
-            variance_x = surface.radius * 2 / 3
-            variance_y = surface.radius * 2 / 3
-        if isinstance(surface, suturo_blenderproc.types.table.OvalTable):
-            variance_x = surface.semi_major_x * 2 / 3
-            variance_y = surface.semi_major_y * 2 / 3
+        variance_x, variance_y = self._surface_set.sampling_dimensions()[self._surface_idx]
 
         cov = [[variance_x, 0], [0, variance_y]]
         mean = center[:2]
-        xy = np.random.multivariate_normal(mean=mean, cov=cov)
+        xy = self.rng.multivariate_normal(mean=mean, cov=cov)
         x, y = np.clip(xy, a_min=mean - [variance_x, variance_y], a_max=mean + [variance_x, variance_y])
         obj.set_location([x, y, surface.height])
-        set_random_rotation_euler_zaxis(obj)
+        set_random_rotation_euler_zaxis(obj, self.rng)
 
     def sample_object_pose_uniform(self, obj: bproc.types.MeshObject):
         surface = self.surface
         center = surface.center
-        dimensions = None
-        if isinstance(surface, suturo_blenderproc.types.table.RectangularTable):
-            dimensions = np.array([surface.x_size * 2 / 3, surface.y_size * 2 / 3])
-        if isinstance(surface, suturo_blenderproc.types.table.RoundTable):
-            dimensions = np.array([surface.radius * 2 / 3, surface.radius * 2 / 3])
-        if isinstance(surface, suturo_blenderproc.types.table.OvalTable):
-            dimensions = np.array([surface.semi_major_x * 2 / 3, surface.semi_major_y * 2 / 3])
-
-        if dimensions is None:
-            raise Exception("Unrecognized surface type")
+        dimensions = self._surface_set.sampling_dimensions()[self._surface_idx]
 
         lower_bound = np.append(center[:2] - (dimensions / 2), surface.height)
         upper_bound = np.append(center[:2] + (dimensions / 2), surface.height)
-        object_pose = np.random.uniform(lower_bound, upper_bound)
+        object_pose = self.rng.uniform(lower_bound, upper_bound)
         obj.set_location(object_pose)
-        set_random_rotation_euler_zaxis(obj)
+        set_random_rotation_euler_zaxis(obj, self.rng)
+
+
+class LightLayout(Enum):
+    CROSS = auto()
+    GRID = auto()
+    RING = auto()
+
+
+class LightPool(object):
+    """
+    Lights that are created once and reused, sampling a new lighting only changes their location, energy and color.
+    Lights a configuration doesn't need are switched off, so the number of scene objects stays constant.
+    """
+
+    def __init__(self, size: int):
+        self.lights = [bproc.types.Light() for _ in range(size)]
+
+    def __len__(self):
+        return len(self.lights)
+
+    def apply(self, positions: np.ndarray, energies: np.ndarray, colors: np.ndarray = None):
+        if len(positions) > len(self.lights):
+            raise Exception(f"The light pool has {len(self.lights)} lights, {len(positions)} were requested")
+        for i, light in enumerate(self.lights):
+            if i < len(positions):
+                light.set_location(positions[i])
+                light.set_energy(float(energies[i]))
+                light.set_color(colors[i] if colors is not None else [1, 1, 1])
+            else:
+                light.set_energy(0)
 
 
-# Noch nicht benutzen, das ist WIP
 class LightPoseSampler(object):
-    def __init__(self, walls: suturo_blenderproc.types.wall.Wall):
+    def __init__(self, walls: suturo_blenderproc.types.wall.Wall, rng: np.random.Generator = None,
+                 pool_size: int = 9):
         self.walls = walls
+        self.rng = get_rng(rng)
+        self.pool_size = pool_size
+        self._pool = None
 
-    def sample_homogenous_lights_around_center(self, strength: float):
-        ceiling_height = self.walls.height
+    def get_pool(self) -> LightPool:
+        # Created on first use, so constructing the sampler doesn't add lights to the scene
+        if self._pool is None:
+            self._pool = LightPool(self.pool_size)
+        return self._pool
+
+    def get_layout_positions(self, layout: LightLayout) -> np.ndarray:
+        """Light positions under the ceiling, spread over 3/4 of the half extents of the room."""
         bbox = self.walls.bbox
         center = np.mean(bbox, axis=0)
-        center[2] = ceiling_height
-        max = np.max(bbox, axis=0)
-        matrix = np.array(
-            [[max[0] * 3 / 4, 0, 0],
-             [-max[0] * 3 / 4, 0, 0],
-             [0, max[1] * 3 / 4, 0],
-             [0, -max[1] * 3 / 4, 0],
-             [0, 0, 0]])
-
-        light_positions = center + matrix
-        for position in light_positions:
-            light = bproc.types.Light()
-            light.set_location(position)
-            light.set_energy(strength)
+        center[2] = self.walls.height
+        half_x, half_y = (np.max(bbox, axis=0) - np.min(bbox, axis=0))[:2] / 2 * 3 / 4
+        if layout == LightLayout.CROSS:
+            offsets = [[half_x, 0], [-half_x, 0], [0, half_y], [0, -half_y], [0, 0]]
+        elif layout == LightLayout.GRID:
+            offsets = [[x, y] for x in (-half_x, 0, half_x) for y in (-half_y, 0, half_y)]
+        elif layout == LightLayout.RING:
+            angles = np.linspace(0, 2 * np.pi, 6, endpoint=False)
+            offsets = np.column_stack([half_x * np.cos(angles), half_y * np.sin(angles)])
+        else:
+            raise Exception(f"Unknown light layout {layout}")
+        offsets = np.asarray(offsets, dtype=np.float64)
+        return center + np.column_stack([offsets, np.zeros(len(offsets))])
+
+    def sample_homogenous_lights_around_center(self, strength: float):
+        positions = self.get_layout_positions(LightLayout.CROSS)
+        self.get_pool().apply(positions, np.full(len(positions), strength))
+
+    def sample_lighting_configuration(self, strength_range: (float, float) = (100, 300), layouts: list = None,
+                                      strength_jitter: float = 0.2, min_color: float = 0.85):
+        """
+        Samples a layout, a strength per light around a common strength from strength_range and slightly tinted
+        colors, and applies them to the light pool.
+        """
+        layouts = list(LightLayout) if layouts is None else layouts
+        positions = self.get_layout_positions(layouts[self.rng.integers(len(layouts))])
+        strength = self.rng.uniform(*strength_range)
+        energies = strength * self.rng.uniform(1 - strength_jitter, 1 + strength_jitter, size=len(positions))
+        colors = self.rng.uniform(min_color, 1.0, size=(len(positions), 3))
+        self.get_pool().apply(positions, energies, colors)
+        return positions, energies, colors
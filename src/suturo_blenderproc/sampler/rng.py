@@ -0,0 +1,44 @@
+from enum import IntEnum
+import numpy as np
+
+
+class RandomStream(IntEnum):
+    PARTITION = 0
+    OBJECT_SUBSET = 1
+    OBJECT_POSE = 2
+    CAMERA_POSE = 3
+    LIGHT = 4
+
+
+def get_rng(rng: np.random.Generator = None) -> np.random.Generator:
+    """
+    rng itself, or without one a Generator seeded from the global numpy state. Samplers built without an rng
+    therefore stay reproducible with np.random.seed, like before they took a Generator.
+    """
+    if rng is not None:
+        return rng
+    return np.random.default_rng(np.random.randint(0, 2 ** 32, size=4, dtype=np.uint64))
+
+
+class RandomStreams(object):
+    """
+    Derives an independent numpy Generator for every (run seed, iteration, stream) directly from a SeedSequence
+    spawn key. Iteration k can therefore be regenerated without replaying the iterations before it. The global
+    iteration index is unique over all shards, so the shard is not part of the key and the output of a run doesn't
+    depend on how many shards it was split into.
+    """
+
+    def __init__(self, run_seed: int = None, shard: int = 0):
+        # Without a seed fresh entropy is drawn, it is kept so that the run can still be reproduced
+        self.run_seed = run_seed if run_seed is not None else np.random.SeedSequence().entropy
+        # Only kept for bookkeeping, the streams of a shard are the ones of its global iterations
+        self.shard = shard
+
+    def seed_sequence(self, iteration: int, stream: RandomStream) -> np.random.SeedSequence:
+        return np.random.SeedSequence(entropy=self.run_seed, spawn_key=(iteration, int(stream)))
+
+    def generator(self, iteration: int, stream: RandomStream) -> np.random.Generator:
+        return np.random.default_rng(self.seed_sequence(iteration, stream))
+
+    def generators(self, iteration: int) -> dict:
+        return {stream: self.generator(iteration, stream) for stream in RandomStream}
@@ -0,0 +1,81 @@
+import numpy as np
+
+from suturo_blenderproc.types.surface_set import SurfaceSet
+from suturo_blenderproc.instrumentation import get_instrumentation
+from suturo_blenderproc.sampler.rng import get_rng
+
+
+def get_inradii(surfaces: SurfaceSet, grid_size: int = 32) -> np.ndarray:
+    """
+    (K,) radius of the largest footprint that fits on every surface. For boxes and ellipses this is half of the
+    shorter side or axis, for support polygons the largest border distance on a grid over the polygon bounds.
+    """
+    inradii = np.min(surfaces.extents, axis=1) / 2
+    for k, polygon in enumerate(surfaces.polygons):
+        if polygon is not None:
+            low, high = polygon.bounds()
+            axes = [np.linspace(low[d], high[d], grid_size) for d in range(2)]
+            grid = np.stack(np.meshgrid(*axes), axis=-1).reshape(-1, 2)
+            inradii[k] = max(float(np.max(polygon.signed_distances(grid))), 0.0)
+    return inradii
+
+
+def get_surface_areas(surfaces: SurfaceSet) -> np.ndarray:
+    """Areas of the surfaces, of the support polygon where one is known."""
+    areas = surfaces.areas()
+    for k, polygon in enumerate(surfaces.polygons):
+        if polygon is not None:
+            areas[k] = polygon.area()
+    return areas
+
+
+class SurfaceScheduler(object):
+    """
+    Spreads the objects of an iteration over the surfaces of a SurfaceSet before they are placed. Every surface
+    has a capacity of packing_density times its area, an object uses the area of its footprint, widened to
+    min_distance / 2 so the spacing of the placement is accounted for. The default density is a bit below the
+    coverage random dart throwing reaches, so the placement still finds free spots on a scheduled surface.
+
+    Objects are assigned largest first, each to a surface it fits on drawn proportionally to the capacity that is
+    left, so surfaces are filled in proportion to their size. An object is never sent to a surface whose inradius
+    is smaller than its footprint or that is already full, there its placement could only run out of tries.
+    """
+
+    def __init__(self, surfaces: SurfaceSet, min_distance: float = 0.0, packing_density: float = 0.5,
+                 rng: np.random.Generator = None):
+        self.surfaces = surfaces
+        self.min_distance = min_distance
+        self.packing_density = packing_density
+        self.rng = get_rng(rng)
+        self.inradii = get_inradii(surfaces)
+        self.capacities = packing_density * get_surface_areas(surfaces)
+
+    def get_footprint_areas(self, radii: np.ndarray) -> np.ndarray:
+        return np.pi * np.square(np.maximum(np.asarray(radii, dtype=np.float64), self.min_distance / 2))
+
+    def fits(self, radii: np.ndarray) -> np.ndarray:
+        """(N, K) bool matrix whether footprints of the radii fit on each surface at all."""
+        return np.asarray(radii, dtype=np.float64)[:, None] <= self.inradii[None, :]
+
+    def assign(self, radii: np.ndarray, surface_indices: np.ndarray = None) -> np.ndarray:
+        """
+        Surface index for every footprint radius, -1 for objects that fit on none of the surfaces. surface_indices
+        restricts the assignment to these surfaces, by default all surfaces are used.
+        """
+        radii = np.asarray(radii, dtype=np.float64)
+        allowed = np.zeros(len(self.surfaces), dtype=bool)
+        allowed[np.arange(len(self.surfaces)) if surface_indices is None else surface_indices] = True
+        remaining = np.where(allowed, self.capacities, 0.0)
+        fits = self.fits(radii)
+        costs = self.get_footprint_areas(radii)
+
+        assignment = np.full(len(radii), -1, dtype=np.int64)
+        for i in np.argsort(-radii, kind="stable"):
+            weights = np.where(fits[i] & (remaining >= costs[i]), remaining, 0.0)
+            if np.sum(weights) <= 0:
+                continue
+            k = self.rng.choice(len(weights), p=weights / np.sum(weights))
+            assignment[i] = k
+            remaining[k] -= costs[i]
+        get_instrumentation().count("unscheduled_objects", int(np.count_nonzero(assignment < 0)))
+        return assignment
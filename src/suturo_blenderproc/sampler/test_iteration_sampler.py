@@ -0,0 +1,78 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from benchmarks import fake_blenderproc
+
+fake_blenderproc.install()
+from benchmarks.synthetic_scene import SyntheticConfig, build_synthetic_scene, get_class_names
+from suturo_blenderproc.scene_init import SceneInitializer
+from suturo_blenderproc.sampler.iteration_sampler import IterationSampler
+from suturo_blenderproc.sampler.keyframe_batch import KeyframeBatch
+from suturo_blenderproc.sampler.line_of_sight import LineOfSightFilter
+from suturo_blenderproc.sampler.placement import BatchPlacementSampler
+from suturo_blenderproc.sampler.pose_bank import CameraPoseBank
+from suturo_blenderproc.sampler.pose_sampler import CameraPoseSampler, LightPoseSampler
+from suturo_blenderproc.sampler.rng import RandomStreams
+from suturo_blenderproc.sampler.surface_scheduler import SurfaceScheduler
+from suturo_blenderproc.visibility import VisibilityManager
+
+
+def build_iteration_sampler(bank_dir, run_seed: int = 7) -> (IterationSampler, list):
+    """A fresh synthetic scene with the samplers of main.py, like a new process of a run, and its objects."""
+    num_classes = 10
+    scene_initializer = SceneInitializer(SyntheticConfig(get_class_names(num_classes)), use_geometry_cache=False,
+                                         selective_loading=False)
+    scene_initializer.mesh_objects = build_synthetic_scene(20, num_classes)
+    walls = scene_initializer.get_walls()[0]
+    line_of_sight = LineOfSightFilter.from_objects(scene_initializer.get_furnitures())
+    camera_pose_sampler = CameraPoseSampler(walls, line_of_sight=line_of_sight)
+    surfaces = scene_initializer.get_surface_set()
+    pose_banks = []
+    for surface in surfaces:
+        radius = max(surface.x_size, surface.y_size) / 2 + 0.6
+        pose_banks.append(CameraPoseBank.get_or_build_circular(
+            bank_dir, "synthetic", camera_pose_sampler, num_poses=64, radius=radius, max_radius=radius + 0.6,
+            center=surface.center, poi=np.append(surface.center[:2], surface.height), height=surface.height + 0.6))
+    placement_sampler = BatchPlacementSampler(surfaces)
+    keyframe_batch = KeyframeBatch(placement_sampler, VisibilityManager(scene_initializer.get_all_mesh_objects()))
+    iteration_sampler = IterationSampler(RandomStreams(run_seed=run_seed), keyframe_batch,
+                                         SurfaceScheduler(surfaces), LightPoseSampler(walls), pose_banks,
+                                         line_of_sight, num_objects=3, num_arrangements=2, num_cameras=2)
+    return iteration_sampler, scene_initializer.get_objects2annotate()
+
+
+def run_iteration(iteration_sampler: IterationSampler, iteration: int, objects: list) -> list:
+    """Samples an iteration like deploy_scene and returns the keyed poses, before the batch is released."""
+    arrangements = iteration_sampler.sample(iteration, objects)
+    poses = [([o.get_name() for o in a.objects], a.positions, a.rotations, a.frames) for a in arrangements]
+    pool = iteration_sampler.light_pose_sampler.get_pool()
+    # Lights the layout doesn't use are switched off where they are, only the lit ones make up the lighting
+    lights = [np.append(light.location, light.energy) for light in pool.lights if light.energy > 0]
+    cameras = list(fake_blenderproc.camera_poses)
+    iteration_sampler.keyframe_batch.release()
+    return poses + [lights, cameras]
+
+
+def assert_same_poses(expected: list, actual: list):
+    assert len(expected) == len(actual)
+    for expected_arrangement, actual_arrangement in zip(expected[:-2], actual[:-2]):
+        assert expected_arrangement[0] == actual_arrangement[0]
+        for expected_values, actual_values in zip(expected_arrangement[1:], actual_arrangement[1:]):
+            assert np.allclose(expected_values, actual_values)
+    assert np.allclose(expected[-2], actual[-2])
+    assert np.allclose(expected[-1], actual[-1])
+
+
+def test_iteration_alone_matches_full_run(tmp_path):
+    last = 4
+    full_run, objects = build_iteration_sampler(tmp_path)
+    full_poses = [run_iteration(full_run, i, objects) for i in range(last + 1)]
+    # The small scene makes the iterations reuse objects, whose poses must not depend on their earlier placements
+    names = [set(n for arrangement in poses[:-2] for n in arrangement[0]) for poses in full_poses]
+    assert names[last] & set().union(*names[:last])
+
+    alone, objects = build_iteration_sampler(tmp_path)
+    assert_same_poses(full_poses[last], run_iteration(alone, last, objects))
@@ -0,0 +1,155 @@
+import numpy as np
+
+from suturo_blenderproc.sampler.rng import get_rng
+
+
+class FenwickTree(object):
+    """Binary indexed tree over non-negative weights with O(log n) updates and prefix-sum searches."""
+
+    def __init__(self, weights: np.ndarray):
+        self.size = len(weights)
+        self._tree = np.zeros(self.size + 1, dtype=np.float64)
+        self.rebuild(weights)
+
+    def rebuild(self, weights: np.ndarray):
+        tree = np.zeros(self.size + 1, dtype=np.float64)
+        tree[1:] = weights
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def update(self, idx: int, delta: float):
+        i = idx + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def total(self) -> float:
+        res = 0.0
+        i = self.size
+        while i > 0:
+            res += self._tree[i]
+            i -= i & -i
+        return res
+
+    def find(self, value: float) -> int:
+        """Returns the smallest index whose prefix sum is greater than value."""
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step > 0:
+            nxt = pos + step
+            if nxt <= self.size and self._tree[nxt] <= value:
+                pos = nxt
+                value -= self._tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+
+class ClassWeightedSampler(object):
+    """
+    Draws instances without replacement where every instance carries the weight of its class.
+    Classes are drawn first with probability proportional to (remaining instances * class weight),
+    then an instance uniformly within the class, which is the same distribution as drawing directly
+    from the per-instance probability vector. A draw costs O(log k) for k classes.
+    """
+
+    # Class masses below this value get rescaled to avoid an underflow to zero
+    _MIN_TOTAL = 1e-150
+
+    def __init__(self, class_names: np.ndarray, rng: np.random.Generator = None):
+        self.rng = get_rng(rng)
+        classes, inverse = np.unique(np.asarray(class_names), return_inverse=True)
+        self.classes = classes
+        self.class_of_instance = inverse
+        order = np.argsort(inverse, kind="stable")
+        counts = np.bincount(inverse, minlength=len(classes))
+        self._buckets = [list(bucket) for bucket in np.split(order, np.cumsum(counts)[:-1])]
+        self.counts = counts.astype(np.float64)
+        # Class weights are kept as logarithms relative to _log_offset, repeated reductions would underflow otherwise
+        self._log_weights = np.zeros(len(classes), dtype=np.float64)
+        self._log_offset = 0.0
+        self._mass = np.zeros(len(classes), dtype=np.float64)
+        self._tree = FenwickTree(self._mass)
+        self._rebuild()
+
+    def remaining(self) -> int:
+        return int(np.sum(self.counts))
+
+    def reset_weights(self):
+        self._log_weights[:] = 0.0
+        self._log_offset = 0.0
+        self._rebuild()
+
+    def _rebuild(self):
+        # Exhausted classes may overflow here, their mass is masked to zero anyway
+        with np.errstate(over="ignore", invalid="ignore"):
+            self._mass = np.where(self.counts > 0, self.counts * np.exp(self._log_weights - self._log_offset), 0.0)
+        self._tree.rebuild(self._mass)
+
+    def _rescale(self):
+        nonempty = self.counts > 0
+        log_max = np.max(self._log_weights[nonempty])
+        if np.isneginf(log_max):
+            # Every remaining class got reduced to zero, fall back to drawing the remaining instances uniformly
+            self._log_weights[nonempty] = 0.0
+            log_max = 0.0
+        self._log_offset = log_max
+        self._rebuild()
+
+    def _set_mass(self, class_idx: int):
+        mass = self.counts[class_idx] * np.exp(self._log_weights[class_idx] - self._log_offset)
+        self._tree.update(class_idx, mass - self._mass[class_idx])
+        self._mass[class_idx] = mass
+
+    def draw(self, reduction_factor: float = 1.0) -> int:
+        """Draws and removes one instance index, the weight of its class gets multiplied by reduction_factor."""
+        if self.remaining() == 0:
+            raise Exception("No instances left to draw from")
+
+        total = self._tree.total()
+        if total < self._MIN_TOTAL:
+            self._rescale()
+            total = self._tree.total()
+
+        class_idx = self._tree.find(self.rng.uniform(0, total))
+        if self._mass[class_idx] <= 0:
+            # Accumulated rounding in the tree, rebuild it from the exact masses and search again
+            self._rebuild()
+            class_idx = self._tree.find(self.rng.uniform(0, self._tree.total()))
+
+        bucket = self._buckets[class_idx]
+        pos = self.rng.integers(len(bucket))
+        bucket[pos], bucket[-1] = bucket[-1], bucket[pos]
+        instance_idx = bucket.pop()
+
+        self.counts[class_idx] -= 1
+        with np.errstate(divide="ignore"):
+            self._log_weights[class_idx] += np.log(reduction_factor)
+        self._set_mass(class_idx)
+        return int(instance_idx)
+
+
+def sample_less_probable_partitions(class_names: np.ndarray, num_partitions: int, partition_size: int,
+                                    reduction_factor: float, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Returns a (num_partitions, partition_size) array of instance indices. Within a partition, every pick of a
+    class multiplies the probability of the remaining instances of that class by reduction_factor.
+    """
+    if num_partitions * partition_size > len(class_names):
+        raise Exception("Not enough objects for the requested partitions")
+
+    sampler = ClassWeightedSampler(class_names, rng)
+    partitions = np.empty(shape=[num_partitions, partition_size], dtype=np.int64)
+    for i in range(num_partitions):
+        sampler.reset_weights()
+        for j in range(partition_size):
+            partitions[i, j] = sampler.draw(reduction_factor)
+    return partitions
+
+
+def unique_class_indices(class_names: np.ndarray) -> np.ndarray:
+    """Returns the indices of the first instance of every class, in their original order."""
+    _, first = np.unique(np.asarray(class_names), return_index=True)
+    return np.sort(first)
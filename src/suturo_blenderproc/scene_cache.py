@@ -0,0 +1,84 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from suturo_blenderproc.scene_index import ObjectRole
+from utils.file_utils import get_file_hash
+
+CACHE_VERSION = 2
+
+# Roles whose bounding boxes are stored, the remaining roles only store their classification
+GEOMETRY_ROLES = [ObjectRole.WALL, ObjectRole.TABLE_RECTANGULAR, ObjectRole.TABLE_ROUND, ObjectRole.TABLE_OVAL,
+                  ObjectRole.SHELF_FLOOR]
+# Roles that additionally store the support polygons of their top faces
+POLYGON_ROLES = [ObjectRole.TABLE_RECTANGULAR, ObjectRole.TABLE_ROUND, ObjectRole.TABLE_OVAL, ObjectRole.SHELF_FLOOR]
+
+
+class SceneGeometryCache(object):
+    """
+    Sidecar cache of the derived scene geometry of a .blend file, keyed by the hash of the file content.
+    The cache is a single .npz holding per role the object names, for GEOMETRY_ROLES the (N, 8, 3) bounding
+    boxes and for POLYGON_ROLES the vertices of all support polygons concatenated, split by an (N + 1,) offset
+    array. It is written atomically, so parallel workers can read it while another one creates it.
+    """
+
+    def __init__(self, blend_path, cache_dir=None):
+        self.blend_path = Path(blend_path)
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else self.blend_path.parent
+        self._file_hash = None
+
+    def get_file_hash(self) -> str:
+        if self._file_hash is None:
+            self._file_hash = get_file_hash(self.blend_path)
+        return self._file_hash
+
+    def get_cache_path(self) -> Path:
+        return self.cache_dir.joinpath(f"{self.blend_path.stem}.{self.get_file_hash()[:16]}.geometry.npz")
+
+    def load(self):
+        """
+        Returns a dict role -> (names, bboxes, polygons), or None on a miss. bboxes and polygons are None for roles
+        without them, polygons is a list of (H, 2) vertex arrays.
+        """
+        path = self.get_cache_path()
+        if not path.is_file():
+            return None
+
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != CACHE_VERSION or str(data["file_hash"]) != self.get_file_hash():
+                return None
+            geometry = {}
+            for role in ObjectRole:
+                names = data[f"{role.name}_names"].tolist()
+                bboxes = data[f"{role.name}_bboxes"] if role in GEOMETRY_ROLES else None
+                polygons = None
+                if role in POLYGON_ROLES:
+                    points, offsets = data[f"{role.name}_polygon_points"], data[f"{role.name}_polygon_offsets"]
+                    polygons = [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+                geometry[role] = (names, bboxes, polygons)
+        return geometry
+
+    def save(self, geometry: dict):
+        arrays = {"version": np.array(CACHE_VERSION), "file_hash": np.array(self.get_file_hash())}
+        for role in ObjectRole:
+            names, bboxes, polygons = geometry[role]
+            arrays[f"{role.name}_names"] = np.array(names, dtype=str)
+            if role in GEOMETRY_ROLES:
+                arrays[f"{role.name}_bboxes"] = np.asarray(bboxes, dtype=np.float64).reshape(-1, 8, 3)
+            if role in POLYGON_ROLES:
+                polygons = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in polygons]
+                arrays[f"{role.name}_polygon_points"] = np.concatenate(polygons) if polygons else np.zeros((0, 2))
+                arrays[f"{role.name}_polygon_offsets"] = np.cumsum([0] + [len(p) for p in polygons])
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.get_cache_path())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,85 @@
+from enum import Enum, auto
+import re
+import blenderproc as bproc
+
+
+class ObjectRole(Enum):
+    WALL = auto()
+    TABLE_RECTANGULAR = auto()
+    TABLE_ROUND = auto()
+    TABLE_OVAL = auto()
+    SHELF_FLOOR = auto()
+    FURNITURE = auto()
+
+
+# The objects of a role are the matches of its patterns concatenated in pattern order, which is the order the
+# getters of the SceneInitializer used to call bproc.filter.by_attr in. Names are matched with re.fullmatch.
+ROLE_PATTERNS = {
+    ObjectRole.WALL: [re.compile(r"[^ ]+Room.*")],
+    ObjectRole.TABLE_RECTANGULAR: [re.compile(r"TableSurface.*"), re.compile(r"[^ ]+TableSurface.*")],
+    ObjectRole.TABLE_ROUND: [re.compile(r"RoundTableSurface.*"), re.compile(r"[^ ]+RoundTableSurface.*")],
+    ObjectRole.TABLE_OVAL: [re.compile(r"OvalTableSurface.*"), re.compile(r"[^ ]+OvalTableSurface.*")],
+    ObjectRole.SHELF_FLOOR: [re.compile(r"[^ ]+SHELFFLOOR.*", re.IGNORECASE),
+                             re.compile(r"SHELFFLOOR.*", re.IGNORECASE)],
+    ObjectRole.FURNITURE: [re.compile(r"Furniture.*")],
+}
+
+
+
+def get_class_pattern(class_name: str) -> str:
+    """Pattern that fullmatches the object names of a class, the class name followed by anything, e.g. Apple.001."""
+    return f"{re.escape(class_name)}.*"
+
+
+class SceneIndex(object):
+    """Classifies every object of a scene by its name once, so role lookups don't have to filter the scene again."""
+
+    def __init__(self, classes2annotate: [str]):
+        self.classes2annotate = list(classes2annotate)
+        self._class_patterns = [re.compile(get_class_pattern(c)) for c in self.classes2annotate]
+        self._roles = {role: [] for role in ObjectRole}
+        self._annotatable = [[] for _ in self.classes2annotate]
+        self.num_objects = 0
+
+    def build(self, objects: list, role_names: dict = None):
+        """
+        Classifies objects. If role_names (role -> list of names, e.g. from the SceneGeometryCache) is given,
+        the roles are resolved by name and only the annotatable classes are matched.
+        """
+        matches = {role: [[] for _ in patterns] for role, patterns in ROLE_PATTERNS.items()}
+        annotatable = [[] for _ in self.classes2annotate]
+        objects_by_name = {}
+        for obj in objects:
+            name = obj.get_name()
+            if role_names is None:
+                for role, patterns in ROLE_PATTERNS.items():
+                    for i, pattern in enumerate(patterns):
+                        if pattern.fullmatch(name):
+                            matches[role][i].append(obj)
+            else:
+                objects_by_name[name] = obj
+            if isinstance(obj, bproc.types.MeshObject):
+                for i, pattern in enumerate(self._class_patterns):
+                    if pattern.fullmatch(name):
+                        annotatable[i].append(obj)
+
+        if role_names is None:
+            self._roles = {role: [o for objs in per_pattern for o in objs] for role, per_pattern in matches.items()}
+        else:
+            self._roles = {role: [objects_by_name[n] for n in role_names[role] if n in objects_by_name]
+                           for role in ObjectRole}
+        self._annotatable = annotatable
+        self.num_objects = len(objects)
+        return self
+
+    def get_role_names(self) -> dict:
+        return {role: [o.get_name() for o in objs] for role, objs in self._roles.items()}
+
+    def get(self, role: ObjectRole) -> list:
+        return list(self._roles[role])
+
+    def get_annotatable(self) -> list:
+        return [o for objs in self._annotatable for o in objs]
+
+    def get_annotatable_by_class(self) -> dict:
+        return {c: list(objs) for c, objs in zip(self.classes2annotate, self._annotatable)}
@@ -4,29 +4,122 @@ import suturo_blenderproc.types.table
 import suturo_blenderproc.types.wall
 import suturo_blenderproc.types.shelf
 import utils.path_utils
-import re
+from suturo_blenderproc.scene_index import SceneIndex, ObjectRole
+from suturo_blenderproc.scene_cache import SceneGeometryCache, GEOMETRY_ROLES, POLYGON_ROLES
+from suturo_blenderproc.types.surface_set import SurfaceSet
+from suturo_blenderproc.types.support_polygon import SupportPolygon
+from suturo_blenderproc.instrumentation import get_instrumentation
+from suturo_blenderproc.asset_loader import AssetLoader
 
 
 class SceneInitializer(object):
-    def __init__(self, yaml_config):
+    def __init__(self, yaml_config, use_geometry_cache: bool = True, geometry_cache_dir=None,
+                 selective_loading: bool = True):
         self.yaml_config = yaml_config
         self.mesh_objects = None
+        # Only load the role objects and the configured classes instead of the whole scene
+        self.selective_loading = selective_loading
+        self.use_geometry_cache = use_geometry_cache
+        self.geometry_cache_dir = geometry_cache_dir
+        self._scene_index = None
+        # role -> (names, bboxes, polygons) of the static scene geometry, loaded from or written to the
+        # SceneGeometryCache or computed once on first use
+        self._geometry = None
 
     def initialize_scene(self):
-        bproc.init()
-        self.mesh_objects = bproc.loader.load_blend(
-            utils.path_utils.get_path_blender_scene(self.yaml_config.get_scene()))
-        bproc.camera.set_resolution(640, 480)
+        instrumentation = get_instrumentation()
+        with instrumentation.stage("scene_load"):
+            bproc.init()
+            blend_path = utils.path_utils.get_path_blender_scene(self.yaml_config.get_scene())
+            if self.selective_loading:
+                library_dir = utils.path_utils.get_path_object_library(self.yaml_config.get_obj_source())
+                self.mesh_objects = AssetLoader(self.yaml_config.get_objects(), library_dir).load(blend_path)
+            else:
+                self.mesh_objects = bproc.loader.load_blend(str(blend_path))
+            bproc.camera.set_resolution(640, 480)
+
+        with instrumentation.stage("scene_analysis"):
+            if not self.use_geometry_cache:
+                self._scene_index = SceneIndex(self.yaml_config.get_objects()).build(self.mesh_objects)
+                return
+
+            cache = SceneGeometryCache(blend_path, self.geometry_cache_dir)
+            self._geometry = cache.load()
+            if self._geometry is not None:
+                instrumentation.count("geometry_cache_hits")
+                role_names = {role: names for role, (names, _, _) in self._geometry.items()}
+                self._scene_index = SceneIndex(self.yaml_config.get_objects()).build(self.mesh_objects, role_names)
+            else:
+                self._scene_index = SceneIndex(self.yaml_config.get_objects()).build(self.mesh_objects)
+                self._geometry = self.compute_geometry()
+                cache.save(self._geometry)
+
+    def load_cached_geometry(self):
+        """Loads the derived geometry without loading the scene, e.g. for workers that only need the entities."""
+        blend_path = utils.path_utils.get_path_blender_scene(self.yaml_config.get_scene())
+        self._geometry = SceneGeometryCache(blend_path, self.geometry_cache_dir).load()
+        if self._geometry is None:
+            raise Exception(f"No geometry cache exists for {blend_path}")
+
+    def compute_geometry(self) -> dict:
+        index = self.get_scene_index()
+        geometry = {}
+        for role, names in index.get_role_names().items():
+            bboxes = None
+            polygons = None
+            if role in GEOMETRY_ROLES:
+                bboxes = np.array([o.get_bound_box() for o in index.get(role)]).reshape(-1, 8, 3)
+            if role in POLYGON_ROLES:
+                polygons = [SupportPolygon.from_mesh_object(o).vertices for o in index.get(role)]
+            geometry[role] = (names, bboxes, polygons)
+        return geometry
+
+    def get_scene_index(self) -> SceneIndex:
+        # Objects appended to or removed from mesh_objects directly are noticed by the changed length,
+        # add_objects and remove_objects invalidate the index explicitly
+        if self._scene_index is None or self._scene_index.num_objects != len(self.mesh_objects):
+            self._scene_index = SceneIndex(self.yaml_config.get_objects()).build(self.mesh_objects)
+            self._geometry = None
+        return self._scene_index
+
+    def add_objects(self, objects: list):
+        self.mesh_objects.extend(objects)
+        self._scene_index = None
+
+    def remove_objects(self, objects: list):
+        removed = set(id(o) for o in objects)
+        self.mesh_objects = [o for o in self.mesh_objects if id(o) not in removed]
+        self._scene_index = None
+
+    def get_geometry(self, role: ObjectRole):
+        """
+        Returns the mesh objects of a role, their bounding boxes and support polygons. The geometry is taken from
+        the geometry cache if available, otherwise it is extracted once and kept until the scene changes.
+        Polygons are None for roles without them and for degenerated top faces.
+        """
+        if self.mesh_objects is None:
+            if self._geometry is None:
+                raise Exception("Neither the scene nor its cached geometry is loaded")
+            objects = [None] * len(self._geometry[role][0])
+        else:
+            objects = self.get_scene_index().get(role)
+            if self._geometry is None or len(self._geometry[role][0]) != len(objects):
+                self._geometry = self.compute_geometry()
+
+        _, bboxes, polygons = self._geometry[role]
+        if polygons is None:
+            return objects, bboxes, [None] * len(objects)
+        return objects, bboxes, [SupportPolygon(p) if len(p) >= 3 else None for p in polygons]
 
     def get_objects2annotate(self):
-        object_names = self.yaml_config.get_objects()
-        mesh_objects = [m for m in self.mesh_objects if isinstance(m, bproc.types.MeshObject)]
-        mesh_objects = [bproc.filter.by_attr(mesh_objects, "name", f"{o}.*", regex=True) for o in object_names]
-        return [o for objects in mesh_objects for o in objects]
+        return self.get_scene_index().get_annotatable()
 
     def get_all_mesh_objects(self):
         return self.mesh_objects
 
+    def get_furnitures(self):
+        return self.get_scene_index().get(ObjectRole.FURNITURE)
+
     def compute_bbox_properties(self, bbox):
         x_min, y_min, z_min = np.min(bbox, axis=0)
         x_max, y_max, z_max = np.max(bbox, axis=0)
@@ -37,12 +130,11 @@ class SceneInitializer(object):
         return x_length, y_length, height, center_point
 
     def get_walls(self):
-        walls = bproc.filter.by_attr(self.mesh_objects, "name", "[^ ]+Room.*", regex=True)
+        walls, bboxes, _ = self.get_geometry(ObjectRole.WALL)
         res = []
-        for wall in walls:
+        for wall, bbox in zip(walls, bboxes):
             wall_object = suturo_blenderproc.types.wall.Wall()
             wall_object.mesh_object = wall
-            bbox = wall.get_bound_box()
             x_length, y_length, z_length, center_point = self.compute_bbox_properties(bbox)
 
             wall_object.x_length = x_length
@@ -54,22 +146,25 @@ class SceneInitializer(object):
             res.append(wall_object)
         return res
 
-    def process_table_surface(self, tables, table_type):
+    def process_table_surface(self, tables, table_type, bboxes=None, polygons=None):
+        if bboxes is None:
+            bboxes = [table.get_bound_box() for table in tables]
+        if polygons is None:
+            polygons = [None] * len(tables)
         res = []
-        for table in tables:
-            assert isinstance(table, bproc.types.MeshObject)
-            bbox = table.get_bound_box()
+        for table, bbox, polygon in zip(tables, bboxes, polygons):
+            assert table is None or isinstance(table, bproc.types.MeshObject)
             x_length, y_length, height, center_point = self.compute_bbox_properties(bbox)
 
             if table_type == "round":
-                radius = np.linalg.norm(center_point[0] - (x_length / 2))
+                radius = x_length / 2
                 table_object = suturo_blenderproc.types.table.RoundTable()
                 table_object.radius = radius
                 table_object.height = height
 
             elif table_type == "oval":
-                radius_x = np.linalg.norm(center_point[0] - (x_length / 2))
-                radius_y = np.linalg.norm(center_point[1] - (y_length / 2))
+                radius_x = x_length / 2
+                radius_y = y_length / 2
                 table_object = suturo_blenderproc.types.table.OvalTable()
                 table_object.semi_major_x = radius_x
                 table_object.semi_major_y = radius_y
@@ -83,35 +178,28 @@ class SceneInitializer(object):
 
             table_object.center = center_point
             table_object.mesh_object = table
+            table_object.support_polygon = polygon
             res.append(table_object)
 
         return res
 
     def get_table_surfaces_rectangular(self):
-        tables = bproc.filter.by_attr(self.mesh_objects, "name", "TableSurface.*", regex=True)
-        tables.extend(bproc.filter.by_attr(self.mesh_objects, "name", "[^ ]+TableSurface.*", regex=True))
-        return self.process_table_surface(tables, "rectangular")
+        tables, bboxes, polygons = self.get_geometry(ObjectRole.TABLE_RECTANGULAR)
+        return self.process_table_surface(tables, "rectangular", bboxes, polygons)
 
     def get_table_surfaces_round(self):
-        tables = bproc.filter.by_attr(self.mesh_objects, "name", "RoundTableSurface.*", regex=True)
-        tables.extend(bproc.filter.by_attr(self.mesh_objects, "name", "[^ ]+RoundTableSurface.*", regex=True))
-        return self.process_table_surface(tables, "round")
+        tables, bboxes, polygons = self.get_geometry(ObjectRole.TABLE_ROUND)
+        return self.process_table_surface(tables, "round", bboxes, polygons)
 
     def get_table_surfaces_oval(self):
-        tables = bproc.filter.by_attr(self.mesh_objects, "name", "OvalTableSurface.*", regex=True)
-        tables.extend(bproc.filter.by_attr(self.mesh_objects, "name", "[^ ]+OvalTableSurface.*", regex=True))
-        return self.process_table_surface(tables, "oval")
+        tables, bboxes, polygons = self.get_geometry(ObjectRole.TABLE_OVAL)
+        return self.process_table_surface(tables, "oval", bboxes, polygons)
 
     def get_shelf_floors(self):
-        pattern = re.compile(r'[^ ]+SHELFFLOOR.*', re.IGNORECASE)
-        pattern2 = re.compile(r'SHELFFLOOR.*', re.IGNORECASE)
-
-        floors = bproc.filter.by_attr(self.mesh_objects, "name", pattern, regex=True)
-        floors.extend(bproc.filter.by_attr(self.mesh_objects, "name", pattern2, regex=True))
+        floors, bboxes, polygons = self.get_geometry(ObjectRole.SHELF_FLOOR)
         res = []
-        for floor in floors:
-            assert isinstance(floor, bproc.types.MeshObject)
-            bbox = floor.get_bound_box()
+        for floor, bbox, polygon in zip(floors, bboxes, polygons):
+            assert floor is None or isinstance(floor, bproc.types.MeshObject)
             x_length, y_length, height, center_point = self.compute_bbox_properties(bbox)
             shelf_floor = suturo_blenderproc.types.shelf.ShelfFloor()
 
@@ -120,6 +208,15 @@ class SceneInitializer(object):
             shelf_floor.height = height
             shelf_floor.center = center_point
             shelf_floor.mesh_object = floor
+            shelf_floor.support_polygon = polygon
             res.append(shelf_floor)
 
         return res
+
+    def get_surface_set(self) -> SurfaceSet:
+        """All table surfaces and shelf floors of the scene as one SurfaceSet."""
+        elliptic = self.get_table_surfaces_round() + self.get_table_surfaces_oval()
+        # The patterns of rectangular tables also match round and oval ones, those are only kept once
+        taken = set(id(t.mesh_object) for t in elliptic if t.mesh_object is not None)
+        rectangular = [t for t in self.get_table_surfaces_rectangular() if id(t.mesh_object) not in taken]
+        return SurfaceSet.from_entities(rectangular + elliptic + self.get_shelf_floors())
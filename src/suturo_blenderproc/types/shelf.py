@@ -13,3 +13,4 @@ class ShelfFloor(suturo_blenderproc.types.entity.Entity):
         self.x_size = 0.0
         self.y_size = 0.0
         self.height = 0.0
+        self.support_polygon = None
@@ -0,0 +1,107 @@
+import numpy as np
+
+
+def convex_hull_2d(points: np.ndarray) -> np.ndarray:
+    """Convex hull of (N, 2) points in counter-clockwise order (Andrew's monotone chain)."""
+    points = np.unique(np.asarray(points, dtype=np.float64).reshape(-1, 2), axis=0)
+    if len(points) < 3:
+        return points
+
+    def half_hull(ordered):
+        hull = []
+        for p in ordered:
+            while len(hull) >= 2 and np.cross(hull[-1] - hull[-2], p - hull[-2]) <= 0:
+                hull.pop()
+            hull.append(p)
+        return hull[:-1]
+
+    # np.unique already sorted the points lexicographically by x, then y
+    return np.array(half_hull(points) + half_hull(points[::-1]))
+
+
+def get_world_mesh_data(mesh_object):
+    """
+    Returns the (N, 3) world coordinates of the vertices of a bproc MeshObject, the (P, 3) world normals of its
+    polygons and for every polygon its vertex indices as (loop vertex indices, loop start, loop total).
+    """
+    mesh = mesh_object.get_mesh()
+    local2world = np.array(mesh_object.get_local2world_mat())
+
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+    mesh.vertices.foreach_get("co", co)
+    vertices = co.reshape(-1, 3) @ local2world[:3, :3].T + local2world[:3, 3]
+
+    normals = np.empty(len(mesh.polygons) * 3, dtype=np.float64)
+    mesh.polygons.foreach_get("normal", normals)
+    normals = normals.reshape(-1, 3) @ np.linalg.inv(local2world[:3, :3])
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int64)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+    loop_start = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    loop_total = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    return vertices, normals, (loop_vertices, loop_start, loop_total)
+
+
+def extract_top_face_points(vertices: np.ndarray, normals: np.ndarray = None, polygon_loops=None,
+                            min_normal_z: float = 0.9, tolerance: float = 0.01) -> np.ndarray:
+    """
+    Returns the xy of the vertices that belong to upward facing polygons and lie within tolerance of the highest
+    of them. Without polygon data all vertices within tolerance of the highest vertex are taken.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if len(vertices) == 0:
+        return np.zeros(shape=(0, 2))
+    candidates = np.arange(len(vertices))
+    if normals is not None and polygon_loops is not None:
+        loop_vertices, loop_start, loop_total = polygon_loops
+        upward = np.asarray(normals)[:, 2] >= min_normal_z
+        if np.any(upward):
+            polygon_of_loop = np.repeat(np.arange(len(loop_start)), loop_total)
+            # Loop indices in polygon order, the loops of the polygons don't have to be stored in that order
+            loops = np.repeat(loop_start, loop_total) + np.concatenate([np.arange(t) for t in loop_total])
+            candidates = np.unique(loop_vertices[loops][upward[polygon_of_loop]])
+
+    z = vertices[candidates, 2]
+    top = candidates[z >= np.max(z) - tolerance]
+    return vertices[top, :2]
+
+
+class SupportPolygon(object):
+    """Convex support polygon of a surface with vectorized containment tests."""
+
+    def __init__(self, vertices: np.ndarray):
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        edges = np.roll(self.vertices, -1, axis=0) - self.vertices
+        lengths = np.maximum(np.linalg.norm(edges, axis=1), 1e-12)
+        # Inward normals of a counter-clockwise polygon
+        self._normals = np.column_stack([-edges[:, 1], edges[:, 0]]) / lengths[:, None]
+        self._offsets = np.sum(self._normals * self.vertices, axis=1)
+
+    @classmethod
+    def from_points(cls, points: np.ndarray):
+        return cls(convex_hull_2d(points))
+
+    @classmethod
+    def from_mesh_object(cls, mesh_object, min_normal_z: float = 0.9, tolerance: float = 0.01):
+        vertices, normals, polygon_loops = get_world_mesh_data(mesh_object)
+        return cls.from_points(extract_top_face_points(vertices, normals, polygon_loops, min_normal_z, tolerance))
+
+    def signed_distances(self, points: np.ndarray) -> np.ndarray:
+        """(M,) distance of every point to the border, positive inside the polygon."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, np.shape(points)[-1])[:, :2]
+        if len(self.vertices) < 3:
+            return np.full(len(points), -np.inf)
+        return np.min(points @ self._normals.T - self._offsets, axis=1)
+
+    def contains(self, points: np.ndarray, margin=0.0) -> np.ndarray:
+        return self.signed_distances(points) >= margin
+
+    def area(self) -> float:
+        x, y = self.vertices[:, 0], self.vertices[:, 1]
+        return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+    def bounds(self):
+        return np.min(self.vertices, axis=0), np.max(self.vertices, axis=0)
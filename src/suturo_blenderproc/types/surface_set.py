@@ -0,0 +1,164 @@
+from enum import IntEnum
+import numpy as np
+import suturo_blenderproc.types.table
+import suturo_blenderproc.types.shelf
+from suturo_blenderproc.sampler.rng import get_rng
+
+
+class SurfaceType(IntEnum):
+    RECTANGULAR = 0
+    ROUND = 1
+    OVAL = 2
+    SHELF_FLOOR = 3
+
+
+class SurfaceSet(object):
+    """
+    Struct of arrays over K support surfaces. extents holds the full x/y size of every surface, which is the
+    diameter for round tables and the two axes for oval tables. Surfaces with a SupportPolygon are tested against
+    the polygon instead of their box or ellipse.
+    """
+
+    def __init__(self, centers: np.ndarray, extents: np.ndarray, heights: np.ndarray, type_codes: np.ndarray,
+                 mesh_objects: list = None, polygons: list = None):
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.extents = np.asarray(extents, dtype=np.float64).reshape(-1, 2)
+        self.heights = np.asarray(heights, dtype=np.float64).reshape(-1)
+        self.type_codes = np.asarray(type_codes, dtype=np.int8).reshape(-1)
+        self.mesh_objects = list(mesh_objects) if mesh_objects is not None else [None] * len(self.heights)
+        self.polygons = list(polygons) if polygons is not None else [None] * len(self.heights)
+
+    @classmethod
+    def from_entities(cls, entities: list):
+        centers, extents, heights, type_codes, mesh_objects, polygons = [], [], [], [], [], []
+        for entity in entities:
+            if isinstance(entity, suturo_blenderproc.types.table.RectangularTable):
+                extents.append([entity.x_size, entity.y_size])
+                type_codes.append(SurfaceType.RECTANGULAR)
+            elif isinstance(entity, suturo_blenderproc.types.table.RoundTable):
+                extents.append([entity.radius * 2, entity.radius * 2])
+                type_codes.append(SurfaceType.ROUND)
+            elif isinstance(entity, suturo_blenderproc.types.table.OvalTable):
+                extents.append([entity.semi_major_x * 2, entity.semi_major_y * 2])
+                type_codes.append(SurfaceType.OVAL)
+            elif isinstance(entity, suturo_blenderproc.types.shelf.ShelfFloor):
+                extents.append([entity.x_size, entity.y_size])
+                type_codes.append(SurfaceType.SHELF_FLOOR)
+            else:
+                raise Exception("Unrecognized surface type")
+            centers.append(np.asarray(entity.center, dtype=np.float64).reshape(3))
+            heights.append(entity.height)
+            mesh_objects.append(entity.mesh_object)
+            polygons.append(entity.support_polygon)
+        return cls(np.array(centers).reshape(-1, 3), np.array(extents).reshape(-1, 2), np.array(heights),
+                   np.array(type_codes), mesh_objects, polygons)
+
+    def __len__(self):
+        return len(self.heights)
+
+    def __getitem__(self, index: int):
+        if not -len(self) <= index < len(self):
+            raise IndexError("SurfaceSet index out of range")
+        return SurfaceView(self, index % len(self))
+
+    def __iter__(self):
+        return (SurfaceView(self, i) for i in range(len(self)))
+
+    def is_elliptic(self) -> np.ndarray:
+        return (self.type_codes == SurfaceType.ROUND) | (self.type_codes == SurfaceType.OVAL)
+
+    def areas(self) -> np.ndarray:
+        rectangle = self.extents[:, 0] * self.extents[:, 1]
+        return np.where(self.is_elliptic(), rectangle * np.pi / 4, rectangle)
+
+    def sampling_dimensions(self) -> np.ndarray:
+        """(K, 2) size of the centered box the ObjectPoseSampler draws from, 2/3 of the size or of the radii."""
+        return np.where(self.is_elliptic()[:, None], self.extents / 2, self.extents) * 2 / 3
+
+    def contains_points(self, points: np.ndarray, margin=0.0) -> np.ndarray:
+        """
+        Returns an (M, K) bool matrix whether the xy of M points lie on each of the K surfaces, at least margin
+        away from its border. margin can be a scalar or an (M,) array, e.g. the footprint radii of objects.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, np.shape(points)[-1])[:, :2]
+        margin = np.broadcast_to(np.asarray(margin, dtype=np.float64), (len(points),))[:, None, None]
+        offsets = np.abs(points[:, None, :] - self.centers[None, :, :2])
+        half_extents = self.extents[None, :, :] / 2 - margin
+        inside_box = np.all(offsets <= half_extents, axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inside_ellipse = np.sum(np.square(offsets / half_extents), axis=2) <= 1
+        inside_ellipse &= np.all(half_extents > 0, axis=2)
+        inside = np.where(self.is_elliptic()[None, :], inside_ellipse, inside_box)
+        for k, polygon in enumerate(self.polygons):
+            if polygon is not None:
+                inside[:, k] = polygon.contains(points, margin[:, 0, 0])
+        return inside
+
+    def select(self, num: int, weights: np.ndarray = None, replace: bool = True,
+               rng: np.random.Generator = None) -> np.ndarray:
+        """Draws num surface indices proportionally to weights, by default proportionally to the surface area."""
+        weights = self.areas() if weights is None else np.asarray(weights, dtype=np.float64)
+        if np.sum(weights) <= 0:
+            raise Exception("Surface weights have to sum up to a positive value")
+        return get_rng(rng).choice(len(self), size=num, p=weights / np.sum(weights), replace=replace)
+
+    def subset(self, indices):
+        indices = np.asarray(indices)
+        return SurfaceSet(self.centers[indices], self.extents[indices], self.heights[indices],
+                          self.type_codes[indices], [self.mesh_objects[i] for i in indices],
+                          [self.polygons[i] for i in indices])
+
+
+class SurfaceView(object):
+    """Single surface of a SurfaceSet that exposes the attributes of the corresponding table and shelf types."""
+
+    __slots__ = ("surface_set", "index")
+
+    def __init__(self, surface_set: SurfaceSet, index: int):
+        self.surface_set = surface_set
+        self.index = index
+
+    @property
+    def center(self) -> np.ndarray:
+        return self.surface_set.centers[self.index]
+
+    @property
+    def height(self) -> float:
+        return float(self.surface_set.heights[self.index])
+
+    @property
+    def type_code(self) -> SurfaceType:
+        return SurfaceType(int(self.surface_set.type_codes[self.index]))
+
+    @property
+    def mesh_object(self):
+        return self.surface_set.mesh_objects[self.index]
+
+    @property
+    def support_polygon(self):
+        return self.surface_set.polygons[self.index]
+
+    @property
+    def x_size(self) -> float:
+        return float(self.surface_set.extents[self.index, 0])
+
+    @property
+    def y_size(self) -> float:
+        return float(self.surface_set.extents[self.index, 1])
+
+    @property
+    def radius(self) -> float:
+        return self.x_size / 2
+
+    @property
+    def semi_major_x(self) -> float:
+        return self.x_size / 2
+
+    @property
+    def semi_major_y(self) -> float:
+        return self.y_size / 2
+
+    @property
+    def area(self) -> float:
+        area = self.x_size * self.y_size
+        return area * np.pi / 4 if self.type_code in (SurfaceType.ROUND, SurfaceType.OVAL) else area
@@ -6,6 +6,8 @@ class Table(suturo_blenderproc.types.entity.Entity):
     def __init__(self):
         super().__init__()
         self.height = 0.0
+        # SupportPolygon of the top face, None if only the bounding box is known
+        self.support_polygon = None
 
 
 class RectangularTable(Table):
@@ -0,0 +1,77 @@
+import blenderproc as bproc
+
+
+class VisibilityManager(object):
+    """
+    Keeps track of the hide_render state of the scene objects, so that changing the visibility only writes the
+    objects whose state actually changes. States can be stored as named snapshots and restored later.
+    """
+
+    def __init__(self, objects: [bproc.types.MeshObject]):
+        self._objects = {}
+        self._visible = set()
+        self._snapshots = {}
+        self.num_writes = 0
+        self.track(objects)
+
+    def track(self, objects: [bproc.types.MeshObject]):
+        """Registers objects with their current hide_render state, this is the only time the state gets read."""
+        for obj in objects:
+            key = obj.get_name()
+            self._objects[key] = obj
+            if obj.blender_obj.hide_render:
+                self._visible.discard(key)
+            else:
+                self._visible.add(key)
+
+    def _keys(self, objects) -> set:
+        keys = set()
+        for obj in objects:
+            key = obj.get_name()
+            if key not in self._objects:
+                self.track([obj])
+            keys.add(key)
+        return keys
+
+    def _write(self, keys, hidden: bool):
+        for key in keys:
+            self._objects[key].blender_obj.hide_render = hidden
+        self.num_writes += len(keys)
+
+    def _apply_visible(self, visible: set):
+        to_hide = self._visible - visible
+        to_show = visible - self._visible
+        self._write(to_hide, True)
+        self._write(to_show, False)
+        self._visible = set(visible)
+
+    def is_visible(self, obj: bproc.types.MeshObject) -> bool:
+        return obj.get_name() in self._visible
+
+    def get_visible(self) -> list:
+        return [self._objects[key] for key in self._visible]
+
+    def show(self, objects):
+        keys = self._keys(objects) - self._visible
+        self._write(keys, False)
+        self._visible |= keys
+
+    def hide(self, objects):
+        keys = self._keys(objects) & self._visible
+        self._write(keys, True)
+        self._visible -= keys
+
+    def hide_all(self):
+        self._apply_visible(set())
+
+    def show_only(self, objects):
+        """Makes exactly the given objects visible, only the difference to the current state is written."""
+        self._apply_visible(self._keys(objects))
+
+    def snapshot(self, name: str):
+        self._snapshots[name] = frozenset(self._visible)
+
+    def restore(self, name: str):
+        if name not in self._snapshots:
+            raise Exception(f"No visibility snapshot named {name}")
+        self._apply_visible(set(self._snapshots[name]))
@@ -0,0 +1,163 @@
+import atexit
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from suturo_blenderproc.writer.streaming_coco import StreamingCocoWriter
+from suturo_blenderproc.instrumentation import get_instrumentation
+
+
+def get_nbytes(value) -> int:
+    """Memory held by the numpy arrays in nested lists and dicts of render outputs."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(get_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(get_nbytes(v) for v in value)
+    return 0
+
+
+def write_hdf5_frame(path, data: dict, frame: int):
+    """
+    Writes frame of the render output data to path like bproc.writer.write_hdf5: arrays are stored gzip compressed,
+    everything else as json string. Unlike write_hdf5 it doesn't touch bpy, so it can run outside the main thread.
+    """
+    tmp_path = f"{path}.tmp"
+    with h5py.File(tmp_path, 'w') as f:
+        for key, values in data.items():
+            value = values[frame] if isinstance(values, list) else values
+            if isinstance(value, np.ndarray):
+                f.create_dataset(key, data=value, compression="gzip")
+            else:
+                f.create_dataset(key, data=np.bytes_(json.dumps(value, default=str)))
+    os.replace(tmp_path, path)
+
+
+class _Job(object):
+    __slots__ = ("iteration", "data", "seg_data", "hdf5_paths", "nbytes")
+
+    def __init__(self, iteration: int, data: dict, seg_data: dict, hdf5_paths: [Path], nbytes: int):
+        self.iteration = iteration
+        self.data = data
+        self.seg_data = seg_data
+        self.hdf5_paths = hdf5_paths
+        self.nbytes = nbytes
+
+
+class AsyncWriter(object):
+    """
+    Writes the outputs of an iteration (COCO images and annotations, one hdf5 file per frame) on a background
+    thread while the main loop already places and renders the next iteration. Iterations are written in submit
+    order, the hdf5 files of an iteration are compressed in parallel on a thread pool. frame_writer is a
+    StreamingCocoWriter or a ShardWriter, without hdf5_dir no hdf5 files are written.
+
+    submit blocks while the queued render outputs hold more than max_pending_mb, so memory stays bounded when the
+    disk is slower than the renderer. An exception on the writer thread is raised again by the next submit, flush
+    or close. on_written(iteration, records, hdf5_paths) is called on the writer thread after an iteration is on
+    disk with the result of frame_writer.write, e.g. to record it in the run manifest.
+    """
+
+    def __init__(self, frame_writer: StreamingCocoWriter, hdf5_dir=None, hdf5_start_index: int = 0,
+                 max_pending_mb: float = 1024, max_pending_jobs: int = 4, num_hdf5_workers: int = 2,
+                 on_written=None):
+        self.frame_writer = frame_writer
+        self.hdf5_dir = Path(hdf5_dir) if hdf5_dir is not None else None
+        if self.hdf5_dir is not None:
+            self.hdf5_dir.mkdir(parents=True, exist_ok=True)
+        self.next_hdf5_index = hdf5_start_index
+        self.max_pending_bytes = int(max_pending_mb * 1024 * 1024)
+        self.max_pending_jobs = max_pending_jobs
+        self.on_written = on_written
+        self.pending_bytes = 0
+        self._jobs = deque()
+        self._busy = False
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._hdf5_pool = ThreadPoolExecutor(max_workers=num_hdf5_workers)
+        self._thread = threading.Thread(target=self._run, name="AsyncWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise Exception("Writing the outputs in the background failed") from error
+
+    def submit(self, iteration: int, data: dict, seg_data: dict) -> [Path]:
+        """Queues the outputs of an iteration and returns the paths its hdf5 files will be written to."""
+        num_frames = len(data["colors"]) if self.hdf5_dir is not None else 0
+        hdf5_paths = [self.hdf5_dir.joinpath(f"{self.next_hdf5_index + k}.hdf5") for k in range(num_frames)]
+        job = _Job(iteration, data, seg_data, hdf5_paths, get_nbytes(data) + get_nbytes(seg_data))
+        with get_instrumentation().stage("writer_backpressure"):
+            with self._condition:
+                if self._closed:
+                    raise Exception("The AsyncWriter is already closed")
+                # A single job is always accepted, even if it is larger than the limit on its own
+                self._condition.wait_for(lambda: self._error is not None or not (self._jobs or self._busy) or (
+                        len(self._jobs) < self.max_pending_jobs and
+                        self.pending_bytes + job.nbytes <= self.max_pending_bytes))
+                self._raise_error()
+                self._jobs.append(job)
+                self.pending_bytes += job.nbytes
+                self._condition.notify_all()
+        self.next_hdf5_index += num_frames
+        return hdf5_paths
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._jobs or self._closed)
+                if not self._jobs:
+                    return
+                job = self._jobs.popleft()
+                self._busy = True
+            try:
+                if self._error is None:
+                    self._write(job)
+            except BaseException as e:
+                self._error = e
+            finally:
+                with self._condition:
+                    self.pending_bytes -= job.nbytes
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _write(self, job: _Job):
+        instrumentation = get_instrumentation()
+        futures = [self._hdf5_pool.submit(write_hdf5_frame, path, job.data, k)
+                   for k, path in enumerate(job.hdf5_paths)]
+        # Timed for the iteration of the job, the main thread is already working on a later one
+        with instrumentation.stage("coco_writing", job.iteration):
+            records = self.frame_writer.write(instance_segmaps=job.seg_data["instance_segmaps"],
+                                             instance_attribute_maps=job.seg_data["instance_attribute_maps"],
+                                             colors=job.data["colors"])
+        with instrumentation.stage("hdf5_writing", job.iteration):
+            for future in futures:
+                future.result()
+        if self.on_written is not None:
+            self.on_written(job.iteration, records, job.hdf5_paths)
+
+    def flush(self):
+        """Blocks until every submitted iteration is written."""
+        with self._condition:
+            self._condition.wait_for(lambda: not (self._jobs or self._busy))
+            self._raise_error()
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._hdf5_pool.shutdown()
+        atexit.unregister(self.close)
+        self._raise_error()
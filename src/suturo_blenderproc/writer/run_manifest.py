@@ -0,0 +1,143 @@
+import json
+import os
+from pathlib import Path
+
+from utils.file_utils import compute_file_hash
+from suturo_blenderproc.dataset.shard_merge import get_hdf5_files
+
+
+class RunManifest(object):
+    """
+    Records every finished iteration of a run in run_manifest.jsonl: its id, the random streams it was drawn from,
+    the written files with their checksums and the state of the writers afterwards. Every record is one appended and
+    fsynced line, a partially written last line of a crashed run is ignored.
+
+    On resume, the outputs get verified and everything written after the last verified iteration is discarded,
+    so the run continues with the same image and annotation numbering. Runs with the COCO and hdf5 output record
+    the size of annotations.jsonl and the number of hdf5 files, runs with the shard output the number of frames in
+    the shards.
+    """
+
+    FILE = "run_manifest.jsonl"
+
+    def __init__(self, output_dir, run_seed: int = None, shard: int = 0, resume: bool = False):
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir.joinpath(self.FILE)
+        self.entries = []
+        if resume and self.path.is_file():
+            header = self._load()
+            if run_seed is not None and run_seed != header["run_seed"]:
+                raise Exception(f"Run seed {run_seed} doesn't match the seed {header['run_seed']} of the manifest")
+            self.run_seed = header["run_seed"]
+            self.shard = header["shard"]
+        else:
+            if self.path.is_file():
+                raise Exception(f"{self.output_dir} already contains a run, use --resume or another output directory")
+            self.run_seed = run_seed
+            self.shard = shard
+
+    def _load(self) -> dict:
+        header = None
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                if record["type"] == "header":
+                    header = record
+                else:
+                    self.entries.append(record)
+        if header is None:
+            raise Exception(f"{self.path} has no header")
+        if valid_size != self.path.stat().st_size:
+            os.truncate(self.path, valid_size)
+        return header
+
+    def _append(self, record: dict):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, run_seed: int):
+        """Writes the header of a new run, nothing happens when an existing run gets resumed."""
+        if self.path.is_file():
+            return
+        self.run_seed = run_seed
+        self._append({"type": "header", "run_seed": int(run_seed), "shard": self.shard})
+
+    def completed_iterations(self) -> set:
+        return set(e["iteration"] for e in self.entries)
+
+    def get_frame_count(self) -> int:
+        """Number of frames in the shard output written by the recorded iterations."""
+        return self.entries[-1].get("frame_count", 0) if self.entries else 0
+
+    def _entry_is_valid(self, entry: dict) -> bool:
+        for file in entry["files"]:
+            path = self.output_dir.joinpath(file["path"])
+            if not path.is_file() or compute_file_hash(path) != file["sha256"]:
+                return False
+        return True
+
+    def restore_outputs(self, coco_dir=None, hdf5_dir=None, shard_writer=None, verify_checksums: bool = True):
+        """
+        Verifies the recorded outputs and drops all iterations from the first invalid one on. With a shard_writer
+        only the shards are cut back to the frames of the last valid iteration, the COCO and hdf5 outputs of a
+        shard run are converted from the shards and left alone. Otherwise annotations.jsonl is cut back to the last
+        valid iteration and hdf5 files written after it are deleted, this has to happen before the writers are
+        created.
+        """
+        key = "frame_count" if shard_writer is not None else "hdf5_count"
+        if any(key not in entry for entry in self.entries):
+            raise Exception(f"{self.path} records a run with another --output_format, it can't be resumed with it")
+        valid = 0
+        for entry in self.entries:
+            if verify_checksums and not self._entry_is_valid(entry):
+                print(f"Outputs of iteration {entry['iteration']} are missing or corrupted, continuing from there")
+                break
+            valid += 1
+        if valid != len(self.entries):
+            self.entries = self.entries[:valid]
+            self._rewrite()
+
+        if shard_writer is not None:
+            shard_writer.truncate(self.get_frame_count())
+            return
+        hdf5_dir = Path(hdf5_dir) if hdf5_dir is not None else self.output_dir
+        last = self.entries[-1] if self.entries else {"coco_offset": 0, "hdf5_count": 0}
+        annotation_path = Path(coco_dir).joinpath("annotations.jsonl")
+        if annotation_path.is_file() and annotation_path.stat().st_size > last["coco_offset"]:
+            os.truncate(annotation_path, last["coco_offset"])
+        for hdf5_file in get_hdf5_files(hdf5_dir)[last["hdf5_count"]:]:
+            hdf5_file.unlink()
+
+    def _rewrite(self):
+        records = [{"type": "header", "run_seed": int(self.run_seed), "shard": self.shard}] + self.entries
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def record_iteration(self, iteration: int, files: [Path], coco_offset: int = 0, next_image_id: int = 0,
+                         next_annotation_id: int = 0, hdf5_count: int = 0, frame_count: int = None):
+        """Records a finished iteration, shard runs pass their frame_count instead of the COCO and hdf5 state."""
+        entry = {"type": "iteration", "iteration": iteration, "seed": [int(self.run_seed), iteration],
+                 "files": [{"path": str(Path(f).relative_to(self.output_dir)), "sha256": compute_file_hash(f)}
+                           for f in files]}
+        if frame_count is not None:
+            entry["frame_count"] = frame_count
+        else:
+            entry.update({"coco_offset": coco_offset, "next_image_id": next_image_id,
+                          "next_annotation_id": next_annotation_id, "hdf5_count": hdf5_count})
+        self._append(entry)
+        self.entries.append(entry)
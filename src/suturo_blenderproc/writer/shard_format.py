@@ -0,0 +1,289 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from suturo_blenderproc.writer.async_writer import write_hdf5_frame
+from suturo_blenderproc.writer.streaming_coco import StreamingCocoWriter
+
+
+def encode_segmap_rle(segmap: np.ndarray) -> (np.ndarray, np.ndarray):
+    """Runs of equal ids along the row-major flattened map as (int32 values, uint32 lengths)."""
+    flat = np.asarray(segmap).ravel()
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint32)
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    lengths = np.diff(np.append(starts, flat.size))
+    return flat[starts].astype(np.int32), lengths.astype(np.uint32)
+
+
+def decode_segmap_rle(values: np.ndarray, lengths: np.ndarray, height: int, width: int) -> np.ndarray:
+    return np.repeat(values, lengths).reshape(height, width)
+
+
+def _align(offset: int, alignment: int = 8) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class ShardWriter(object):
+    """
+    Packs frames into shard files of frames_per_shard frames. A frame is stored as its encoded image, the instance
+    segmentation map as runs of equal ids and the instance attribute map as json, so the RGB is only written once
+    and a segmap takes a few kB instead of width * height * 4 bytes.
+
+    Every frames_XXXXX.bin has a frames_XXXXX.idx next to it with one row of INDEX_FIELDS per frame. The row is
+    appended after the frame data is flushed, so the index never points at data that is not on disk and a shard can
+    be read while it is still written. Data behind the last index row is cut off when the writer is opened again.
+    """
+
+    FORMAT_FILE = "format.json"
+    INDEX_FIELDS = ["image_offset", "image_length", "runs_offset", "num_runs", "attributes_offset",
+                    "attributes_length", "height", "width"]
+
+    def __init__(self, output_dir, frames_per_shard: int = 1024, image_format: str = "jpg", jpg_quality: int = 95):
+        if image_format not in ("jpg", "png"):
+            raise Exception(f"Unknown image format {image_format}, use jpg or png")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.frames_per_shard = frames_per_shard
+        self.image_format = image_format
+        self.jpg_quality = jpg_quality
+        self._write_format()
+        self._data_file = None
+        self._index_file = None
+        self.num_frames = 0
+        self._shard = 0
+        self._shard_frames = 0
+        self._open()
+
+    def _write_format(self):
+        format_path = self.output_dir.joinpath(self.FORMAT_FILE)
+        if format_path.is_file():
+            with open(format_path, 'r') as f:
+                fmt = json.load(f)
+            # An existing dataset keeps its layout, otherwise the shard numbering would not match anymore
+            self.frames_per_shard = fmt["frames_per_shard"]
+            self.image_format = fmt["image_format"]
+            return
+        fmt = {"version": 1, "frames_per_shard": self.frames_per_shard, "image_format": self.image_format,
+               "index_fields": self.INDEX_FIELDS}
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(fmt, f)
+        os.replace(tmp_path, format_path)
+
+    def _open(self):
+        """Continues after the last completely written frame of an existing output dir."""
+        counts = [len(index) for index in read_shard_indices(self.output_dir)]
+        self.num_frames = int(sum(counts))
+        self._shard = max(len(counts) - 1, 0)
+        self._shard_frames = counts[-1] if counts else 0
+        self._open_shard(truncate=True)
+
+    def _open_shard(self, truncate: bool = False):
+        self.close()
+        data_path, index_path = get_shard_paths(self.output_dir, self._shard)
+        if truncate:
+            index = np.array(read_index(index_path))
+            end = int(np.max(index[:, [0, 2, 4]] + index[:, [1, 3, 5]] * [1, 8, 1])) if len(index) else 0
+            for path, size in [(index_path, index.nbytes), (data_path, end)]:
+                if path.is_file() and path.stat().st_size > size:
+                    os.truncate(path, size)
+        self._data_file = open(data_path, 'ab')
+        self._index_file = open(index_path, 'ab')
+
+    def _append(self, blob: bytes) -> int:
+        offset = _align(self._data_file.tell())
+        self._data_file.write(b"\0" * (offset - self._data_file.tell()))
+        self._data_file.write(blob)
+        return offset
+
+    def write_frame(self, instance_segmap: np.ndarray, instance_attribute_map: [dict], color: np.ndarray) -> int:
+        """Appends one frame and returns its index in the whole output dir."""
+        if self._shard_frames >= self.frames_per_shard:
+            self._shard += 1
+            self._shard_frames = 0
+            self._open_shard()
+        buffer = io.BytesIO()
+        image = Image.fromarray(np.asarray(color, dtype=np.uint8))
+        if self.image_format == "jpg":
+            image.save(buffer, format="JPEG", quality=self.jpg_quality)
+        else:
+            image.save(buffer, format="PNG")
+        instance_segmap = np.asarray(instance_segmap)
+        values, lengths = encode_segmap_rle(instance_segmap)
+        attributes = json.dumps(instance_attribute_map, default=str).encode()
+
+        image_offset = self._append(buffer.getvalue())
+        runs_offset = self._append(values.tobytes() + lengths.tobytes())
+        attributes_offset = self._append(attributes)
+        self._data_file.flush()
+        row = np.array([image_offset, buffer.tell(), runs_offset, len(values), attributes_offset, len(attributes),
+                        instance_segmap.shape[0], instance_segmap.shape[1]], dtype=np.int64)
+        self._index_file.write(row.tobytes())
+        self._index_file.flush()
+        self._shard_frames += 1
+        self.num_frames += 1
+        return self.num_frames - 1
+
+    def write(self, instance_segmaps: [np.ndarray], instance_attribute_maps: [[dict]], colors: [np.ndarray]) -> [int]:
+        """Same arguments as StreamingCocoWriter.write, returns the frame indices."""
+        frames = [self.write_frame(segmap, attributes, color)
+                  for segmap, attributes, color in zip(instance_segmaps, instance_attribute_maps, colors)]
+        os.fsync(self._data_file.fileno())
+        os.fsync(self._index_file.fileno())
+        return frames
+
+    def truncate(self, num_frames: int):
+        """Drops all frames from num_frames on, e.g. the frames of iterations a resumed run generates again."""
+        self.close()
+        for k, num_indexed in enumerate([len(index) for index in read_shard_indices(self.output_dir)]):
+            data_path, index_path = get_shard_paths(self.output_dir, k)
+            keep = int(np.clip(num_frames - k * self.frames_per_shard, 0, num_indexed))
+            if keep == 0 and k > 0:
+                data_path.unlink(missing_ok=True)
+                index_path.unlink()
+            elif keep < num_indexed:
+                os.truncate(index_path, keep * len(self.INDEX_FIELDS) * 8)
+        self._open()
+
+    def close(self):
+        for f in [self._data_file, self._index_file]:
+            if f is not None:
+                f.close()
+        self._data_file = None
+        self._index_file = None
+
+
+def get_shard_paths(shard_dir, shard: int) -> (Path, Path):
+    shard_dir = Path(shard_dir)
+    return shard_dir.joinpath(f"frames_{shard:05d}.bin"), shard_dir.joinpath(f"frames_{shard:05d}.idx")
+
+
+def read_index(index_path) -> np.ndarray:
+    """(N, 8) index rows of a shard, a row that is not completely written yet is ignored."""
+    row_size = len(ShardWriter.INDEX_FIELDS) * 8
+    num_rows = Path(index_path).stat().st_size // row_size if Path(index_path).is_file() else 0
+    if num_rows == 0:
+        return np.zeros(shape=(0, len(ShardWriter.INDEX_FIELDS)), dtype=np.int64)
+    return np.memmap(index_path, dtype=np.int64, mode='r', shape=(num_rows, len(ShardWriter.INDEX_FIELDS)))
+
+
+def read_shard_indices(shard_dir) -> [np.ndarray]:
+    indices = []
+    while get_shard_paths(shard_dir, len(indices))[1].is_file():
+        indices.append(read_index(get_shard_paths(shard_dir, len(indices))[1]))
+    return indices
+
+
+class ShardReader(object):
+    """
+    Reads single frames of a ShardWriter output dir. Index and data files are memory-mapped, reading frame i only
+    touches its own bytes. Frames written after the reader was created are visible after refresh.
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir.joinpath(ShardWriter.FORMAT_FILE), 'r') as f:
+            fmt = json.load(f)
+        self.image_format = fmt["image_format"]
+        self._data = {}
+        self.refresh()
+
+    def refresh(self):
+        self._indices = read_shard_indices(self.shard_dir)
+        self._starts = np.cumsum([0] + [len(index) for index in self._indices])
+        self._data = {}
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def _locate(self, frame: int) -> (np.ndarray, np.memmap):
+        if not 0 <= frame < len(self):
+            raise Exception(f"Frame {frame} is not in {self.shard_dir}, it has {len(self)} frames")
+        shard = int(np.searchsorted(self._starts, frame, side="right")) - 1
+        if shard not in self._data:
+            self._data[shard] = np.memmap(get_shard_paths(self.shard_dir, shard)[0], dtype=np.uint8, mode='r')
+        return self._indices[shard][frame - self._starts[shard]], self._data[shard]
+
+    def read_image_bytes(self, frame: int) -> bytes:
+        row, data = self._locate(frame)
+        return data[row[0]:row[0] + row[1]].tobytes()
+
+    def read_color(self, frame: int) -> np.ndarray:
+        with Image.open(io.BytesIO(self.read_image_bytes(frame))) as image:
+            return np.asarray(image.convert("RGB"))
+
+    def read_runs(self, frame: int) -> (np.ndarray, np.ndarray):
+        row, data = self._locate(frame)
+        values = np.frombuffer(data, dtype=np.int32, count=row[3], offset=row[2])
+        lengths = np.frombuffer(data, dtype=np.uint32, count=row[3], offset=row[2] + 4 * row[3])
+        return values, lengths
+
+    def read_segmap(self, frame: int) -> np.ndarray:
+        row, _ = self._locate(frame)
+        return decode_segmap_rle(*self.read_runs(frame), row[6], row[7])
+
+    def read_mask(self, frame: int, instance_id: int) -> np.ndarray:
+        """Binary mask of one instance, decoded from the runs without building the whole segmap."""
+        row, _ = self._locate(frame)
+        values, lengths = self.read_runs(frame)
+        return decode_segmap_rle(values == instance_id, lengths, row[6], row[7])
+
+    def read_attribute_map(self, frame: int) -> [dict]:
+        row, data = self._locate(frame)
+        return json.loads(data[row[4]:row[4] + row[5]].tobytes())
+
+    def read_frame(self, frame: int) -> dict:
+        """The frame in the layout of the render outputs, as it is written to the hdf5 files."""
+        return {"colors": self.read_color(frame), "instance_segmaps": self.read_segmap(frame),
+                "instance_attribute_maps": self.read_attribute_map(frame)}
+
+
+def shard_to_coco(shard_dir, coco_dir, id2name: dict, start_frame: int = None) -> int:
+    """
+    Appends the frames from start_frame on to the streamed COCO output in coco_dir and compiles
+    coco_annotations.json. The encoded images are written as they are, jpg images are not compressed again. By
+    default the conversion continues after the frames an earlier conversion already wrote to coco_dir.
+    """
+    reader = ShardReader(shard_dir)
+    coco_writer = StreamingCocoWriter(coco_dir, id2name=id2name)
+    start_frame = start_frame if start_frame is not None else coco_writer.next_image_id
+    for frame in range(start_frame, len(reader)):
+        coco_writer.write_encoded_frame(reader.read_segmap(frame), reader.read_attribute_map(frame),
+                                        reader.read_image_bytes(frame), suffix=f".{reader.image_format}")
+    coco_writer.finalize()
+    return max(len(reader) - start_frame, 0)
+
+
+def shard_to_hdf5(shard_dir, hdf5_dir, start_index: int = 0) -> int:
+    """Writes one <index>.hdf5 per frame like the AsyncWriter does, starting at start_index."""
+    reader = ShardReader(shard_dir)
+    Path(hdf5_dir).mkdir(parents=True, exist_ok=True)
+    for frame in range(len(reader)):
+        # write_hdf5_frame picks frame 0 of every list, the values are wrapped so the attribute map stays whole
+        data = {key: [value] for key, value in reader.read_frame(frame).items()}
+        write_hdf5_frame(Path(hdf5_dir).joinpath(f"{start_index + frame}.hdf5"), data, 0)
+    return len(reader)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Converts frame shards into the COCO and hdf5 output layouts.')
+    parser.add_argument("shard_dir", help="Directory written by the ShardWriter")
+    parser.add_argument("--coco_dir", default=None, help="Write the frames as COCO dataset into this directory")
+    parser.add_argument("--id2name", default=None, help="Json file mapping category ids to names, needed for COCO")
+    parser.add_argument("--hdf5_dir", default=None, help="Write one hdf5 file per frame into this directory")
+    args = parser.parse_args()
+    if args.coco_dir is not None:
+        if args.id2name is None:
+            raise Exception("Converting to COCO needs --id2name")
+        with open(args.id2name, 'r') as stream:
+            mapping = json.load(stream)
+        print(f"Wrote {shard_to_coco(args.shard_dir, args.coco_dir, mapping)} frames to {args.coco_dir}")
+    if args.hdf5_dir is not None:
+        print(f"Wrote {shard_to_hdf5(args.shard_dir, args.hdf5_dir)} frames to {args.hdf5_dir}")
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+def binary_mask_to_rle(mask: np.ndarray) -> dict:
+    """Uncompressed COCO RLE of a binary mask, the runs are counted in column-major order starting with zeros."""
+    flat = mask.flatten(order='F').astype(np.int8)
+    changes = np.flatnonzero(np.diff(flat)) + 1
+    counts = np.diff(np.concatenate([[0], changes, [len(flat)]]))
+    if flat.size > 0 and flat[0] == 1:
+        counts = np.concatenate([[0], counts])
+    return {"counts": counts.tolist(), "size": list(mask.shape)}
+
+
+def mask_to_bbox(mask: np.ndarray) -> [int]:
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    cols = np.flatnonzero(np.any(mask, axis=0))
+    return [int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)]
+
+
+def generate_annotations(instance_segmap: np.ndarray, instance_attribute_map: [dict]) -> [dict]:
+    """Annotations without ids for all instances of a frame, the background instance 0 is skipped."""
+    attributes = {int(a["idx"]): a for a in instance_attribute_map}
+    annotations = []
+    for inst in np.unique(instance_segmap):
+        if inst == 0 or int(inst) not in attributes:
+            continue
+        mask = instance_segmap == inst
+        annotations.append({
+            "category_id": int(attributes[int(inst)]["category_id"]),
+            "name": attributes[int(inst)].get("name", ""),
+            "iscrowd": 0,
+            "area": int(np.count_nonzero(mask)),
+            "bbox": mask_to_bbox(mask),
+            "segmentation": binary_mask_to_rle(mask),
+        })
+    return annotations
+
+
+class StreamingCocoWriter(object):
+    """
+    Writes COCO annotations incrementally. Every frame appends its image record and annotations as one line to
+    annotations.jsonl, so a write costs the same no matter how large the dataset already is. finalize compiles
+    coco_annotations.json once, it can also be run on the output of an unfinished run.
+
+    A finished run is marked by DONE_FILE, which finalize only writes when the run completed and a writer that
+    starts on the directory again removes, e.g. for --resume. Readers of the stream wait for it instead of for
+    coco_annotations.json, which a crashed run writes as well.
+    """
+
+    ANNOTATION_FILE = "annotations.jsonl"
+    COCO_FILE = "coco_annotations.json"
+    DONE_FILE = "generation_done"
+
+    def __init__(self, output_dir, id2name: dict = None, jpg_quality: int = 95):
+        self.output_dir = Path(output_dir)
+        self.images_dir = self.output_dir.joinpath("images")
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        self.annotation_path = self.output_dir.joinpath(self.ANNOTATION_FILE)
+        self.output_dir.joinpath(self.DONE_FILE).unlink(missing_ok=True)
+        self.id2name = id2name if id2name is not None else {}
+        self.jpg_quality = jpg_quality
+        self.next_image_id = 0
+        self.next_annotation_id = 0
+        self._restore_counters()
+
+    def _restore_counters(self):
+        # Continue the numbering of an existing file, a partially written last line gets cut off
+        if not self.annotation_path.is_file():
+            return
+        valid_size = 0
+        for record, end in read_records(self.annotation_path):
+            self.next_image_id = record["image"]["id"] + 1
+            if record["annotations"]:
+                self.next_annotation_id = record["annotations"][-1]["id"] + 1
+            valid_size = end
+        if valid_size != self.annotation_path.stat().st_size:
+            os.truncate(self.annotation_path, valid_size)
+
+    def get_offset(self) -> int:
+        """Current size of annotations.jsonl, everything up to it belongs to completely written frames."""
+        return self.annotation_path.stat().st_size if self.annotation_path.is_file() else 0
+
+    def write_frame(self, instance_segmap: np.ndarray, instance_attribute_map: [dict], color: np.ndarray) -> dict:
+        file_name = Path("images").joinpath(f"{self.next_image_id:06d}.jpg")
+        Image.fromarray(np.asarray(color, dtype=np.uint8)).save(self.output_dir.joinpath(file_name),
+                                                               quality=self.jpg_quality)
+        return self._append_record(instance_segmap, instance_attribute_map, file_name)
+
+    def write_encoded_frame(self, instance_segmap: np.ndarray, instance_attribute_map: [dict], image_bytes: bytes,
+                            suffix: str = ".jpg") -> dict:
+        """Like write_frame for an already encoded image, whose bytes are stored as they are."""
+        file_name = Path("images").joinpath(f"{self.next_image_id:06d}{suffix}")
+        with open(self.output_dir.joinpath(file_name), 'wb') as f:
+            f.write(image_bytes)
+        return self._append_record(instance_segmap, instance_attribute_map, file_name)
+
+    def _append_record(self, instance_segmap: np.ndarray, instance_attribute_map: [dict], file_name: Path) -> dict:
+        image_id = self.next_image_id
+        annotations = generate_annotations(np.asarray(instance_segmap), instance_attribute_map)
+        for annotation in annotations:
+            annotation["id"] = self.next_annotation_id
+            annotation["image_id"] = image_id
+            self.next_annotation_id += 1
+
+        height, width = np.asarray(instance_segmap).shape[:2]
+        record = {"image": {"id": image_id, "file_name": str(file_name), "width": int(width), "height": int(height)},
+                  "annotations": annotations}
+        with open(self.annotation_path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+        self.next_image_id += 1
+        return record
+
+    def write(self, instance_segmaps: [np.ndarray], instance_attribute_maps: [[dict]], colors: [np.ndarray]):
+        """Same arguments as bproc.writer.write_coco_annotations, one entry per rendered frame."""
+        return [self.write_frame(segmap, attribute_map, color)
+                for segmap, attribute_map, color in zip(instance_segmaps, instance_attribute_maps, colors)]
+
+    def finalize(self, finished: bool = True) -> dict:
+        """Compiles coco_annotations.json, with finished the stream is marked as complete."""
+        coco = compile_coco_annotations(self.output_dir, self.id2name)
+        if finished:
+            self.output_dir.joinpath(self.DONE_FILE).touch()
+        return coco
+
+
+def read_records(annotation_path, offset: int = 0):
+    """
+    Yields (record, end offset) for every complete line starting at the byte offset, stops at a partially written
+    last line.
+    """
+    with open(annotation_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            offset += len(line)
+            yield record, offset
+
+
+def compile_coco_annotations(output_dir, id2name: dict = None) -> dict:
+    """Builds coco_annotations.json from annotations.jsonl, categories are named by id2name if given."""
+    output_dir = Path(output_dir)
+    id2name = id2name if id2name is not None else {}
+    images = []
+    annotations = []
+    categories = {}
+    for record, _ in read_records(output_dir.joinpath(StreamingCocoWriter.ANNOTATION_FILE)):
+        images.append(record["image"])
+        for annotation in record["annotations"]:
+            name = annotation.pop("name", "")
+            category_id = annotation["category_id"]
+            if category_id not in categories:
+                categories[category_id] = id2name.get(str(category_id), name.split('.')[0])
+            annotations.append(annotation)
+
+    coco = {
+        "info": {"description": "SUTURO synthetic dataset"},
+        "licenses": [],
+        "categories": [{"id": k, "name": categories[k], "supercategory": "coco_annotations"}
+                       for k in sorted(categories)],
+        "images": images,
+        "annotations": annotations,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(coco, f)
+    os.replace(tmp_path, output_dir.joinpath(StreamingCocoWriter.COCO_FILE))
+    return coco
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compiles coco_annotations.json from a streamed annotations.jsonl.')
+    parser.add_argument("coco_dir", help="Directory containing annotations.jsonl")
+    parser.add_argument("--id2name", default=None, help="Json file mapping category ids to names")
+    args = parser.parse_args()
+    mapping = None
+    if args.id2name is not None:
+        with open(args.id2name, 'r') as stream:
+            mapping = json.load(stream)
+    result = compile_coco_annotations(args.coco_dir, mapping)
+    print(f"Wrote {len(result['images'])} images and {len(result['annotations'])} annotations")
@@ -0,0 +1,95 @@
+import json
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from suturo_blenderproc.writer.shard_format import (ShardReader, ShardWriter, decode_segmap_rle, encode_segmap_rle,
+                                                    shard_to_coco, shard_to_hdf5)
+from suturo_blenderproc.writer.streaming_coco import StreamingCocoWriter
+
+
+def make_frames(num_frames: int, height: int = 24, width: int = 32, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(num_frames):
+        segmap = np.zeros((height, width), dtype=np.int32)
+        segmap[2:10, 3:12] = 1
+        segmap[12:20, 15:30] = 2
+        attributes = [{"idx": 0, "category_id": 0, "name": "background"},
+                      {"idx": 1, "category_id": 3, "name": "bowl.001"},
+                      {"idx": 2, "category_id": 5, "name": "cup.002"}]
+        color = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        frames.append((segmap, attributes, color))
+    return frames
+
+
+def write_frames(shard_dir, frames, frames_per_shard: int = 2) -> ShardWriter:
+    writer = ShardWriter(shard_dir, frames_per_shard=frames_per_shard, image_format="png")
+    writer.write(*zip(*frames))
+    return writer
+
+
+def test_segmap_rle_round_trip():
+    segmap = np.random.default_rng(1).integers(0, 4, size=(17, 13)).astype(np.int32)
+    assert np.array_equal(decode_segmap_rle(*encode_segmap_rle(segmap), 17, 13), segmap)
+    values, lengths = encode_segmap_rle(np.zeros((0, 5), dtype=np.int32))
+    assert len(values) == 0 and len(lengths) == 0
+
+
+def test_shard_round_trip(tmp_path):
+    frames = make_frames(5)
+    write_frames(tmp_path, frames).close()
+    reader = ShardReader(tmp_path)
+    assert len(reader) == 5
+    for i, (segmap, attributes, color) in enumerate(frames):
+        assert np.array_equal(reader.read_segmap(i), segmap)
+        assert np.array_equal(reader.read_mask(i, 2), segmap == 2)
+        assert np.array_equal(reader.read_color(i), color)
+        assert reader.read_attribute_map(i) == attributes
+
+
+def test_truncate_and_reopen(tmp_path):
+    frames = make_frames(5)
+    writer = write_frames(tmp_path, frames)
+    writer.truncate(3)
+    writer.write(*zip(*frames[:1]))
+    writer.close()
+    # A partially written frame behind the last index row is cut off when the writer is opened again
+    with open(tmp_path.joinpath("frames_00001.bin"), 'ab') as f:
+        f.write(b"partial")
+    ShardWriter(tmp_path, frames_per_shard=2, image_format="png").close()
+    reader = ShardReader(tmp_path)
+    assert len(reader) == 4
+    assert np.array_equal(reader.read_color(3), frames[0][2])
+
+
+def test_shard_to_hdf5_keeps_attribute_maps(tmp_path):
+    frames = make_frames(3)
+    write_frames(tmp_path.joinpath("shards"), frames).close()
+    assert shard_to_hdf5(tmp_path.joinpath("shards"), tmp_path.joinpath("hdf5"), start_index=10) == 3
+    for i, (segmap, attributes, color) in enumerate(frames):
+        with h5py.File(tmp_path.joinpath("hdf5", f"{10 + i}.hdf5"), 'r') as f:
+            assert json.loads(np.array(f["instance_attribute_maps"]).item()) == attributes
+            assert np.array_equal(np.array(f["instance_segmaps"]), segmap)
+            assert np.array_equal(np.array(f["colors"]), color)
+
+
+def test_shard_to_coco_resumes(tmp_path):
+    frames = make_frames(4)
+    writer = write_frames(tmp_path.joinpath("shards"), frames[:2])
+    id2name = {"3": "bowl", "5": "cup"}
+    assert shard_to_coco(tmp_path.joinpath("shards"), tmp_path.joinpath("coco"), id2name) == 2
+    writer.write(*zip(*frames[2:]))
+    writer.close()
+    assert shard_to_coco(tmp_path.joinpath("shards"), tmp_path.joinpath("coco"), id2name) == 2
+
+    with open(tmp_path.joinpath("coco", StreamingCocoWriter.COCO_FILE), 'r') as f:
+        coco = json.load(f)
+    assert [image["id"] for image in coco["images"]] == [0, 1, 2, 3]
+    assert len(coco["annotations"]) == 8
+    assert {c["name"] for c in coco["categories"]} == {"bowl", "cup"}
+    bowl = next(a for a in coco["annotations"] if a["category_id"] == 3)
+    assert bowl["bbox"] == [3, 2, 9, 8]
@@ -0,0 +1,23 @@
+import hashlib
+import os
+
+# (resolved path, size, mtime) -> sha256 of the files hashed by get_file_hash in this process
+_file_hashes = {}
+
+
+def compute_file_hash(path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_file_hash(path) -> str:
+    """compute_file_hash, but a file is only read once per process as long as its size and mtime don't change."""
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        _file_hashes[key] = compute_file_hash(path)
+    return _file_hashes[key]
@@ -1,11 +1,15 @@
+from functools import lru_cache
 from pathlib import Path
 
+# All paths are resolved from the location of this file instead of the working directory, once per process
+
 
 def get_project_root():
     p = get_suturo_blenderproc_path()
     return p.parent
 
 
+@lru_cache(maxsize=None)
 def get_suturo_blenderproc_path():
     """Return the root directory of the project."""
     p = get_project_src_dir()
@@ -13,14 +17,15 @@ def get_suturo_blenderproc_path():
 
 
 def get_path_id2name_json():
-    p = Path.cwd().joinpath(get_suturo_blenderproc_path(), "data", "id2name.json")
+    p = get_suturo_blenderproc_path().joinpath("data", "json", "id2name.json")
     if not p.exists():
         raise Exception("id2name.json doesn't exist")
     return p
 
 
+@lru_cache(maxsize=None)
 def get_path_yaml_config(filename):
-    p = Path.cwd().joinpath(get_suturo_blenderproc_path(), "data/yaml", filename)
+    p = get_suturo_blenderproc_path().joinpath("data/yaml", filename)
     if p.suffix != ".yaml":
         p = p.with_suffix(".yaml")
         if p.is_file():
@@ -33,25 +38,43 @@ def get_path_yaml_config(filename):
     return p
 
 
+@lru_cache(maxsize=None)
 def get_project_src_dir():
-    p = Path.cwd()
-    while p.stem != "src":
-        p = p.parent
+    return Path(__file__).resolve().parent.parent
+
 
+@lru_cache(maxsize=None)
+def get_path_output_dir():
+    p = get_suturo_blenderproc_path().joinpath("output")
+    p.mkdir(parents=True, exist_ok=True)
     return p
 
 
-def get_path_output_dir():
-    p = Path.cwd().joinpath(get_suturo_blenderproc_path(), "output")
-    if not p.exists():
-        Path(p).mkdir(parents=True)
+@lru_cache(maxsize=None)
+def get_path_pose_bank_dir():
+    p = get_suturo_blenderproc_path().joinpath("data", "pose_banks")
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def get_path_object_library(obj_source=None):
+    if obj_source is not None:
+        return Path(obj_source).expanduser()
+    return get_project_root().joinpath("blender_data/objects")
+
+
+@lru_cache(maxsize=None)
+def get_path_object_cache_dir():
+    p = get_project_root().joinpath("blender_data/object_cache")
+    p.mkdir(parents=True, exist_ok=True)
     return p
 
 
+@lru_cache(maxsize=None)
 def get_path_blender_scene(scene):
-    p = Path.cwd().joinpath(get_project_root(), "blender_data/scenes", scene)
+    p = get_project_root().joinpath("blender_data/scenes", scene)
     if not p.exists():
         print("Doesn't exist")
-        return Path.cwd().joinpath(get_project_root(), "blender_data/scenes", f"{scene}.blend")
+        return get_project_root().joinpath("blender_data/scenes", f"{scene}.blend")
 
     return p
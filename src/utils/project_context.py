@@ -0,0 +1,39 @@
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+from utils import path_utils
+from utils.yaml_config import YAMLConfig
+
+
+class ProjectContext(object):
+    """
+    Paths and config of a run, resolved and checked once per process. It only holds paths and the parsed config,
+    so it can be pickled to worker processes, which call activate instead of resolving everything again.
+    """
+
+    def __init__(self, config_name: str = None, output_dir=None):
+        self.src_dir = path_utils.get_project_src_dir()
+        self.project_root = path_utils.get_project_root()
+        self.config = YAMLConfig(filename=config_name) if config_name is not None else None
+        self.output_dir = Path(output_dir) if output_dir is not None else path_utils.get_path_output_dir()
+        self.id2name_path = path_utils.get_path_id2name_json()
+        self.pose_bank_dir = path_utils.get_path_pose_bank_dir()
+        self.blend_path = None
+        self.object_library = None
+        if self.config is not None:
+            self.blend_path = path_utils.get_path_blender_scene(self.config.get_scene())
+            if not self.blend_path.is_file():
+                raise Exception(f"Scene {self.config.get_scene()} doesn't exist in {self.blend_path.parent}")
+            self.object_library = path_utils.get_path_object_library(self.config.get_obj_source())
+
+    def activate(self):
+        """Makes the src dir importable, e.g. in a spawned worker that received the context."""
+        if str(self.src_dir) not in sys.path:
+            sys.path.append(str(self.src_dir))
+        return self
+
+
+@lru_cache(maxsize=None)
+def get_project_context(config_name: str = None, output_dir: str = None) -> ProjectContext:
+    return ProjectContext(config_name, output_dir)
@@ -1,30 +1,99 @@
+import numpy as np
 import yaml
 from utils import path_utils
 
 
+def _to_positions(value, name: str, dims: [int], errors: [str]) -> np.ndarray:
+    """Converts a list of positions, or a dict of named positions, to an (N, D) array."""
+    values = list(value.values()) if isinstance(value, dict) else value
+    try:
+        positions = np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        positions = None
+    if positions is not None and positions.size == 0:
+        return np.zeros(shape=(0, dims[-1]))
+    if positions is None or positions.ndim != 2 or positions.shape[1] not in dims:
+        errors.append(f"{name} has to be a list or dict of positions with {' or '.join(map(str, dims))} numbers")
+        return np.zeros(shape=(0, dims[-1]))
+    return positions
+
+
 class YAMLConfig(object):
-    def __init__(self, filename):
-        config = str(path_utils.get_path_yaml_config(filename))
-        with open(config, 'r') as stream:
-            data_loaded = yaml.safe_load(stream)
-        self._data = data_loaded
+    """
+    The user configuration, validated when it is loaded. All problems of a config are reported together, positions
+    are converted to NumPy arrays once. The config only holds plain data and arrays, so it is cheap to pickle.
+    """
+
+    def __init__(self, filename=None, data: dict = None):
+        if data is None:
+            config = str(path_utils.get_path_yaml_config(filename))
+            with open(config, 'r') as stream:
+                data = yaml.safe_load(stream) or {}
+        self._data = data
+        self._parse(filename)
+
+    def _parse(self, filename):
+        errors = []
+        data = self._data
+        self.scene = data.get('scene')
+        if not isinstance(self.scene, str) or not self.scene:
+            errors.append("scene has to be the name of a blend file")
+        self.objects = data.get('objects')
+        if not isinstance(self.objects, list) or not all(isinstance(o, str) for o in self.objects):
+            errors.append("objects has to be a list of class names")
+            self.objects = []
+
+        self.object_positions = _to_positions(data.get('object_positions') or [], "object_positions", [2, 3], errors)
+        self.camera_positions = _to_positions(data.get('camera_positions') or [], "camera_positions", [3], errors)
+        self.position_of_interest = None
+        if data.get('position_of_interest') is not None:
+            try:
+                self.position_of_interest = np.array(data['position_of_interest'], dtype=np.float64)
+            except (TypeError, ValueError):
+                pass
+            if self.position_of_interest is None or self.position_of_interest.shape != (3,):
+                errors.append("position_of_interest has to be a position with 3 numbers")
+                self.position_of_interest = None
+
+        for key in ['yolo_dataset', 'combine_with_existing_dataset']:
+            if not isinstance(data.get(key, False), bool):
+                errors.append(f"{key} has to be true or false")
+        if data.get('combine_with_existing_dataset', False) and not data.get('path_to_dataset_that_has_to_be_combined'):
+            errors.append("combine_with_existing_dataset needs path_to_dataset_that_has_to_be_combined")
+        if errors:
+            raise Exception(f"Invalid config {filename if filename is not None else 'data'}: " + "; ".join(errors))
 
     def print(self):
         print(self._data)
 
     def get_list_object_positions(self):
-        pos_dict = self._data['object_positions']
-        return [v for k, v in pos_dict.items()]
+        return self.object_positions
 
     def get_list_camera_positions(self):
-        locations_dict = self._data['camera_positions']
-        return [v for k, v in locations_dict.items()]
+        return self.camera_positions
 
     def get_position_of_interest(self):
-        return self._data['position_of_interest']
+        if self.position_of_interest is None:
+            raise Exception("The config has no position_of_interest")
+        return self.position_of_interest
 
     def get_objects(self):
-        return self._data['objects']
+        return self.objects
 
     def get_scene(self):
-        return self._data['scene']
+        return self.scene
+
+    def get_obj_source(self):
+        return self._data.get('obj_source')
+
+    def get_yolo_dataset(self):
+        return bool(self._data.get('yolo_dataset', False))
+
+    def get_yolo_save_path(self):
+        return self._data.get('yolo_save_path')
+
+    def get_combine_with_existing_dataset(self):
+        return bool(self._data.get('combine_with_existing_dataset', False))
+
+    def get_path_to_dataset_that_has_to_be_combined(self):
+        return self._data.get('path_to_dataset_that_has_to_be_combined')